@@ -1,8 +1,11 @@
+import datetime
 import functools
 import json
+import logging
 import operator
 import os
 import re
+import threading
 from urllib.parse import parse_qsl
 from urllib.parse import urlencode
 
@@ -10,37 +13,70 @@ from flask import Blueprint
 from flask import Response
 from flask import abort
 from flask import flash
+from flask import has_request_context
 from flask import redirect
 from flask import render_template
 from flask import request
+from flask import send_file
 from flask import session
 from flask import url_for
+from flask_peewee.exceptions import ConcurrentUpdateError
 from flask_peewee.filters import FilterForm
 from flask_peewee.filters import FilterMapping
 from flask_peewee.filters import FilterModelConverter
 from flask_peewee.forms import BaseModelConverter
 from flask_peewee.forms import AjaxSelectWidget
 from flask_peewee.forms import LimitedModelSelectField
+from flask_peewee.forms import ScopedModelHiddenField
 from flask_peewee.forms import ScopedModelSelectField
+from flask_peewee.search import ContainsSearch
 from flask_peewee.serializer import Serializer
+from flask_peewee.utils import CountedPaginatedQuery
+from flask_peewee.utils import KeysetPaginatedQuery
 from flask_peewee.utils import PaginatedQuery
-from flask_peewee.utils import alias_field
+from flask_peewee.utils import TTLCache
 from flask_peewee.utils import alias_join_path
+from flask_peewee.utils import bulk_update_changed
+from flask_peewee.utils import changed_fields
+from flask_peewee.utils import deserialize_datetime
 from flask_peewee.utils import get_next
+from flask_peewee.utils import get_table_estimate
+from flask_peewee.utils import get_table_size
 from flask_peewee.utils import order_query
 from flask_peewee.utils import path_to_models
+from flask_peewee.utils import save_changed
 from flask_peewee.utils import slugify
+from jinja2 import FileSystemBytecodeCache
+from peewee import CharField
+from peewee import DateField
+from peewee import DateTimeField
 from peewee import ForeignKeyField
-from peewee import JOIN
+from peewee import TextField
+from peewee import TimeField
 from werkzeug.datastructures import CombinedMultiDict
 from werkzeug.datastructures import Headers
 from wtforms import fields
-from wtfpeewee.fields import ModelHiddenField
+from wtforms import widgets
 from wtfpeewee.orm import model_form
 
 
 current_dir = os.path.dirname(__file__)
 
+logger = logging.getLogger(__name__)
+
+
+_missing = object()
+
+
+def get_instance_attr(obj, name):
+    # a column only resolvable on the instance itself, called if callable.
+    try:
+        attr = getattr(obj, name)
+    except AttributeError:
+        raise AttributeError('Could not find attribute or method named "%s".'
+                             % name)
+    return attr() if callable(attr) else attr
+
 
 class AdminModelConverter(BaseModelConverter):
     def __init__(self, model_admin, additional=None):
@@ -51,10 +87,12 @@ class AdminModelConverter(BaseModelConverter):
         if field.null:
             kwargs['allow_blank'] = True
 
-        if field.name in (self.model_admin.foreign_key_lookups or ()):
-            form_field = ModelHiddenField(model=field.rel_model, **kwargs)
+        # either way the submitted pk is checked with one primary-key lookup
+        # against the related admin's query.
+        query = self.model_admin.admin.get_query_for(field.rel_model)
+        if field.name in self.model_admin.get_foreign_key_lookups():
+            form_field = ScopedModelHiddenField(query=query, **kwargs)
         else:
-            query = self.model_admin.admin.get_query_for(field.rel_model)
             form_field = ScopedModelSelectField(query=query, **kwargs)
         return field.name, form_field
 
@@ -65,7 +103,7 @@ class AdminFilterModelConverter(FilterModelConverter):
         self.model_admin = model_admin
 
     def handle_foreign_key(self, model, field, **kwargs):
-        if field.name in (self.model_admin.foreign_key_lookups or ()):
+        if field.name in self.model_admin.get_foreign_key_lookups():
             data_source = url_for(self.model_admin.get_url_name('ajax_list'))
             kwargs['widget'] = AjaxSelectWidget(data_source, field.name)
         query = self.model_admin.admin.get_query_for(field.rel_model)
@@ -74,6 +112,13 @@ class AdminFilterModelConverter(FilterModelConverter):
 
 
 class Action(object):
+    # when every row matching the list's filters and search is selected, an
+    # action supporting queries is given their query by run_query(). others
+    # are given the matching ids, as a list, by run(), and refuse more than
+    # select_all_limit of them.
+    supports_query = False
+    select_all_limit = 1000
+
     def __init__(self, name=None, description=None):
         self.name = name or (type(self).__name__.replace('Action', ''))
         self.description = description or re.sub(r'[\-_]', ' ', self.name).title()
@@ -86,6 +131,278 @@ class Action(object):
         """
         raise NotImplementedError
 
+    def run(self, model_admin, id_list):
+        return self.callback(id_list)
+
+    def run_query(self, model_admin, query):
+        raise NotImplementedError
+
+    def get_id_list(self, model_admin, query):
+        # the matching ids in pk order, as the strings a form would post, or
+        # None when there are more than select_all_limit.
+        pk = model_admin.pk
+        id_list = [str(row[0]) for row in (query
+                   .select(pk)
+                   .order_by(pk)
+                   .limit(self.select_all_limit + 1)
+                   .tuples())]
+        if len(id_list) <= self.select_all_limit:
+            return id_list
+
+
+class ChunkedAction(Action):
+    """
+    An action over the selected rows' query rather than a list of ids, for
+    selections too large to load at once. process_chunk() receives the rows
+    in batches of chunk_size, read in primary-key order by keyset (pk > last
+    seen) and each processed in its own transaction. With a JobRunner, the
+    work runs in the background and its progress shows in that runner's
+    JobPanel.
+    """
+    chunk_size = 500
+    supports_query = True
+
+    def __init__(self, name=None, description=None, chunk_size=None,
+                 runner=None):
+        super(ChunkedAction, self).__init__(name, description)
+        self.chunk_size = chunk_size or self.chunk_size
+        self.runner = runner
+
+    def process_chunk(self, model_admin, rows):
+        raise NotImplementedError
+
+    def run(self, model_admin, id_list):
+        query = model_admin.get_query().where(model_admin.pk << id_list)
+        return self.run_query(model_admin, query)
+
+    def run_query(self, model_admin, query):
+        if self.runner is not None:
+            def job_fn(fileobj, job):
+                with model_admin.db.connection_context():
+                    job.total = query.order_by().count()
+                    self.process(model_admin, query, job)
+            self.runner.submit('%s %s' % (self.description,
+                                          model_admin.get_display_name()),
+                               None, job_fn, model_admin.admin.get_job_owner())
+            flash('%s queued. Progress appears on the dashboard.'
+                  % self.description, 'success')
+        else:
+            count = self.process(model_admin, query)
+            flash('%s: processed %s rows.' % (self.description, count),
+                  'success')
+
+    def process(self, model_admin, query, job=None):
+        pk = model_admin.pk
+        last = None
+        count = 0
+        while True:
+            batch = query.order_by(pk)
+            if last is not None:
+                batch = batch.where(pk > last)
+            with model_admin.db.atomic():
+                rows = list(batch.limit(self.chunk_size))
+                if not rows:
+                    break
+                self.process_chunk(model_admin, rows)
+            last = rows[-1]._pk
+            count += len(rows)
+            if job is not None:
+                job.progress = count
+        return count
+
+
+class InlineModelAdmin(object):
+    """
+    Edits the rows of a model that point at the parent through a foreign key,
+    as a table of forms on the parent's add and edit pages. List subclasses
+    in ModelAdmin.inlines.
+    """
+    model = None
+
+    # the foreign key to the parent. None picks the model's only one.
+    fk_name = None
+
+    # whitelist and blacklist of the child fields to edit, and per-field
+    # wtforms kwargs, as on ModelAdmin.
+    fields = None
+    exclude = None
+    field_args = None
+
+    # blank rows offered for adding children.
+    extra = 1
+    can_delete = True
+
+    form_converter = AdminModelConverter
+
+    def __init__(self, model_admin):
+        self.model_admin = model_admin
+        self.admin = model_admin.admin
+        self.fk = self.get_fk()
+        self.prefix = '%s_%s' % (slugify(self.model.__name__), self.fk.name)
+
+    def get_fk(self):
+        if self.fk_name:
+            return self.model._meta.fields[self.fk_name]
+        fks = [field for field in self.model._meta.sorted_fields
+               if isinstance(field, ForeignKeyField) and
+               field.rel_model is self.model_admin.model]
+        if len(fks) != 1:
+            raise ValueError('%s needs fk_name: %s has %d foreign keys to %s.' % (
+                type(self).__name__, self.model.__name__, len(fks),
+                self.model_admin.model.__name__))
+        return fks[0]
+
+    def get_display_name(self):
+        return self.model.__name__
+
+    def get_foreign_key_lookups(self):
+        # the child rows' own foreign keys always render as scoped selects.
+        return {}
+
+    def get_form(self):
+        exclude = [self.fk.name] + list(self.exclude or ())
+        return model_form(self.model,
+            only=self.fields,
+            exclude=exclude,
+            field_args=self.field_args,
+            converter=self.form_converter(self),
+        )
+
+    def get_query(self, parent):
+        return self.admin.get_query_for(self.model).where(self.fk == parent._pk)
+
+    def get_formset(self, parent, formdata=None):
+        return InlineFormSet(self, parent, formdata)
+
+
+class InlineFormSet(object):
+    """
+    The bound forms of one inline on one parent: a row per child, loaded with
+    a single query, plus `extra` blank rows. Rows are posted as
+    <prefix>-<n>-<field> with the child's pk in <prefix>-<n>-_pk and the
+    row count in <prefix>-TOTAL.
+    """
+    def __init__(self, inline, parent, formdata=None):
+        self.inline = inline
+        self.parent = parent
+        self.prefix = inline.prefix
+
+        children = []
+        if parent._pk is not None:
+            children = list(inline.get_query(parent))
+        Form = self.Form = inline.get_form()
+        self._blank_values = None
+
+        # each row is (form, instance, deleted).
+        self.rows = []
+        if formdata is None:
+            instances = children + [inline.model() for i in range(inline.extra)]
+            for i, obj in enumerate(instances):
+                form = Form(obj=obj, prefix=self.get_row_prefix(i))
+                self.rows.append((form, obj, False))
+            return
+
+        by_pk = dict((str(obj._pk), obj) for obj in children)
+        try:
+            total = int(formdata.get('%s-TOTAL' % self.prefix) or 0)
+        except ValueError:
+            total = 0
+        for i in range(min(total, len(children) + inline.extra)):
+            row_prefix = self.get_row_prefix(i)
+            pk = formdata.get(row_prefix + '_pk')
+            if pk:
+                # a pk that is not one of this parent's children is dropped.
+                if pk not in by_pk:
+                    continue
+                obj = by_pk[pk]
+            else:
+                obj = inline.model()
+            deleted = inline.can_delete and bool(formdata.get(row_prefix + '_delete'))
+            self.rows.append((Form(formdata, obj=obj, prefix=row_prefix), obj, deleted))
+
+    def get_row_prefix(self, i):
+        return '%s-%d-' % (self.prefix, i)
+
+    def get_rendered_value(self, field):
+        # what the browser posts for an input left as it was rendered: a
+        # select posts its selected option, or else its first one, and a
+        # checkbox posts nothing unless it was rendered ticked.
+        if field.type == 'BooleanField':
+            return bool(field.data)
+        if 'Select' in field.type:
+            first = None
+            for choice in field.iter_choices():
+                if choice[2]:
+                    return str(choice[0])
+                if first is None:
+                    first = str(choice[0])
+            return first
+        return field._value()
+
+    def get_posted_value(self, field):
+        if field.type == 'BooleanField':
+            return bool(field.raw_data)
+        return field.raw_data[0] if field.raw_data else ''
+
+    def get_blank_values(self):
+        if self._blank_values is None:
+            fields = self.inline.model._meta.fields
+            blank = self.Form(obj=self.inline.model())
+            # a callable default, like datetime.now, renders differently from
+            # one request to the next, so it can't tell a row was left blank.
+            self._blank_values = dict(
+                (field.name, self.get_rendered_value(field))
+                for field in blank
+                if not callable(getattr(fields.get(field.name), 'default', None)))
+        return self._blank_values
+
+    def is_blank(self, form):
+        # a new row whose inputs all still post their default.
+        for name, value in self.get_blank_values().items():
+            if self.get_posted_value(form[name]) != value:
+                return False
+        return True
+
+    def get_active_rows(self):
+        for form, obj, deleted in self.rows:
+            if not deleted and not (obj._pk is None and self.is_blank(form)):
+                yield form, obj
+
+    def validate(self):
+        # validate every row, so each one carries its errors.
+        results = [form.validate() for form, obj in self.get_active_rows()]
+        return all(results)
+
+    def save(self, parent):
+        """
+        Write the rows: one DELETE for the removed children, one INSERT for
+        the new ones and, for the children that changed, one UPDATE per set
+        of changed columns. Unchanged children are not written.
+        """
+        model = self.inline.model
+        inserts = []
+        updates = []
+        for form, obj in self.get_active_rows():
+            before = dict(obj.__data__)
+            form.populate_obj(obj)
+            if obj._pk is None:
+                setattr(obj, self.inline.fk.name, parent)
+                inserts.append(obj)
+            else:
+                updates.append((obj, changed_fields(obj, before)))
+
+        deleted = [obj._pk for form, obj, is_deleted in self.rows
+                   if is_deleted and obj._pk is not None]
+        if deleted:
+            (model
+             .delete()
+             .where((model._meta.primary_key << deleted) &
+                    (self.inline.fk == parent._pk))
+             .execute())
+        if inserts:
+            model.insert_many([obj.__data__ for obj in inserts]).execute()
+        bulk_update_changed(model, updates)
+
 
 class ModelAdmin(object):
     """
@@ -94,19 +411,50 @@ class ModelAdmin(object):
     paginate_by = 20
     filter_paginate_by = 15
 
+    # how the index counts its rows for pagination. 'exact' runs a COUNT,
+    # 'capped' counts at most count_cap rows ("10,000+"), and 'estimate'
+    # reads the table statistics when the list is unfiltered (falling back
+    # to 'capped' otherwise). count_cache_timeout, in seconds, caches counts
+    # per filter and search signature so paging does not re-count.
+    count_mode = 'exact'
+    count_cap = 10000
+    count_cache_timeout = None
+
+    # 'offset' pages the index by number. 'keyset' seeks on the ordering
+    # column plus the primary key instead, so a page deep into a large table
+    # is as cheap as the first, with next/previous links and a box to jump
+    # to a value of the ordering column in place of page numbers. its count
+    # is capped at count_cap, even with count_mode 'exact'.
+    pagination = 'offset'
+
     # columns to display in the list index - can be field names, model
     # attributes, or callables on a model instance or the ModelAdmin.
     columns = None
 
+    # columns edited in place on the index. the changed cells of a page are
+    # saved together, validated row by row.
+    list_editable = None
+
     # exclude certian fields from being exposed as filters -- for related fields
     # use "__" notation, e.g. user__password
     filter_exclude = None
     filter_fields = None
 
+    # boolean or choices field names whose values the index lists beside the
+    # filters, each with the number of rows it would match under the other
+    # filters and search. one GROUP BY per field, cached for
+    # facet_cache_timeout seconds per filter and search signature.
+    facet_fields = None
+    facet_cache_timeout = 10
+
     # char/text field names for the quick-search box. supports "__" traversal
     # into related models, e.g. 'user__username'. empty -> no search box.
     search_fields = None
 
+    # how the search term matches search_fields, a flask_peewee.search
+    # SearchBackend instance. None means ContainsSearch (LIKE '%term%').
+    search_backend = None
+
     # max related-model hops when auto-building the filter and export field
     # trees, so a long or densely linked fk graph cannot explode them.
     max_filter_depth = 3
@@ -133,12 +481,42 @@ class ModelAdmin(object):
     # User-defined bulk actions. List or tuple of Action instances.
     actions = None
 
+    # InlineModelAdmin subclasses, editing related rows on the add and edit
+    # pages.
+    inlines = None
+
+    # an integer field used for optimistic concurrency. it is carried through
+    # the edit form in a hidden input, and saving over a row someone else
+    # changed in the meantime fails instead of overwriting their edit.
+    version_field = None
+
+    # fields whose changes the admin's audit log records without their
+    # values, e.g. a password hash.
+    audit_exclude = None
+
     # foreign_key_field --> related field to search on, e.g. {'user': 'username'}
     foreign_key_lookups = None
 
-    # delete behavior
+    # how the lookup picker's term matches the related field, a SearchBackend
+    # (PrefixSearch can use an index). None means ContainsSearch. the picker's
+    # results are cached for ajax_cache_timeout seconds, to absorb bursts of
+    # typeahead requests.
+    ajax_search_backend = None
+    ajax_cache_timeout = None
+
+    # a foreign key not in foreign_key_lookups renders as a <select> of every
+    # related row. once the related admin's query holds more rows than this,
+    # the field switches to the lookup picker on the related model's first
+    # char/text field. None, the default, always keeps the <select>.
+    foreign_key_select_limit = None
+
+    # delete behavior. rows are deleted delete_chunk_size at a time, each
+    # chunk in a transaction, and when every matching row is selected the
+    # confirmation lists only the first delete_preview_limit.
     delete_collect_objects = True
     delete_recursive = True
+    delete_chunk_size = 500
+    delete_preview_limit = 100
 
     # restrict which fields may be exported. export_fields is a whitelist of
     # field names, export_exclude a blacklist. Related models are restricted
@@ -146,6 +524,12 @@ class ModelAdmin(object):
     export_fields = None
     export_exclude = None
 
+    # a flask_peewee.jobs.JobRunner. when set, the export page offers to run
+    # the export in the background and write a gzip file instead of streaming
+    # the response, for exports that outlast a proxy timeout. register a
+    # JobPanel with the same runner to list the jobs and their downloads.
+    export_runner = None
+
     filter_mapping = FilterMapping
     filter_converter = AdminFilterModelConverter
 
@@ -170,9 +554,65 @@ class ModelAdmin(object):
         self.action_map = dict((action.name, action)
                                for action in (self.actions or ()))
 
+        self.count_cache = None
+        if self.count_cache_timeout:
+            self.count_cache = TTLCache(self.count_cache_timeout)
+        self.facet_cache = None
+        if self.facet_cache_timeout:
+            self.facet_cache = TTLCache(self.facet_cache_timeout)
+        self.ajax_cache = None
+        if self.ajax_cache_timeout:
+            self.ajax_cache = TTLCache(self.ajax_cache_timeout)
+
+        # related table sizes, re-checked once a minute.
+        self.relation_size_cache = TTLCache(60)
+
+        self.inline_instances = [inline(self) for inline in self.inlines or ()]
+
+        # column and readonly names resolved to accessors once, up front.
+        self._accessors = {}
+        for name in list(self.columns or ()) + list(self.readonly_fields or ()):
+            self.get_accessor(name)
+
     def get_template_overrides(self):
         return {}
 
+    def get_paginated_query(self, query, paginate_by=None, ordering=None):
+        estimate = None
+        if self.count_mode == 'estimate' and query._where is None:
+            estimate = functools.partial(get_table_estimate, self.model)
+        # keyset pages exist to avoid scanning the table, so an exact count
+        # is capped there too.
+        count_cap = None
+        if self.count_mode != 'exact' or self.pagination == 'keyset':
+            count_cap = self.count_cap
+        kwargs = dict(count_cap=count_cap, estimate=estimate,
+                      cache=self.count_cache)
+        paginate_by = paginate_by or self.paginate_by
+        if self.pagination == 'keyset' and ordering is not None:
+            field, descending = self.get_keyset_ordering(ordering)
+            if field is not None:
+                return KeysetPaginatedQuery(
+                    query, paginate_by, field, descending,
+                    name=ordering.lstrip('-') or None, **kwargs)
+        return CountedPaginatedQuery(query, paginate_by, **kwargs)
+
+    def get_keyset_ordering(self, ordering):
+        # (field, descending) to seek on for the requested ordering, the
+        # primary key when there is none. a nullable column cannot be sought
+        # on reliably, so (None, False) falls back to numbered pages.
+        column = ordering.lstrip('-')
+        if not column or not self.column_is_sortable(column):
+            return self.pk, False
+        field = self.model._meta.fields[column]
+        if field.null:
+            return None, False
+        return field, ordering.startswith('-')
+
+    def get_total_display(self):
+        # the record count shown on the tabs and the dashboard.
+        return self.get_paginated_query(self.get_query()).get_count_display()
+
     def get_url_name(self, name):
         return '%s.%s_%s' % (
             self.admin.blueprint.name,
@@ -195,6 +635,31 @@ class ModelAdmin(object):
         form, query, cleaned = filter_form.process_request(query)
         return form, query, cleaned, filter_form._field_tree
 
+    def get_facets(self):
+        # the facet_fields' value counts for the filters and search in the
+        # request, each value with the url that filters on it (or, for the
+        # value already filtered on, the url that drops that filter).
+        if not self.facet_fields:
+            return []
+        filter_form = self.get_filter_form()
+        query = self.apply_search(self.get_query(), request.args.get('q'))
+        facet_fields = [self.model._meta.fields[name]
+                        for name in self.facet_fields]
+        facets = filter_form.get_facets(query, facet_fields, self.facet_cache)
+        for facet in facets:
+            name = facet['field'].name
+            op = filter_form.field_operation_prefix + name
+            var = filter_form.field_value_prefix + name
+            for item in facet['values']:
+                item['active'] = (request.args.get(op) == 'eq' and
+                                  request.args.get(var) == item['param'])
+                if item['active']:
+                    item['url'] = './?' + self.get_matching_args(op, var)
+                else:
+                    item['url'] = './?' + self.get_matching_args(
+                        **{op: 'eq', var: item['param']})
+        return facets
+
     def get_form(self, adding=False):
         allow_pk = adding and not self.model._meta.auto_increment
         only, exclude = self.fields, self.exclude
@@ -213,13 +678,136 @@ class ModelAdmin(object):
             allow_pk=allow_pk,
             only=only,
             exclude=exclude,
-            field_args=self.field_args,
+            field_args=self.get_field_args(),
             converter=self.form_converter(self),
         )
 
+    def get_field_args(self):
+        # the version travels with the form, hidden, so a save can tell
+        # whether the row changed since the form was rendered.
+        field_args = self.field_args
+        if self.version_field:
+            field_args = dict(field_args or {})
+            field_args[self.version_field] = dict(
+                field_args.get(self.version_field) or {},
+                widget=widgets.HiddenInput())
+        return field_args
+
     def get_add_form(self):
         return self.get_form(adding=True)
 
+    def get_list_form(self):
+        # a form of just the list_editable fields, and the version field,
+        # bound once per row.
+        only = list(self.list_editable)
+        if self.version_field:
+            only.append(self.version_field)
+        return model_form(self.model,
+            only=only,
+            field_args=self.get_field_args(),
+            converter=self.form_converter(self),
+        )
+
+    def get_list_prefix(self, obj):
+        return 'row-%s-' % obj._pk
+
+    def save_list_edits(self):
+        """
+        Save the cells edited on the index. When a row fails validation, or
+        was changed by someone else, nothing is written, and the bound forms
+        of every submitted row are returned, keyed by pk, to render the page
+        again with the input kept. Otherwise each row is saved with
+        save_model(), as the edit view saves it, in one transaction, and {}
+        is returned.
+        """
+        Form = self.get_list_form()
+        pks = request.form.getlist('_list_pk')
+        forms = {}
+        rows = []
+        errors = 0
+        for obj in self.get_query().where(self.pk << pks):
+            form = Form(request.form, obj=obj, prefix=self.get_list_prefix(obj))
+            forms[str(obj._pk)] = form
+            if not form.validate():
+                errors += 1
+                continue
+            rows.append((obj, form))
+
+        if errors:
+            flash('Changes were not saved, %d row%s had errors.' % (
+                errors, errors != 1 and 's' or ''), 'danger')
+            return forms
+
+        count = 0
+        try:
+            with self.atomic():
+                for obj, form in rows:
+                    before = dict(obj.__data__)
+                    self.save_model(obj, form)
+                    if obj.__data__ != before:
+                        count += 1
+        except ConcurrentUpdateError:
+            flash('Changes were not saved, a %s was changed by someone else. '
+                  'Reload the page to see their changes.' %
+                  self.get_display_name(), 'danger')
+            return forms
+        flash('%d %s%s updated.' % (count, self.get_display_name(),
+                                    count != 1 and 's' or ''), 'success')
+        return {}
+
+    def get_form_field_names(self):
+        readonly = self.readonly_fields or ()
+        return [f.name for f in self.model._meta.sorted_fields
+                if (not self.fields or f.name in self.fields) and
+                f.name not in (self.exclude or ()) and f.name not in readonly]
+
+    def get_relation_size(self, rel_model):
+        # the related admin's row count, capped just past the select limit so
+        # sizing a huge table costs no more than sizing a small one.
+        # cached under the compiled query, so a get_query() scoped to the
+        # user never serves one user's count to another.
+        limit = self.foreign_key_select_limit
+        query = self.admin.get_query_for(rel_model).order_by().limit(limit + 1)
+        sql, params = query.sql()
+        key = (sql, tuple(params))
+        size = self.relation_size_cache.get(key)
+        if size is None:
+            size = query.count()
+            self.relation_size_cache.set(key, size)
+        return size
+
+    def get_lookup_field_for(self, rel_model):
+        for field in rel_model._meta.sorted_fields:
+            if isinstance(field, (CharField, TextField)) and not field.primary_key:
+                return field.name
+
+    def get_foreign_key_lookups(self):
+        """
+        foreign_key_lookups, plus an entry for each foreign key on the form
+        whose related table has outgrown foreign_key_select_limit. Worked out
+        once per request, however many form fields and templates ask.
+        """
+        if not has_request_context():
+            return self.collect_foreign_key_lookups()
+        cache = request.environ.setdefault('flask_peewee.fk_lookups', {})
+        if self not in cache:
+            cache[self] = self.collect_foreign_key_lookups()
+        return cache[self]
+
+    def collect_foreign_key_lookups(self):
+        lookups = dict(self.foreign_key_lookups or {})
+        limit = self.foreign_key_select_limit
+        if limit is None:
+            return lookups
+        for name in self.get_form_field_names():
+            field = self.model._meta.fields[name]
+            if not isinstance(field, ForeignKeyField) or name in lookups:
+                continue
+            lookup_field = self.get_lookup_field_for(field.rel_model)
+            if lookup_field and self.get_relation_size(field.rel_model) > limit:
+                lookups[name] = lookup_field
+        return lookups
+
     def get_edit_form(self, instance):
         return self.get_form()
 
@@ -241,7 +829,7 @@ class ModelAdmin(object):
                     accum.append((
                         None,
                         self.admin.get_verbose_name(self.model, name),
-                        self.admin.get_model_field(instance, name)))
+                        self.get_column_value(instance, name)))
             return accum
 
         # form fields and readonly names interleaved in model-field order,
@@ -283,6 +871,33 @@ class ModelAdmin(object):
     def get_columns(self):
         return self.model._meta.sorted_field_names
 
+    def make_accessor(self, name):
+        """
+        Resolve a column name to a function of the row instance: a field, a
+        model attribute or method, else a method of this ModelAdmin taking the
+        instance. A name found on neither is looked up on each instance.
+        """
+        if name in self.model._meta.fields:
+            return operator.attrgetter(name)
+        attr = getattr(self.model, name, _missing)
+        if attr is not _missing:
+            if callable(attr):
+                return operator.methodcaller(name)
+            return operator.attrgetter(name)
+        attr = getattr(self, name, None)
+        if callable(attr):
+            return attr
+        return functools.partial(get_instance_attr, name=name)
+
+    def get_accessor(self, name):
+        accessor = self._accessors.get(name)
+        if accessor is None:
+            accessor = self._accessors[name] = self.make_accessor(name)
+        return accessor
+
+    def get_column_value(self, obj, name):
+        return self.get_accessor(name)(obj)
+
     def column_is_sortable(self, col):
         return col in self.model._meta.fields
 
@@ -293,8 +908,60 @@ class ModelAdmin(object):
         return slugify(self.model.__name__)
 
     def save_model(self, instance, form, adding=False):
+        before = dict(instance.__data__)
         form.populate_obj(instance)
-        instance.save(force_insert=adding)
+        if adding:
+            instance.save(force_insert=True)
+        else:
+            # only the changed columns are written, if any.
+            save_changed(instance, before, self.version_field)
+        self.log_save(instance, before, adding)
+        return instance
+
+    def get_changes(self, before, after):
+        # {field name: [old, new]} for the columns that differ.
+        exclude = self.audit_exclude or ()
+        accum = {}
+        for field in self.model._meta.sorted_fields:
+            old, new = before.get(field.name), after.get(field.name)
+            if old != new:
+                accum[field.name] = [None, None] if field.name in exclude else [old, new]
+        return accum
+
+    def log_change(self, action, obj=None, data=None):
+        audit_log = self.admin.audit_log
+        if audit_log is not None:
+            audit_log.record(
+                self.get_admin_name(),
+                action,
+                obj._pk if obj is not None else None,
+                data,
+                self.admin.auth.get_logged_in_user())
+
+    def log_save(self, instance, before, adding=False):
+        if adding:
+            self.log_change('add', instance, self.get_changes({}, instance.__data__))
+        else:
+            changes = self.get_changes(before, instance.__data__)
+            if changes:
+                self.log_change('edit', instance, changes)
+
+    def get_inline_formsets(self, instance, formdata=None):
+        return [inline.get_formset(instance, formdata)
+                for inline in self.inline_instances]
+
+    def atomic(self):
+        # a transaction whose audit entries are recorded once it commits.
+        if self.admin.audit_log is not None:
+            return self.admin.audit_log.atomic(self.db)
+        return self.db.atomic()
+
+    def save_with_inlines(self, instance, form, formsets, adding=False):
+        # the parent and its inline children are written in one transaction.
+        with self.atomic():
+            instance = self.save_model(instance, form, adding)
+            for formset in formsets:
+                formset.save(instance)
         return instance
 
     def apply_ordering(self, query, ordering):
@@ -318,23 +985,14 @@ class ModelAdmin(object):
             model = fk.rel_model
         return model._meta.fields[parts[-1]], fks
 
+    def get_search_backend(self):
+        return self.search_backend or ContainsSearch()
+
     def apply_search(self, query, term):
         term = (term or '').strip()
-        search_fields = self.get_search_fields()
-        if not term or not search_fields:
+        if not term or not self.get_search_fields():
             return query
-
-        # search LEFT OUTER joins each path so a row whose foreign key is null
-        # still appears when it matches a direct field. filters INNER join.
-        alias_map = {}
-        clauses = []
-        for name in search_fields:
-            field, fks = self._resolve_search_field(name)
-            query, field = alias_field(
-                query, self.model, fks, field, alias_map, JOIN.LEFT_OUTER)
-            clauses.append(field.contains(term))
-
-        return query.where(functools.reduce(operator.or_, clauses))
+        return self.get_search_backend().apply(self, query, term)
 
     def get_form_data(self):
         # combine files with form data so file-upload fields (e.g. blobs)
@@ -344,21 +1002,50 @@ class ModelAdmin(object):
         return request.form
 
     def index(self):
-        if request.method == 'POST':
+        list_forms = {}
+        if request.method == 'POST' and '_save_list' in request.form:
+            list_forms = self.save_list_edits()
+            if not list_forms:
+                return self._index_redirect()
+        elif request.method == 'POST':
+            # with select_all the rows are those matching the filters, search
+            # and ordering in the query string the list was posted to.
             id_list = request.form.getlist('id')
+            select_all = bool(request.form.get('select_all'))
             action = request.form['action']
             if action == 'delete':
+                if select_all:
+                    return redirect(self.get_matching_url('delete', select_all=1))
                 return redirect(url_for(self.get_url_name('delete'), id=id_list))
             elif action == 'export':
+                if select_all:
+                    return redirect(self.get_matching_url('export'))
                 return redirect(url_for(self.get_url_name('export'), id=id_list))
             elif action in self.action_map:
-                if not id_list:
-                    flash('Please select one or more rows.', 'warning')
+                action_obj = self.action_map[action]
+                # logged once the action has run, not if it fails.
+                maybe_response = None
+                if select_all and action_obj.supports_query:
+                    maybe_response = action_obj.run_query(
+                        self, self.get_matching_query())
+                    self.log_change(action, data={
+                        'matching': self.get_matching_args()})
                 else:
-                    action_obj = self.action_map[action]
-                    maybe_response = action_obj.callback(id_list)
-                    if isinstance(maybe_response, Response):
-                        return maybe_response
+                    if select_all:
+                        id_list = action_obj.get_id_list(
+                            self, self.get_matching_query())
+                    if id_list is None:
+                        flash('%s acts on at most %d rows at once, please '
+                              'narrow the selection.' % (
+                                  action_obj.description,
+                                  action_obj.select_all_limit), 'danger')
+                    elif not id_list:
+                        flash('Please select one or more rows.', 'warning')
+                    else:
+                        maybe_response = action_obj.run(self, id_list)
+                        self.log_change(action, data={'id': id_list})
+                if isinstance(maybe_response, Response):
+                    return maybe_response
             else:
                 flash('Unknown action: "%s".' % action, 'danger')
             return self._index_redirect()
@@ -376,20 +1063,88 @@ class ModelAdmin(object):
         query = self.apply_search(query, search_query)
 
         # create a paginated query out of our filtered results
-        pq = PaginatedQuery(query, self.paginate_by)
+        pq = self.get_paginated_query(query, ordering=ordering)
 
         return render_template(self.templates['index'],
             admin=self.admin,
             model_admin=self,
             query=pq,
+            keyset=isinstance(pq, KeysetPaginatedQuery),
+            list_form=self.list_editable and self.get_list_form() or None,
+            list_forms=list_forms,
             ordering=ordering,
             search_query=search_query,
             filter_form=filter_form,
             field_tree=field_tree,
             active_filters=cleaned,
+            facets=self.get_facets(),
             **self.get_extra_context()
         )
 
+    def select_matching(self, query):
+        # the rows whose pk `query` selects, so its filter and search joins
+        # stay in a subquery the database runs, and the rows are the model's
+        # alone: WHERE pk IN (SELECT pk ...).
+        return self.model.select().where(
+            self.pk.in_(query.order_by().select(self.pk)))
+
+    def get_matching_query(self):
+        # every row the index lists for the filters, search and ordering in
+        # the request's query string, across all pages.
+        filter_form, query, cleaned, field_tree = self.process_filters(
+            self.get_query())
+        query = self.apply_search(query, request.args.get('q'))
+        return self.apply_ordering(self.select_matching(query),
+                                   request.args.get('ordering') or '')
+
+    def get_matching_args(self, *drop, **extra):
+        # the query string of that selection, less the page position and any
+        # `drop` parameters.
+        position = ('page', 'after', 'before', 'jump') + drop
+        args = [(k, v) for k, v in request.args.items(multi=True)
+                if k not in position and k not in extra]
+        args.extend(extra.items())
+        return urlencode(args)
+
+    def get_matching_url(self, name, **extra):
+        return '%s?%s' % (url_for(self.get_url_name(name)),
+                          self.get_matching_args(**extra))
+
+    def delete_rows(self, query):
+        # in primary-key order, a chunk per transaction, so a large selection
+        # is never loaded at once. each chunk is one DELETE of the pks read
+        # for it, unless rows referencing it must be deleted row by row. the
+        # pks are read first, as mysql can't delete from a subquery of the
+        # same table, and only an audit log needs whole rows.
+        recursive = self.delete_recursive and bool(self.model._meta.backrefs)
+        load_rows = recursive or self.admin.audit_log is not None
+        count = 0
+        last = None
+        while True:
+            batch = query.order_by(self.pk)
+            if last is not None:
+                batch = batch.where(self.pk > last)
+            if not load_rows:
+                batch = batch.select(self.pk)
+            with self.atomic():
+                rows = list(batch.limit(self.delete_chunk_size))
+                if not rows:
+                    break
+                if recursive:
+                    for obj in rows:
+                        obj.delete_instance(recursive=True)
+                else:
+                    (self.model.delete()
+                     .where(self.pk << [obj._pk for obj in rows])
+                     .execute())
+                if self.admin.audit_log is not None:
+                    for obj in rows:
+                        self.log_change('delete', obj,
+                                        self.get_changes(obj.__data__, {}))
+            last = rows[-1]._pk
+            count += len(rows)
+        return count
+
     def _index_redirect(self):
         url = (session.get('%s.index' % self.get_admin_name()) or
                url_for(self.get_url_name('index')))
@@ -411,18 +1166,22 @@ class ModelAdmin(object):
 
         if request.method == 'POST':
             form = Form(self.get_form_data())
-            if form.validate():
-                instance = self.save_model(instance, form, True)
+            formsets = self.get_inline_formsets(instance, self.get_form_data())
+            valid = [form.validate()] + [fs.validate() for fs in formsets]
+            if all(valid):
+                instance = self.save_with_inlines(instance, form, formsets, True)
                 flash('New %s saved successfully' % self.get_display_name(), 'success')
                 return self.dispatch_save_redirect(instance)
         else:
             form = Form()
+            formsets = self.get_inline_formsets(instance)
 
         return render_template(self.templates['add'],
             admin=self.admin,
             model_admin=self,
             form=form,
             instance=instance,
+            inline_formsets=formsets,
             **self.get_extra_context()
         )
 
@@ -436,18 +1195,28 @@ class ModelAdmin(object):
 
         if request.method == 'POST':
             form = Form(self.get_form_data(), obj=instance)
-            if form.validate():
-                self.save_model(instance, form, False)
-                flash('Changes to %s saved successfully' % self.get_display_name(), 'success')
-                return self.dispatch_save_redirect(instance)
+            formsets = self.get_inline_formsets(instance, self.get_form_data())
+            valid = [form.validate()] + [fs.validate() for fs in formsets]
+            if all(valid):
+                try:
+                    self.save_with_inlines(instance, form, formsets, False)
+                except ConcurrentUpdateError:
+                    flash('This %s was changed by someone else while you were '
+                          'editing it. Reload the page to see their changes.' %
+                          self.get_display_name(), 'danger')
+                else:
+                    flash('Changes to %s saved successfully' % self.get_display_name(), 'success')
+                    return self.dispatch_save_redirect(instance)
         else:
             form = Form(obj=instance)
+            formsets = self.get_inline_formsets(instance)
 
         return render_template(self.templates['edit'],
             admin=self.admin,
             model_admin=self,
             instance=instance,
             form=form,
+            inline_formsets=formsets,
             **self.get_extra_context()
         )
 
@@ -464,26 +1233,32 @@ class ModelAdmin(object):
         return sorted(objects, key=lambda i: i[1].__name__)
 
     def delete(self):
-        if request.method == 'GET':
-            id_list = request.args.getlist('id')
+        select_all = bool(request.args.get('select_all'))
+        if select_all:
+            # the filters, search and ordering ride along in the query string
+            # rather than as a list of ids.
+            query = self.get_matching_query()
         else:
-            id_list = request.form.getlist('id')
+            if request.method == 'GET':
+                id_list = request.args.getlist('id')
+            else:
+                id_list = request.form.getlist('id')
 
-        # honor get_query() so a scoped admin only deletes, and on the GET
-        # confirmation page only discloses, rows the user is allowed to see.
-        query = self.get_query().where(self.pk << id_list)
+            # honor get_query() so a scoped admin only deletes, and on the GET
+            # confirmation page only discloses, rows the user is allowed to see.
+            query = self.get_query().where(self.pk << id_list)
 
         if request.method == 'GET':
+            count = query.order_by().count()
+            if select_all:
+                query = query.limit(self.delete_preview_limit)
             collected = {}
             if self.delete_collect_objects:
                 for obj in query:
                     collected[obj._pk] = self.collect_objects(obj)
 
         elif request.method == 'POST':
-            count = query.count()
-            for obj in query:
-                obj.delete_instance(recursive=self.delete_recursive)
-
+            count = self.delete_rows(query)
             flash('Successfully deleted %s %ss' % (count, self.get_display_name()), 'success')
             return self._index_redirect()
 
@@ -491,6 +1266,8 @@ class ModelAdmin(object):
             admin=self.admin,
             model_admin=self,
             query=query,
+            count=count,
+            select_all=select_all,
             collected=collected,
             **self.get_extra_context()
         ))
@@ -545,13 +1322,12 @@ class ModelAdmin(object):
         return allowed
 
     def export(self):
-        query = self.get_query()
-
-        ordering = request.args.get('ordering') or ''
-        query = self.apply_ordering(query, ordering)
-
         # process the filters from the request
-        filter_form, query, cleaned, field_tree = self.process_filters(query)
+        filter_form, query, cleaned, field_tree = self.process_filters(
+            self.get_query())
+        query = self.apply_search(query, request.args.get('q'))
+        query = self.apply_ordering(self.select_matching(query),
+                                    request.args.get('ordering') or '')
         related = self.collect_related_fields(self.model, {}, [])
 
         # check for raw id
@@ -571,6 +1347,8 @@ class ModelAdmin(object):
                 # it would dump excluded columns such as the password hash.
                 raw_fields = [self.pk.name]
             export = Export(query, related, raw_fields)
+            if request.form.get('background') and self.export_runner is not None:
+                return self.export_in_background(export)
             return export.json_response('export-%s.json' % self.get_admin_name())
 
         return render_template(self.templates['export'],
@@ -587,13 +1365,62 @@ class ModelAdmin(object):
             **self.get_extra_context()
         )
 
+    def export_in_background(self, export):
+        # the Export was prepared (and its fields checked against the
+        # allowlist) in this request. the worker only streams it to a file.
+        filename = 'export-%s-%s.json.gz' % (
+            self.get_admin_name(),
+            datetime.datetime.now().strftime('%Y%m%d%H%M%S'))
+        self.export_runner.submit(
+            'Export %s' % self.get_display_name(), filename, export.write,
+            self.admin.get_job_owner())
+        flash('Export of %s queued. The download link appears on the '
+              'dashboard when it is ready.' % self.get_display_name(), 'success')
+        return redirect(url_for(self.admin.get_url_name('index')))
+
+    def get_ajax_search_backend(self):
+        return self.ajax_search_backend or ContainsSearch()
+
+    def dump_ajax_cursor(self, value, pk):
+        convert = Serializer().convert_value
+        return json.dumps([convert(value), convert(pk)])
+
+    def load_ajax_cursor(self, cursor, rel_field):
+        try:
+            value, pk = json.loads(cursor)
+            if value is not None and isinstance(
+                    rel_field, (DateField, DateTimeField, TimeField)):
+                value = deserialize_datetime(rel_field, value)
+        except (TypeError, ValueError):
+            return None
+        return value, pk
+
+    def get_ajax_results(self, query, rel_field):
+        # (id, repr, cursor) per row. cached by the compiled query, which
+        # covers the field, term, position and the related admin's scoping.
+        key = None
+        if self.ajax_cache is not None:
+            sql, params = query.sql()
+            key = (sql, tuple(params))
+            results = self.ajax_cache.get(key)
+            if results is not None:
+                return results
+
+        results = [(obj._pk, str(obj),
+                    self.dump_ajax_cursor(getattr(obj, rel_field.name), obj._pk))
+                   for obj in query]
+        if key is not None:
+            self.ajax_cache.set(key, results)
+        return results
+
     def ajax_list(self):
         field_name = request.args.get('field')
         prev_page = 0
         next_page = 0
+        next_after = None
 
         data = []
-        lookups = self.foreign_key_lookups or {}
+        lookups = self.get_foreign_key_lookups()
         try:
             models = path_to_models(self.model, field_name)
         except (AttributeError, TypeError):
@@ -604,27 +1431,58 @@ class ModelAdmin(object):
             field = self.model._meta.fields[field_name]
             rel_model = models.pop()
             rel_field = rel_model._meta.fields[lookups[field_name]]
+            rel_pk = rel_model._meta.primary_key
             # enumerate candidates through the related admin's get_query() so the
-            # picker respects that admin's row visibility.
-            query = self.admin.get_query_for(rel_model).order_by(rel_field)
+            # picker respects that admin's row visibility. the pk breaks ties so
+            # the order, and so the keyset cursor, is total. a nullable lookup
+            # field puts its NULLs last explicitly, as databases disagree on
+            # where they sort.
+            ordering = [rel_field, rel_pk]
+            if rel_field.null:
+                ordering.insert(0, rel_field.is_null())
+            query = self.admin.get_query_for(rel_model).order_by(*ordering)
             query_string = request.args.get('query')
             if query_string:
-                query = query.where(rel_field.contains(query_string))
-
-            pq = PaginatedQuery(query, self.filter_paginate_by)
-            current_page = pq.get_page()
-            if current_page > 1:
-                prev_page = current_page - 1
-            if current_page < pq.get_pages():
-                next_page = current_page + 1
+                backend = self.get_ajax_search_backend()
+                query = query.where(backend.match(rel_field, query_string))
+
+            # "load more" seeks past the last row sent (keyset), while page=N
+            # still works for older clients. neither counts the matches: one
+            # extra row tells whether there is more.
+            paginate_by = self.filter_paginate_by
+            after = self.load_ajax_cursor(request.args.get('after'), rel_field)
+            if after is not None:
+                value, pk = after
+                if value is None:
+                    # within the trailing NULLs, which no comparison matches.
+                    query = query.where(rel_field.is_null() & (rel_pk > pk))
+                else:
+                    seek = (rel_field > value) | ((rel_field == value) & (rel_pk > pk))
+                    if rel_field.null:
+                        seek |= rel_field.is_null()
+                    query = query.where(seek)
+                current_page = None
+            else:
+                current_page = PaginatedQuery(query, paginate_by).get_page()
+                query = query.offset((current_page - 1) * paginate_by)
+                if current_page > 1:
+                    prev_page = current_page - 1
+
+            results = self.get_ajax_results(query.limit(paginate_by + 1), rel_field)
+            if len(results) > paginate_by:
+                results = results[:paginate_by]
+                next_after = results[-1][2]
+                if current_page is not None:
+                    next_page = current_page + 1
 
             # if the field is nullable, include the "None" option at the top.
-            if field.null:
+            if field.null and current_page == 1:
                 data.append({'id': '__None', 'repr': 'None'})
 
-            data.extend([{'id': obj._pk, 'repr': str(obj)} for obj in pq.get_list()])
+            data.extend([{'id': pk, 'repr': text} for pk, text, _ in results])
 
-        json_data = json.dumps({'prev_page': prev_page, 'next_page': next_page, 'object_list': data})
+        json_data = json.dumps({'prev_page': prev_page, 'next_page': next_page,
+                                'next_after': next_after, 'object_list': data})
         return Response(json_data, mimetype='application/json')
 
 
@@ -659,10 +1517,215 @@ class AdminPanel(object):
         return render_template(self.get_template_name(), panel=self, **self.get_context())
 
 
+class JobPanel(AdminPanel):
+    """
+    Lists the jobs of a JobRunner, with their progress and a download link
+    once finished, e.g. admin.register_panel('Exports', JobPanel, runner).
+    """
+    template_name = 'admin/panels/jobs.html'
+
+    def __init__(self, admin, title, runner):
+        super(JobPanel, self).__init__(admin, title)
+        self.runner = runner
+
+    def get_urls(self):
+        return (
+            ('/<job_id>/download/', self.download),
+        )
+
+    def is_visible(self, job):
+        # a job submitted for a user is listed, and downloaded, by them alone.
+        return job.owner is None or job.owner == self.admin.get_job_owner()
+
+    def download(self, job_id):
+        job = self.runner.get(job_id)
+        if (job is None or job.status != job.DONE or job.path is None or
+                not self.is_visible(job)):
+            abort(404)
+        return send_file(job.path, mimetype='application/gzip',
+                         as_attachment=True, download_name=job.filename)
+
+    def get_context(self):
+        return {'jobs': [job for job in self.runner.get_jobs()
+                         if self.is_visible(job)]}
+
+
+class StatsPanel(AdminPanel):
+    """
+    Row counts, recent inserts and on-disk sizes for every registered model,
+    e.g. admin.register_panel('Stats', StatsPanel, interval=300). A daemon
+    thread, started on the first render, recollects them every `interval`
+    seconds; the dashboard only ever reads the last collection.
+
+    Recent inserts count rows whose date field falls within `window`. The
+    date field is taken from `date_fields`, a mapping of model to field name,
+    or else is the model's first DateTimeField with a default. Pass `models`
+    to cover only some of the registered models.
+    """
+    template_name = 'admin/panels/stats.html'
+
+    def __init__(self, admin, title, interval=300, window=None, date_fields=None,
+                 models=None):
+        super(StatsPanel, self).__init__(admin, title)
+        self.models = models
+        self.interval = interval
+        self.window = window or datetime.timedelta(days=1)
+        self.date_fields = date_fields or {}
+        self.stats = []
+        self.updated = None
+        self.last_error = None
+        self._thread = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    def get_date_field(self, model):
+        if model in self.date_fields:
+            return model._meta.fields[self.date_fields[model]]
+        for field in model._meta.sorted_fields:
+            if isinstance(field, DateTimeField) and field.default is not None:
+                return field
+
+    def collect(self, model_admin):
+        model = model_admin.model
+        query = model_admin.get_query().order_by()
+        recent = None
+        date_field = self.get_date_field(model)
+        if date_field is not None:
+            since = datetime.datetime.now() - self.window
+            recent = query.where(date_field >= since).count()
+        return {
+            'model_admin': model_admin,
+            'count': query.count(),
+            'recent': recent,
+            'size': get_table_size(model),
+        }
+
+    def get_model_admins(self):
+        model_admins = self.admin.get_model_admins()
+        if self.models is not None:
+            model_admins = [m for m in model_admins if m.model in self.models]
+        return model_admins
+
+    def refresh(self):
+        stats = []
+        for model_admin in self.get_model_admins():
+            with model_admin.model._meta.database.connection_context():
+                stats.append(self.collect(model_admin))
+        with self._lock:
+            self.stats = stats
+            self.updated = datetime.datetime.now()
+        return stats
+
+    def run(self):
+        while not self._stop.is_set():
+            try:
+                # the thread has no context of its own, so give get_query()
+                # and friends the app's.
+                with self.admin.app.app_context():
+                    self.refresh()
+            except Exception as exc:
+                # keep serving the last collection, and try again next time.
+                logger.exception('Error collecting statistics.')
+                with self._lock:
+                    self.last_error = str(exc) or exc.__class__.__name__
+            else:
+                with self._lock:
+                    self.last_error = None
+            self._stop.wait(self.interval)
+
+    def start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stop.clear()
+                self._thread = threading.Thread(target=self.run)
+                self._thread.daemon = True
+                self._thread.start()
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def get_window_display(self):
+        hours = int(self.window.total_seconds() // 3600)
+        return '%dh' % hours if hours else '%dm' % (self.window.total_seconds() // 60)
+
+    def get_context(self):
+        with self._lock:
+            context = {'stats': self.stats, 'updated': self.updated,
+                       'last_error': self.last_error}
+        self.start()
+        return context
+
+
+class AuditLogPanel(AdminPanel):
+    """
+    The newest entries of the admin's AuditLog, linking to a page that browses
+    the whole log with keyset pagination, newest first, e.g.
+    admin.register_panel('Audit log', AuditLogPanel). The page narrows to a
+    model, object, user or action given as a query argument of that name.
+    """
+    template_name = 'admin/panels/audit_log.html'
+    log_template_name = 'admin/audit_log.html'
+    recent = 10
+    paginate_by = 50
+    count_cap = 10000
+
+    def __init__(self, admin, title, audit_log=None):
+        super(AuditLogPanel, self).__init__(admin, title)
+        self.audit_log = audit_log or admin.audit_log
+
+    def get_urls(self):
+        return (
+            ('/', self.browse),
+        )
+
+    def get_filters(self):
+        return [(name, request.args[name])
+                for name in ('model', 'object_id', 'username', 'action')
+                if request.args.get(name)]
+
+    def get_query(self):
+        query = self.audit_log.get_query()
+        for name, value in self.get_filters():
+            query = query.where(getattr(self.audit_log.model, name) == value)
+        return query
+
+    def get_object_url(self, entry):
+        # deleted rows, and models no longer registered, have no edit page.
+        if entry.object_id is None or entry.action == 'delete':
+            return None
+        for model_admin in self.admin.get_model_admins():
+            if model_admin.get_admin_name() == entry.model:
+                return url_for(model_admin.get_url_name('edit'),
+                               pk=entry.object_id)
+
+    def browse(self):
+        AuditEntry = self.audit_log.model
+        query = KeysetPaginatedQuery(
+            self.get_query(), self.paginate_by, AuditEntry.timestamp,
+            descending=True, count_cap=self.count_cap)
+        return render_template(self.log_template_name,
+                               admin=self.admin,
+                               panel=self,
+                               query=query,
+                               filters=self.get_filters())
+
+    def get_context(self):
+        AuditEntry = self.audit_log.model
+        entries = (self.audit_log.get_query()
+                   .order_by(AuditEntry.timestamp.desc(), AuditEntry.id.desc())
+                   .limit(self.recent))
+        return {'entries': list(entries), 'audit_log': self.audit_log}
+
+
 class Admin(object):
-    def __init__(self, app, auth, prefix='/admin', name='admin', branding='flask-peewee', theme=None):
+    def __init__(self, app, auth, prefix='/admin', name='admin', branding='flask-peewee', theme=None,
+                 template_cache_dir=None, audit_log=None):
         self.app = app
         self.auth = auth
+        self.audit_log = audit_log
 
         self._registry = {}
         self._panels = {}
@@ -672,6 +1735,12 @@ class Admin(object):
         self.branding = branding
         self.theme = theme
 
+        # directory for compiled template bytecode, shared between processes
+        # so that each worker does not recompile every admin template.
+        if template_cache_dir is None:
+            template_cache_dir = app.config.get('TEMPLATE_CACHE_DIR')
+        self.template_cache_dir = template_cache_dir
+
         self.prepare_template_environment()
 
     def get_url_name(self, name):
@@ -695,6 +1764,11 @@ class Admin(object):
     def check_user_permission(self, user):
         return user.admin
 
+    def get_job_owner(self):
+        # the owner of the jobs the current user submits to a JobRunner.
+        user = self.auth.get_logged_in_user()
+        return user._pk if user is not None else None
+
     def get_urls(self):
         return (
             ('/', self.auth_required(self.index)),
@@ -783,25 +1857,15 @@ class Admin(object):
                 )
 
     def setup(self):
+        self.app.extensions.setdefault('flask_peewee', {})['admin'] = self
         self.configure_routes()
         self.register_blueprint()
 
     def get_model_field(self, model, field):
-        try:
-            attr = getattr(model, field)
-        except AttributeError:
-            model_admin = self[type(model)]
-            try:
-                attr = getattr(model_admin, field)
-            except AttributeError:
-                raise AttributeError('Could not find attribute or method '
-                                     'named "%s".' % field)
-            else:
-                return attr(model)
-        else:
-            if callable(attr):
-                attr = attr()
-            return attr
+        model_admin = self.get_admin_for(type(model))
+        if model_admin is not None:
+            return model_admin.get_column_value(model, field)
+        return get_instance_attr(model, field)
 
     def get_form_field(self, form, field_name):
         return getattr(form, field_name)
@@ -848,6 +1912,34 @@ class Admin(object):
 
     def prepare_template_environment(self):
         self.app.jinja_env.filters['apply_prefix'] = self.apply_prefix
+        if self.template_cache_dir and self.app.jinja_env.bytecode_cache is None:
+            if not os.path.exists(self.template_cache_dir):
+                os.makedirs(self.template_cache_dir)
+            self.app.jinja_env.bytecode_cache = FileSystemBytecodeCache(
+                self.template_cache_dir)
+
+    def get_template_names(self):
+        # every template shipped with flask-peewee, by loader name.
+        root = os.path.join(current_dir, 'templates')
+        accum = []
+        for dirpath, dirnames, filenames in os.walk(root):
+            for filename in filenames:
+                if filename.endswith('.html'):
+                    path = os.path.join(dirpath, filename)
+                    accum.append(os.path.relpath(path, root).replace(os.sep, '/'))
+        return sorted(accum)
+
+    def compile_templates(self):
+        """
+        Load every flask-peewee template through the app's environment, so an
+        app override of a template is the one compiled, and return the names.
+        With a bytecode cache configured this fills it ahead of the first
+        request.
+        """
+        names = self.get_template_names()
+        for name in names:
+            self.app.jinja_env.get_template(name)
+        return names
 
 
 class Export(object):
@@ -907,24 +1999,39 @@ class Export(object):
             clone = clone.columns(*select)
         return clone, field_dict
 
-    def json_response(self, filename='export.json'):
+    def generate(self, on_row=None):
         serializer = Serializer()
         prepared_query, field_dict = self.prepare_query()
 
-        def generate():
-            # prefix the separator from the second row on, rather than keying
-            # commas off a pre-count. a count taken before iteration can
-            # disagree with the rows actually streamed (a concurrent insert or
-            # delete), producing a missing or trailing comma and invalid JSON.
-            yield b'[\n'
-            first = True
-            for obj in prepared_query:
-                if not first:
-                    yield b',\n'
-                first = False
-                obj_data = serializer.serialize_object(obj, field_dict)
-                yield json.dumps(obj_data).encode('utf-8')
-            yield b'\n]'
+        # prefix the separator from the second row on, rather than keying
+        # commas off a pre-count. a count taken before iteration can disagree
+        # with the rows actually streamed (a concurrent insert or delete),
+        # producing a missing or trailing comma and invalid JSON.
+        yield b'[\n'
+        first = True
+        for obj in prepared_query:
+            if not first:
+                yield b',\n'
+            first = False
+            obj_data = serializer.serialize_object(obj, field_dict)
+            yield json.dumps(obj_data).encode('utf-8')
+            if on_row is not None:
+                on_row()
+        yield b'\n]'
+
+    def json_response(self, filename='export.json'):
         headers = Headers()
         headers.add('Content-Disposition', 'attachment; filename=%s' % filename)
-        return Response(generate(), mimetype='application/json', headers=headers, direct_passthrough=True)
+        return Response(self.generate(), mimetype='application/json', headers=headers, direct_passthrough=True)
+
+    def write(self, fileobj, job=None):
+        # runs on a JobRunner worker thread, which needs its own connection.
+        with self.query.model._meta.database.connection_context():
+            if job is not None:
+                job.total = self.query.order_by().count()
+
+            def on_row():
+                job.progress += 1
+
+            for chunk in self.generate(on_row if job is not None else None):
+                fileobj.write(chunk)
@@ -0,0 +1,233 @@
+import atexit
+import datetime
+import json
+import logging
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+from peewee import AutoField
+from peewee import BigAutoField
+from peewee import BigIntegerField
+from peewee import CharField
+from peewee import DateTimeField
+from peewee import IntegerField
+from peewee import OperationalError
+from peewee import TextField
+
+from flask_peewee.serializer import Serializer
+
+
+logger = logging.getLogger(__name__)
+
+class AuditLog(object):
+    """
+    Records admin changes -- adds, edits with the fields they changed, deletes
+    and actions -- to a table, e.g. Admin(app, auth, audit_log=AuditLog(db)).
+
+    Entries are queued in memory and written by a background thread, started
+    with the first entry, in batches of up to `batch_size` rows with
+    insert_many, so an admin write does not wait on a second INSERT. With
+    `max_queue` entries already pending an entry is written synchronously
+    instead. The queue is flushed by stop(), which runs at interpreter exit.
+
+    With `inline` set entries are written by the request itself instead.
+    SQLite has one write lock per file, and a request that reads and then
+    writes in a transaction fails with "database is locked" if the writer
+    thread takes it in between, so set it when the log's database is SQLite
+    and sees concurrent admin writes.
+
+    Entries recorded inside atomic() are held until its transaction commits.
+    The user_id column takes the type of `user_model`'s primary key.
+    """
+    def __init__(self, db, model=None, batch_size=100, max_queue=10000,
+                 interval=1.0, db_table='auditlog', inline=False, retries=3,
+                 user_model=None):
+        self.db = db
+        self.db_table = db_table
+        self.user_model = user_model
+        self.model = model or self.get_model()
+        self.batch_size = batch_size
+        self.interval = interval
+        self.inline = inline
+        # attempts at writing a batch, a lock being released in between.
+        self.retries = retries
+        # batches that failed to write, and the last error, for the panel.
+        self.dropped = 0
+        self.last_error = None
+        self._queue = queue.Queue(max_queue)
+        self._thread = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        # entries of the transactions open in each thread, see atomic().
+        self._local = threading.local()
+        atexit.register(self.stop)
+
+    def get_user_id_field(self):
+        if self.user_model is None:
+            return IntegerField(null=True)
+        pk = self.user_model._meta.primary_key
+        if isinstance(pk, BigAutoField):
+            return BigIntegerField(null=True)
+        elif isinstance(pk, AutoField):
+            return IntegerField(null=True)
+        field = type(pk)(null=True)
+        if hasattr(pk, 'max_length'):
+            field.max_length = pk.max_length
+        return field
+
+    def get_model(self):
+        class AuditEntry(self.db.Model):
+            timestamp = DateTimeField(default=datetime.datetime.now, index=True)
+            user_id = self.get_user_id_field()
+            username = CharField(null=True)
+            model = CharField(index=True)
+            object_id = CharField(null=True)
+            action = CharField()
+            # {field: [old, new]} for adds, edits and deletes.
+            data = TextField(null=True)
+
+            def get_data(self):
+                return json.loads(self.data) if self.data else {}
+
+            class Meta:
+                table_name = self.db_table
+
+        return AuditEntry
+
+    def record(self, model, action, object_id=None, data=None, user=None):
+        username = None
+        if user is not None:
+            username = getattr(user, 'username', None) or str(user)
+        row = {
+            'timestamp': datetime.datetime.now(),
+            'user_id': user._pk if user is not None else None,
+            'username': username,
+            'model': model,
+            'object_id': str(object_id) if object_id is not None else None,
+            'action': action,
+            'data': json.dumps(Serializer().clean_data(data or {})),
+        }
+        pending = getattr(self._local, 'pending', None)
+        if pending is not None:
+            pending.append(row)
+        else:
+            self.put(row)
+
+    def put(self, row):
+        if self.inline:
+            self.model.insert(row).execute()
+            return
+        try:
+            self._queue.put_nowait(row)
+        except queue.Full:
+            # the writer has fallen behind, so this request pays for its own
+            # INSERT rather than queueing without bound.
+            self.model.insert(row).execute()
+        else:
+            self.start()
+
+    @contextmanager
+    def atomic(self, database):
+        """
+        A transaction on `database` whose entries are recorded once it
+        commits, and dropped if it rolls back, so a queued entry never
+        describes a write that did not happen.
+        """
+        pending = getattr(self._local, 'pending', None)
+        if pending is not None:
+            # nested, the outermost block records. a block rolled back to its
+            # savepoint drops the entries recorded within it.
+            mark = len(pending)
+            try:
+                with database.atomic():
+                    yield
+            except Exception:
+                del pending[mark:]
+                raise
+            return
+
+        self._local.pending = pending = []
+        try:
+            with database.atomic():
+                yield
+        finally:
+            self._local.pending = None
+        for row in pending:
+            self.put(row)
+
+    def drain(self, n):
+        rows = []
+        while len(rows) < n:
+            try:
+                rows.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return rows
+
+    def write(self, rows):
+        # one short transaction per batch. a locked database is retried, any
+        # other error drops the batch, keeping the writer alive and counting
+        # what was lost.
+        database = self.model._meta.database
+        for attempt in range(self.retries):
+            try:
+                with database.connection_context():
+                    with database.atomic():
+                        self.model.insert_many(rows).execute()
+                return
+            except OperationalError as exc:
+                error = exc
+                if 'locked' not in str(exc):
+                    break
+                if attempt < self.retries - 1:
+                    time.sleep(self.interval / self.retries)
+            except Exception as exc:
+                error = exc
+                break
+        logger.error('Dropped %d audit log entries: %s', len(rows), error,
+                     exc_info=error)
+        self.dropped += len(rows)
+        self.last_error = str(error)
+
+    def run(self):
+        while True:
+            try:
+                rows = [self._queue.get(timeout=self.interval)]
+            except queue.Empty:
+                if self._stop.is_set():
+                    return
+                continue
+            rows.extend(self.drain(self.batch_size - 1))
+            self.write(rows)
+
+    def start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stop.clear()
+                self._thread = threading.Thread(target=self.run)
+                self._thread.daemon = True
+                self._thread.start()
+
+    def flush(self):
+        # write whatever is queued from the calling thread, returning the
+        # number of entries written.
+        count = 0
+        rows = self.drain(self.batch_size)
+        while rows:
+            self.write(rows)
+            count += len(rows)
+            rows = self.drain(self.batch_size)
+        return count
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            thread.join(timeout)
+        self.flush()
+
+    def get_query(self):
+        return self.model.select()
@@ -19,6 +19,7 @@ from flask_peewee.utils import get_next
 from flask_peewee.utils import is_legacy_password
 from flask_peewee.utils import is_safe_url
 from flask_peewee.utils import make_password
+from flask_peewee.utils import save_changed
 from wtforms.validators import DataRequired
 
 
@@ -86,9 +87,11 @@ class Auth(object):
 
             # never expose the password hash through data export.
             export_exclude = ('password',)
+            audit_exclude = ('password',)
 
             def save_model(self, instance, form, adding=False):
                 orig_password = instance.password
+                before = dict(instance.__data__)
                 form.populate_obj(instance)
 
                 # hash before the single save so the raw password is never
@@ -98,7 +101,11 @@ class Auth(object):
                 if form.password.data != orig_password:
                     instance.set_password(form.password.data)
 
-                instance.save(force_insert=adding)
+                if adding:
+                    instance.save(force_insert=True)
+                else:
+                    save_changed(instance, before, self.version_field)
+                self.log_save(instance, before, adding)
                 return instance
 
 
@@ -1,6 +1,7 @@
 import click
 from flask import current_app
 from flask.cli import AppGroup
+from jinja2 import TemplateError
 from peewee import AutoField
 from peewee import IntegrityError
 from peewee import sort_models
@@ -189,3 +190,26 @@ def diff():
     """Print the schema changes needed to match the models."""
     schema_diff = run_migration(get_diff, get_runner())
     click.echo(schema_diff if schema_diff else 'schema matches models.')
+
+
+@fp.command()
+def compile_templates():
+    """Compile the admin templates into the template bytecode cache."""
+    admin = get_extension('admin', 'Admin')
+    if current_app.jinja_env.bytecode_cache is None:
+        raise click.ClickException(
+            'no template bytecode cache is configured, set '
+            'TEMPLATE_CACHE_DIR.')
+    try:
+        names = admin.compile_templates()
+    except TemplateError as exc:
+        raise click.ClickException(str(exc))
+    report('compiled', names)
+
+
+@fp.command()
+def field_tree_stats():
+    """Report the time spent building filter field trees."""
+    from flask_peewee.filters import field_tree_stats as stats
+    click.echo('field trees: %d built, %d reused, %.3fs building' % (
+        stats['misses'], stats['hits'], stats['seconds']))
@@ -1,2 +1,10 @@
 class ImproperlyConfigured(Exception):
     pass
+
+
+class ConcurrentUpdateError(Exception):
+    """
+    The row was changed by someone else since it was read: its version
+    column no longer holds the value the update expected.
+    """
+    pass
@@ -1,5 +1,6 @@
 import datetime
 import operator
+import time
 
 from flask import request
 from peewee import *
@@ -12,6 +13,7 @@ from wtforms import widgets
 from flask_peewee.forms import BaseModelConverter
 from flask_peewee.utils import alias_field
 from flask_peewee.utils import convert_boolean
+from flask_peewee.utils import get_facet_counts
 from functools import reduce
 
 
@@ -136,59 +138,110 @@ class ContainsQueryFilter(QueryFilter):
         return 'contains'
 
 
-class YearFilter(QueryFilter):
+class DateRangeFilter(QueryFilter):
+    """
+    Base for operations matching a span of time. They compile to a half-open
+    range, `field >= start AND field < end`, rather than comparing a part
+    extracted from the column, so an index on the column can be used.
+    """
+    def get_range(self, value):
+        # return (start, end) as dates, either of which may be None.
+        raise NotImplementedError
+
+    def get_bound(self, value):
+        # a DateField compares against a date -- sqlite stores both as text,
+        # and '2024-01-01' sorts before '2024-01-01 00:00:00'. a datetime or
+        # timestamp column compares against midnight.
+        if isinstance(self.field, DateField):
+            return value
+        return datetime.datetime.combine(value, datetime.time())
+
+    def query(self, value):
+        start, end = self.get_range(value)
+        exprs = []
+        if start is not None:
+            exprs.append(self.field >= self.get_bound(start))
+        if end is not None:
+            exprs.append(self.field < self.get_bound(end))
+        return reduce(operator.and_, exprs)
+
+
+class YearFilter(DateRangeFilter):
     key = 'year'
     input_type = 'number'
 
     def clean(self, value):
-        return int(value)
+        value = int(value)
+        if not datetime.MINYEAR <= value < datetime.MAXYEAR:
+            raise ValueError('year out of range: %s' % value)
+        return value
 
-    def query(self, value):
-        return self.field.year == value
+    def get_range(self, value):
+        return datetime.date(value, 1, 1), datetime.date(value + 1, 1, 1)
 
     def operation(self):
         return 'year equals'
 
 
-class MonthFilter(QueryFilter):
+class MonthFilter(DateRangeFilter):
+    """
+    Matches a month of a given year, written 'YYYY-MM', as a range. A bare
+    month number matches that month of every year, which cannot be a range,
+    so it still compares the extracted month.
+    """
     key = 'month'
-    input_type = 'number'
+    # takes either form, so neither a number nor a month picker.
+    input_type = 'text'
 
     def clean(self, value):
-        return int(value)
+        if '-' in value:
+            year, month = map(int, value.split('-', 1))
+            # validates the month, and that the following month exists.
+            self.get_range((year, month))
+            return (year, month)
+        value = int(value)
+        if not 1 <= value <= 12:
+            raise ValueError('month out of range: %s' % value)
+        return value
+
+    def get_range(self, value):
+        year, month = value
+        if month == 12:
+            return datetime.date(year, 12, 1), datetime.date(year + 1, 1, 1)
+        return datetime.date(year, month, 1), datetime.date(year, month + 1, 1)
 
     def query(self, value):
+        if isinstance(value, tuple):
+            return super(MonthFilter, self).query(value)
         return self.field.month == value
 
     def operation(self):
         return 'month equals'
 
 
-class WithinDaysAgoFilter(QueryFilter):
+class WithinDaysAgoFilter(DateRangeFilter):
     key = 'within_days'
     input_type = 'number'
 
     def clean(self, value):
         return int(value)
 
-    def query(self, value):
-        return self.field >= (
-            datetime.date.today() - datetime.timedelta(days=value))
+    def get_range(self, value):
+        return datetime.date.today() - datetime.timedelta(days=value), None
 
     def operation(self):
         return 'within X days ago'
 
 
-class OlderThanDaysAgoFilter(QueryFilter):
+class OlderThanDaysAgoFilter(DateRangeFilter):
     key = 'older_days'
     input_type = 'number'
 
     def clean(self, value):
         return int(value)
 
-    def query(self, value):
-        return self.field < (
-            datetime.date.today() - datetime.timedelta(days=value))
+    def get_range(self, value):
+        return None, datetime.date.today() - datetime.timedelta(days=value)
 
     def operation(self):
         return 'older than X days ago'
@@ -330,15 +383,77 @@ class FieldTreeNode(object):
         self.model = model
         self.fields = fields
         self.children = children or {}
+        # data derived from the tree. nodes are shared and never change once
+        # built, so it is computed once per node.
+        self.cache = {}
+
+
+# memoized field trees, shared by every resource, admin and filter form built
+# from the same arguments, and the time spent building them.
+_field_tree_cache = {}
+field_tree_stats = {'hits': 0, 'misses': 0, 'seconds': 0.0}
+
+
+# the models within n foreign keys of a model, keyed by (model, n).
+_reachable_cache = {}
+
+
+def get_reachable_models(model, depth):
+    key = (model, depth)
+    if key not in _reachable_cache:
+        models = frontier = set([model])
+        for i in range(depth):
+            frontier = set(
+                field.rel_model for m in frontier
+                for field in m._meta.sorted_fields
+                if isinstance(field, ForeignKeyField)) - models
+            models = models | frontier
+        _reachable_cache[key] = frozenset(models)
+    return _reachable_cache[key]
 
 
 def make_field_tree(model, fields, exclude, force_recursion=False, seen=None,
                     max_depth=3):
+    seen = seen or frozenset()
+    # `seen` is the foreign-key path to this model. the subtree depends on it
+    # only through the hops left and through the foreign keys on it that the
+    # walk can come back to (a cycle), so those key the cache, and two paths
+    # reaching a model alike share one node.
+    hops = max(max_depth - len(seen), 0)
+    reachable = get_reachable_models(model, hops)
+    key = (model,
+           None if fields is None else frozenset(fields),
+           frozenset(exclude or ()),
+           bool(force_recursion),
+           hops,
+           frozenset(f for f in seen if f.model in reachable))
+    node = _field_tree_cache.get(key)
+    if node is not None:
+        field_tree_stats['hits'] += 1
+        return node
+
+    field_tree_stats['misses'] += 1
+    start = time.perf_counter()
+    node = _field_tree_cache[key] = build_field_tree(
+        model, fields, exclude, force_recursion, seen, max_depth)
+    if not seen:
+        # nested builds are included in the outermost one's time.
+        field_tree_stats['seconds'] += time.perf_counter() - start
+    return node
+
+
+def clear_field_tree_cache():
+    # call after changing a model's fields at runtime.
+    _field_tree_cache.clear()
+    _reachable_cache.clear()
+
+
+def build_field_tree(model, fields, exclude, force_recursion, seen, max_depth):
     no_explicit_fields = fields is None # assume we want all of them
     if no_explicit_fields:
         fields = model._meta.sorted_field_names
-    exclude = exclude or []
-    seen = seen or frozenset()
+    fields = set(fields)
+    exclude = set(exclude or ())
 
     model_fields = []
     children = {}
@@ -351,25 +466,21 @@ def make_field_tree(model, fields, exclude, force_recursion=False, seen=None,
         if field_obj.name in fields and not isinstance(field_obj, BlobField):
             model_fields.append(field_obj)
 
-        # `seen` is the foreign-key path to this model, so a cycle is broken
-        # without collapsing two distinct paths to one model onto a single
-        # branch (a shared set did that). max_depth bounds the walk so a long
-        # or densely linked schema cannot explode the tree.
+        # a cycle is broken without collapsing two distinct paths to one
+        # model onto a single branch (a shared set did that). max_depth bounds
+        # the walk so a long or densely linked schema cannot explode the tree.
         if isinstance(field_obj, ForeignKeyField) and len(seen) < max_depth:
+            prefix = '%s__' % field_obj.name
             if no_explicit_fields:
                 rel_fields = None
             else:
-                rel_fields = [
-                    rf.replace('%s__' % field_obj.name, '') \
-                        for rf in fields if rf.startswith('%s__' % field_obj.name)
-                ]
+                rel_fields = [rf[len(prefix):] for rf in fields
+                              if rf.startswith(prefix)]
                 if not rel_fields and force_recursion:
                     rel_fields = None
 
-            rel_exclude = [
-                rx.replace('%s__' % field_obj.name, '') \
-                    for rx in exclude if rx.startswith('%s__' % field_obj.name)
-            ]
+            rel_exclude = [rx[len(prefix):] for rx in exclude
+                           if rx.startswith(prefix)]
             children[field_obj.name] = make_field_tree(
                 field_obj.rel_model, rel_fields, rel_exclude, force_recursion,
                 seen | {field_obj}, max_depth)
@@ -483,29 +594,26 @@ class FilterForm(object):
             field_dict,
         )
 
-    def parse_query_filters(self):
-        # reconstruct the "select" and "value" fields we are searching for in the
-        # arguments from the request by depth-first searching the field tree --
-        # basically what we should have at the end is the field we're querying,
-        # the type of query (QueryFilter), the value requested, and the foreign
-        # keys we joined to get there.
-        accum = {}
+    def get_parameter_index(self):
+        # operation parameter name, e.g. 'fr_user-fo_username' -> (position,
+        # field, value parameter name, the foreign keys joined to reach the
+        # field, label). built once per field tree and naming scheme, by
+        # depth-first search.
+        key = ('parameters', self.field_operation_prefix,
+               self.field_value_prefix, self.field_relation_prefix,
+               self.separator)
+        index = self._field_tree.cache.get(key)
+        if index is not None:
+            return index
+
+        index = {}
 
         def _dfs(node, prefix, join_columns, path_names):
             for field in node.fields:
                 qf_select = self.field_operation_prefix.join((prefix, field.name))
                 qf_value = self.field_value_prefix.join((prefix, field.name))
-
-                if qf_select in request.args and qf_value in request.args:
-                    accum.setdefault(field, [])
-                    accum[field].append((
-                        request.args.getlist(qf_select),
-                        request.args.getlist(qf_value),
-                        join_columns,
-                        qf_select,
-                        qf_value,
-                        ' / '.join(path_names + [field.name]),
-                    ))
+                index[qf_select] = (len(index), field, qf_value, join_columns,
+                                    ' / '.join(path_names + [field.name]))
 
             for child_prefix, child in node.children.items():
                 new_prefix = prefix + self.field_relation_prefix + child_prefix + self.separator
@@ -513,7 +621,30 @@ class FilterForm(object):
                 _dfs(child, new_prefix, join_copy, path_names + [child_prefix])
 
         _dfs(self._field_tree, '', [], [])
+        self._field_tree.cache[key] = index
+        return index
 
+    def parse_query_filters(self):
+        # map the "select" and "value" parameters in the request back to the
+        # field we're querying, the values requested, and the foreign keys we
+        # joined to get there. only the parameters present are looked up, so
+        # the cost follows the filters submitted rather than the tree's size.
+        # fields keep the order of the tree.
+        index = self.get_parameter_index()
+        accum = {}
+        for qf_select in sorted((k for k in request.args if k in index),
+                                key=lambda k: index[k][0]):
+            _, field, qf_value, join_columns, label = index[qf_select]
+            if qf_value in request.args:
+                accum.setdefault(field, [])
+                accum[field].append((
+                    request.args.getlist(qf_select),
+                    request.args.getlist(qf_value),
+                    join_columns,
+                    qf_select,
+                    qf_value,
+                    label,
+                ))
         return accum
 
     def resolve_form_field(self, form, name):
@@ -524,17 +655,19 @@ class FilterForm(object):
             obj = obj[part].form
         return obj[parts[-1]]
 
-    def process_request(self, query):
-        field_dict = self.get_field_dict()
-        FormClass = self.get_form(field_dict)
-
-        form = FormClass(request.args)
+    def apply_filters(self, query, skip=None):
+        # apply the filters in the request to `query`, returning the query and
+        # the filters applied as (query filter, submitted value, operation
+        # and value parameter names, label). filters on the field `skip`,
+        # reached without a join, are left out.
         query_filters = self.parse_query_filters()
-        cleaned = []
+        applied = []
         alias_map = {}
 
         for field, filters in query_filters.items():
             for (filter_key_list, filter_value_list, join_path, qf_s, qf_v, label) in filters:
+                if field is skip and not join_path:
+                    continue
                 query, bound_field = alias_field(
                     query, self.model, join_path, field, alias_map)
 
@@ -558,20 +691,7 @@ class FilterForm(object):
                     group = op_groups.setdefault(
                         query_filter.key, (query_filter.combine, []))
                     group[1].append(bound.query(value))
-
-                    # `form` only binds the first occurrence of each
-                    # parameter, so give each row its own form bound to just
-                    # that row's operation and value.
-                    row_form = FormClass(MultiDict([
-                        (qf_s, query_filter.key), (qf_v, filter_value)]))
-                    cleaned.append({
-                        'label': label,
-                        'key': query_filter.key,
-                        'value': filter_value,
-                        'input_type': query_filter.input_type,
-                        'op_field': self.resolve_form_field(row_form, qf_s),
-                        'value_field': self.resolve_form_field(row_form, qf_v),
-                    })
+                    applied.append((query_filter, filter_value, qf_s, qf_v, label))
 
                 # repeated uses of one match op OR together (eq a, eq b matches
                 # either). an exclusion ANDs instead (ne a, ne b excludes both).
@@ -580,8 +700,59 @@ class FilterForm(object):
                 for combine, exprs in op_groups.values():
                     query = query.where(reduce(combine, exprs))
 
+        return query, applied
+
+    def process_request(self, query):
+        field_dict = self.get_field_dict()
+        FormClass = self.get_form(field_dict)
+
+        form = FormClass(request.args)
+        query, applied = self.apply_filters(query)
+        cleaned = []
+
+        for query_filter, filter_value, qf_s, qf_v, label in applied:
+            # `form` only binds the first occurrence of each parameter, so
+            # give each row its own form bound to just that row's operation
+            # and value.
+            row_form = FormClass(MultiDict([
+                (qf_s, query_filter.key), (qf_v, filter_value)]))
+            cleaned.append({
+                'label': label,
+                'key': query_filter.key,
+                'value': filter_value,
+                'input_type': query_filter.input_type,
+                'op_field': self.resolve_form_field(row_form, qf_s),
+                'value_field': self.resolve_form_field(row_form, qf_v),
+            })
+
         return form, query, cleaned
 
+    def get_facets(self, query, facet_fields, cache=None):
+        # for each field, the rows each of its values would match: `query`
+        # with every filter in the request applied except those on the field
+        # itself, grouped by the field -- one GROUP BY per field. `param` is
+        # the value as the field's filter takes it in a query-string.
+        facets = []
+        for field in facet_fields:
+            facet_query, _ = self.apply_filters(query, skip=field)
+            if isinstance(field, BooleanField):
+                labels = {True: 'Yes', False: 'No'}
+            else:
+                labels = dict(field.choices or ())
+            values = []
+            for value, count in get_facet_counts(facet_query, field, cache):
+                param = value
+                if isinstance(value, bool):
+                    param = value and '1' or '0'
+                values.append({
+                    'value': value,
+                    'label': labels.get(value, value),
+                    'count': count,
+                    'param': '' if param is None else str(param),
+                })
+            facets.append({'field': field, 'values': values})
+        return facets
+
 
 class DateTimeLocalField(fields.DateTimeLocalField):
     # wtforms' default format list renders with a space separator, which is
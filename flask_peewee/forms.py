@@ -1,7 +1,9 @@
 from peewee import BooleanField
 
 from wtforms import widgets
+from wtforms.validators import ValidationError
 from wtfpeewee.fields import BooleanSelectField
+from wtfpeewee.fields import HiddenQueryField
 from wtfpeewee.fields import SelectQueryField
 from wtfpeewee.fields import wtf_choice
 from wtfpeewee.orm import ModelConverter
@@ -51,6 +53,24 @@ class ScopedModelSelectField(SelectQueryField):
             label, validators, query=query, **kwargs)
 
 
+class ScopedModelHiddenField(HiddenQueryField):
+    """
+    Hidden input holding the pk picked with the ajax lookup. The submitted pk
+    is resolved by a single primary-key lookup against the scoped query, and a
+    pk outside it is rejected rather than silently saved as None.
+    """
+    def __init__(self, label=None, validators=None, model=None, query=None, **kwargs):
+        if query is None:
+            query = model.select()
+        super(ScopedModelHiddenField, self).__init__(
+            label, validators, query=query, **kwargs)
+
+    def pre_validate(self, form):
+        value = self.raw_data and self.raw_data[0]
+        if value and value != '__None' and self.data is None:
+            raise ValidationError(self.gettext('Not a valid choice.'))
+
+
 class LimitedModelSelectField(ScopedModelSelectField):
     limit = 20
 
@@ -0,0 +1,120 @@
+import datetime
+import gzip
+import os
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+
+class Job(object):
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    def __init__(self, name, filename, path, owner=None):
+        self.id = uuid.uuid4().hex
+        self.name = name
+        # the primary key of the user the job belongs to, None for anyone.
+        self.owner = owner
+        self.filename = filename
+        self.path = path
+        self.status = self.PENDING
+        self.progress = 0
+        self.total = None
+        self.error = None
+        self.created = datetime.datetime.now()
+        self.finished = None
+        self.future = None
+
+    @property
+    def is_finished(self):
+        return self.status in (self.DONE, self.FAILED)
+
+    def get_percent(self):
+        if self.status == self.DONE:
+            return 100
+        if not self.total:
+            return 0
+        return min(100, int(100 * self.progress / self.total))
+
+    def wait(self, timeout=None):
+        if self.future is not None:
+            self.future.result(timeout)
+        return self
+
+
+class JobRunner(object):
+    """
+    Runs long jobs, such as large exports, on a local pool of worker threads
+    and writes each job's gzip-compressed output to a file in `directory`.
+    Only the filesystem is needed -- no broker. Job state lives in this
+    process's memory, so the runner only works when one process serves the
+    admin: a status poll or download reaching another process finds no such
+    job and gets a 404.
+    """
+    def __init__(self, directory, max_workers=2, max_jobs=50, executor=None):
+        self.directory = directory
+        self.max_jobs = max_jobs
+        self.executor = executor or ThreadPoolExecutor(max_workers)
+        self._jobs = {}
+        self._lock = threading.Lock()
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+    def submit(self, name, filename, fn, owner=None):
+        """
+        Queue `fn(fileobj, job)`, which writes the job's output to the
+        (gzip) file object and may update job.total / job.progress as it goes.
+        A job with no filename produces no file and is passed None. `owner`
+        is the primary key of the user the job and its output belong to.
+        """
+        job = Job(name, filename, None, owner)
+        if filename is not None:
+            job.path = os.path.join(self.directory, '%s.gz' % job.id)
+        with self._lock:
+            self._jobs[job.id] = job
+            self.prune()
+        job.future = self.executor.submit(self.run, job, fn)
+        return job
+
+    def run(self, job, fn):
+        job.status = Job.RUNNING
+        # write to a temporary name so a download never sees a partial file.
+        tmp_path = job.path + '.tmp' if job.path else None
+        try:
+            if tmp_path is None:
+                fn(None, job)
+            else:
+                with gzip.open(tmp_path, 'wb') as fh:
+                    fn(fh, job)
+                os.rename(tmp_path, job.path)
+        except Exception as exc:
+            job.status = Job.FAILED
+            job.error = str(exc)
+            if tmp_path and os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+        else:
+            job.status = Job.DONE
+        job.finished = datetime.datetime.now()
+
+    def prune(self):
+        # drop the oldest finished jobs, and their files, past max_jobs.
+        finished = sorted((job for job in self._jobs.values()
+                           if job.is_finished), key=lambda job: job.created)
+        while len(self._jobs) > self.max_jobs and finished:
+            job = finished.pop(0)
+            del self._jobs[job.id]
+            if job.path and os.path.exists(job.path):
+                os.unlink(job.path)
+
+    def get(self, job_id):
+        return self._jobs.get(job_id)
+
+    def get_jobs(self):
+        with self._lock:
+            jobs = list(self._jobs.values())
+        return sorted(jobs, key=lambda job: job.created, reverse=True)
+
+    def shutdown(self, wait=True):
+        self.executor.shutdown(wait=wait)
@@ -5,18 +5,24 @@ import operator
 from flask import Blueprint
 from flask import Response
 from flask import g
+from flask import has_request_context
 from flask import request
 from flask import url_for
 from peewee import *
 from peewee import DJANGO_MAP
 
+from flask_peewee.exceptions import ConcurrentUpdateError
 from flask_peewee.filters import make_field_tree
 from flask_peewee.serializer import Deserializer
 from flask_peewee.serializer import Serializer
 from flask_peewee.utils import PaginatedQuery
+from flask_peewee.utils import TTLCache
 from flask_peewee.utils import alias_field
 from flask_peewee.utils import convert_boolean
+from flask_peewee.utils import get_facet_counts
 from flask_peewee.utils import order_query
+from flask_peewee.utils import prefetch_related
+from flask_peewee.utils import save_changed
 from flask_peewee.utils import slugify
 from functools import reduce
 
@@ -185,6 +191,19 @@ class AdminAuthentication(UserAuthentication):
         return res
 
 
+class Collection(object):
+    """
+    A reverse relation listed by RestResource.include_collections. Its rows
+    are serialized through `resource`, at most `limit` of them per object,
+    chosen in `ordering` -- a field name, "-" prefixed for descending, e.g.
+    Collection(MessageResource, limit=5, ordering='-pub_date').
+    """
+    def __init__(self, resource, limit=None, ordering=None):
+        self.resource = resource
+        self.limit = limit
+        self.ordering = ordering
+
+
 class RestResource(object):
     # default page size when the client does not request a "limit".
     paginate_by = 20
@@ -196,6 +215,12 @@ class RestResource(object):
                         'True': True, 'true': True,
                         'None': None, 'none': None}
 
+    # functions of the aggregate view, each a query-string parameter listing
+    # fields, e.g. ?sum=amount, and the units date_trunc may truncate to.
+    AGGREGATES = {'count': fn.COUNT, 'sum': fn.SUM, 'avg': fn.AVG,
+                  'min': fn.MIN, 'max': fn.MAX}
+    DATE_TRUNC_PARTS = ('year', 'month', 'day', 'hour', 'minute', 'second')
+
     # ops whose predicate excludes values instead of matching them. repeated
     # values of an exclusion combine with AND, not OR (see apply_filter).
     NEGATIVE_OPS = frozenset({'ne', 'is_not', 'not_in'})
@@ -204,6 +229,20 @@ class RestResource(object):
     fields = None
     exclude = None
 
+    # read a list with only the columns its serialization needs, instead of
+    # whole rows. a request narrowing the fields (see fields_var) is always
+    # read so. name in load_fields any other field read from the rows, e.g.
+    # in prepare_data.
+    prune_columns = False
+    load_fields = None
+
+    # query-string parameters a GET may narrow its response with: a
+    # comma-separated list of the fields to return, dotted for an included
+    # resource's fields (user.email), and of the includes and collections to
+    # expand. either is checked against fields/exclude above.
+    fields_var = 'fields'
+    include_var = 'include'
+
     # field names that clients may never write, even when they appear in an
     # incoming POST/PUT body -- protects against mass assignment.
     readonly_fields = None
@@ -222,6 +261,17 @@ class RestResource(object):
     filter_fields = None
     filter_recursive = True
 
+    # boolean or choices field names whose per-value row counts are returned
+    # in the list's meta block, each counted under every filter but its own.
+    # one GROUP BY per field, cached for facet_cache_timeout seconds per
+    # filter signature.
+    facet_fields = None
+    facet_cache_timeout = 10
+
+    # the rows the aggregate view may group into, e.g. by a foreign key. a
+    # query with more groups is answered with a 400.
+    max_aggregate_groups = 1000
+
     # max related-model hops when building the filter field tree, so a long or
     # densely linked fk graph cannot explode it.
     max_filter_depth = 3
@@ -229,11 +279,22 @@ class RestResource(object):
     # mapping of field name to resource class
     include_resources = None
 
+    # mapping of a reverse relation -- a foreign key's backref, e.g.
+    # 'message_set' -- to the resource class its rows are serialized with, or
+    # to a Collection, which can also cap the rows listed per object. the
+    # rows for a whole page load with one query per relation.
+    include_collections = None
+
     # whether related objects may be created/updated through a nested {...} in
     # this resource's payload. When False, a nested object is ignored (the FK
     # can still be set by scalar id).
     nested_writes = True
 
+    # an integer field used for optimistic concurrency. an edit carrying a
+    # stale version in its payload is answered with a 409 instead of
+    # overwriting the newer row.
+    version_field = None
+
     # delete behavior
     delete_recursive = True
 
@@ -259,6 +320,10 @@ class RestResource(object):
 
         self._resources = {}
 
+        self.facet_cache = None
+        if self.facet_cache_timeout:
+            self.facet_cache = TTLCache(self.facet_cache_timeout)
+
         # recurse into nested resources
         if self.include_resources:
             for field_name, resource in self.include_resources.items():
@@ -275,6 +340,15 @@ class RestResource(object):
                 self._filter_fields.extend(['%s__%s' % (field_name, ff) for ff in resource_obj._filter_fields])
                 self._filter_exclude.extend(['%s__%s' % (field_name, ff) for ff in resource_obj._filter_exclude])
 
+        # reverse relation name -> (foreign key, resource, Collection).
+        self._collections = {}
+        for name, collection in (self.include_collections or {}).items():
+            if not isinstance(collection, Collection):
+                collection = Collection(collection)
+            fk = getattr(self.model, name).field
+            resource_obj = collection.resource(self.api, fk.model, self.authentication, self.allowed_methods)
+            self._collections[name] = (fk, resource_obj, collection)
+
         self._field_tree = make_field_tree(
             self.model, self._filter_fields, self._filter_exclude,
             self.filter_recursive, max_depth=self.max_filter_depth)
@@ -295,12 +369,16 @@ class RestResource(object):
     def get_query(self):
         return self.model.select()
 
-    def process_query(self, query):
+    def process_query(self, query, skip=None, ignore=()):
+        # `skip` names a field of the model whose filters are left out, and
+        # `ignore` request parameters that are not filters.
         raw_filters = {}
 
         # clean and normalize the request parameters
         for key in request.args:
-            if key in ('ordering', 'page', 'limit'):
+            if key in ('ordering', 'page', 'limit', self.fields_var, self.include_var):
+                continue
+            if key in ignore:
                 continue
 
             orig_key = key
@@ -333,7 +411,9 @@ class RestResource(object):
             for field in node.fields:
                 filter_expr = '%s%s' % (prefix, field.name)
                 if filter_expr in raw_filters:
-                    plan.append((field, fks, raw_filters.pop(filter_expr)))
+                    filters = raw_filters.pop(filter_expr)
+                    if filter_expr != skip:
+                        plan.append((field, fks, filters))
 
             for child_prefix, child_node in node.children.items():
                 fk = node.model._meta.fields[child_prefix]
@@ -404,17 +484,162 @@ class RestResource(object):
         return data
 
     def serialize_object(self, obj):
-        s = self.get_serializer()
-        return self.prepare_data(
-            obj, s.serialize_object(obj, self._fields, self._exclude)
-        )
+        return self.serialize_query([obj])[0]
 
     def serialize_query(self, query):
+        fields, exclude, names = self.get_current_selection()
         s = self.get_serializer()
-        return [
-            self.prepare_data(obj, s.serialize_object(obj, self._fields, self._exclude)) \
-                for obj in query
-        ]
+        objects = list(query)
+        collections = self.get_collections(objects, names)
+        result = []
+        for obj in objects:
+            data = s.serialize_object(obj, fields, exclude)
+            for name in names:
+                fk = self._collections[name][0]
+                key = obj.__data__.get(fk.rel_field.name)
+                data[name] = collections[name].get(key, [])
+            result.append(self.prepare_data(obj, data))
+        return result
+
+    def get_selection(self):
+        # what is serialized: the path-keyed fields and exclude maps, and the
+        # names of the collections listed.
+        return self._fields, self._exclude, list(self._collections)
+
+    def get_current_selection(self):
+        # the selection use_request_selection() set for the current request,
+        # otherwise get_selection().
+        if has_request_context():
+            selections = request.environ.get('flask_peewee.selections', {})
+            if self in selections:
+                return selections[self]
+        return self.get_selection()
+
+    def use_request_selection(self):
+        # serialize the rest of the current request with the selection it
+        # asks for. a ValueError names a field or include not exposed.
+        selection = self.get_request_selection()
+        selections = request.environ.setdefault('flask_peewee.selections', {})
+        selections[self] = selection
+        return selection
+
+    def get_request_names(self, var):
+        # the comma-separated names in a query-string parameter, which may be
+        # repeated, or None when the parameter is absent.
+        if var not in request.args:
+            return None
+        return [name.strip() for value in request.args.getlist(var)
+                for name in value.split(',') if name.strip()]
+
+    def get_request_selection(self):
+        """
+        Narrow get_selection() to the request's fields_var and include_var
+        parameters. A ValueError names any field or include that is not
+        exposed.
+        """
+        fields, exclude, collections = self.get_selection()
+        requested = self.get_request_names(self.fields_var)
+        include = self.get_request_names(self.include_var)
+        if requested is None and include is None:
+            return fields, exclude, collections
+
+        # paths the request names explicitly, through include or a dotted
+        # field. these are expanded even when their parent's fields are
+        # narrowed to leave them out.
+        named = set()
+        unknown = []
+        for name in include or ():
+            path = tuple(name.split('.'))
+            if (path and path in fields) or name in collections:
+                named.add(path)
+            else:
+                unknown.append(name)
+
+        selected = {}
+        for name in requested or ():
+            parts = tuple(name.split('.'))
+            path, field_name = parts[:-1], parts[-1]
+            if not path and field_name in collections:
+                selected.setdefault((), [])
+                named.add(parts)
+            elif (field_name in fields.get(path, ()) and
+                  field_name not in exclude.get(path, ())):
+                selected.setdefault(path, []).append(field_name)
+                if path:
+                    named.add(path)
+            else:
+                unknown.append(name)
+
+        if unknown:
+            raise ValueError('Unrecognized field(s): %s' % ', '.join(unknown))
+
+        # naming a path names its ancestors. without include_var every
+        # configured include may be expanded, otherwise only those named.
+        named = set(path[:i] for path in named for i in range(1, len(path) + 1))
+        expand = set(named)
+        if include is None:
+            expand.update(fields)
+
+        narrowed = {}
+        for path in sorted(fields, key=len):
+            if path:
+                parent, field_name = path[:-1], path[-1]
+                if path not in expand or parent not in narrowed:
+                    continue
+                if path in named and field_name not in narrowed[parent]:
+                    narrowed[parent].append(field_name)
+                # an include is only expanded if its parent outputs the fk.
+                if (field_name not in narrowed[parent] or
+                        field_name in exclude.get(parent, ())):
+                    continue
+            narrowed[path] = list(selected.get(path, fields[path]))
+
+        if include is None and () not in selected:
+            names = collections
+        else:
+            names = [name for name in collections if (name,) in named]
+        return narrowed, exclude, names
+
+    def get_collection_query(self, fk, keys, limit=None, ordering=None):
+        # this resource's rows whose foreign key `fk` is one of `keys`, in
+        # `ordering` and, with a limit, at most `limit` per key: a window
+        # function ranks each key's rows, in a subquery of the primary keys.
+        order = [self.pk.asc()]
+        if ordering:
+            field = self.model._meta.fields[ordering.lstrip('-')]
+            order.insert(0, field.desc() if ordering.startswith('-') else field.asc())
+
+        query = self.apply_related_joins(self.get_query(), extra=[fk.name])
+        if not limit:
+            return query.where(fk.in_(keys)).order_by(*order)
+
+        rank = fn.ROW_NUMBER().over(partition_by=[fk], order_by=order)
+        ranked = (self.get_query()
+                  .select(self.pk.alias('rank_pk'), rank.alias('rank'))
+                  .where(fk.in_(keys))
+                  .alias('ranked'))
+        top = (Select([ranked], [ranked.c.rank_pk])
+               .where(ranked.c.rank <= limit))
+        return query.where(self.pk.in_(top)).order_by(*order)
+
+    def get_collections(self, objects, names=None):
+        # {relation name: {parent key: [serialized rows]}} for `objects`,
+        # loaded with one query per relation.
+        collections = {}
+        if names is None:
+            names = list(self._collections)
+        for name in names:
+            fk, resource, collection = self._collections[name]
+            grouped = collections[name] = {}
+            keys = set(obj.__data__.get(fk.rel_field.name) for obj in objects)
+            keys.discard(None)
+            if not keys:
+                continue
+            rows = list(resource.get_collection_query(
+                fk, list(keys), collection.limit, collection.ordering))
+            for row, data in zip(rows, resource.serialize_query(rows)):
+                grouped.setdefault(row.__data__[fk.name], []).append(data)
+        return collections
 
     def get_readonly_fields(self):
         # the primary key is always read-only: it is addressed via the URL,
@@ -473,6 +698,12 @@ class RestResource(object):
             if unknown:
                 raise ValueError('Unrecognized field(s): %s'
                                  % ', '.join(sorted(unknown)))
+        # remember the loaded values, so save_object writes only what changed.
+        # a prefetched related row already has them, from before the parent's
+        # deserialization wrote the nested values onto it.
+        if instance.get_id() is not None and \
+                getattr(instance, '_loaded_data', None) is None:
+            instance._loaded_data = dict(instance.__data__)
         d = self.get_deserializer()
         return d.deserialize_object(instance, data)
 
@@ -508,6 +739,7 @@ class RestResource(object):
             ('/', self.require_method(self.api_list, ['GET', 'POST'])),
             ('/<pk>/', self.require_method(self.api_detail, ['GET', 'POST', 'PUT', 'DELETE'])),
             ('/<pk>/delete/', self.require_method(self.post_delete, ['POST', 'DELETE'])),
+            ('/aggregate/', self.require_method(self.api_aggregate, ['GET'])),
         )
 
     def check_get(self, obj=None):
@@ -523,7 +755,12 @@ class RestResource(object):
         return True
 
     def save_object(self, instance, raw_data):
-        instance.save()
+        # an existing row is only UPDATEd in its changed columns, if any.
+        before = getattr(instance, '_loaded_data', None)
+        if before is None:
+            instance.save()
+        else:
+            save_changed(instance, before, self.version_field)
         return instance
 
     def api_list(self):
@@ -556,6 +793,11 @@ class RestResource(object):
     def post_delete(self, pk):
         return self.api_detail(pk, 'DELETE')
 
+    def api_aggregate(self):
+        if not self.check_get():
+            return self.response_forbidden()
+        return self.object_aggregate()
+
     def apply_ordering(self, query):
         ordering = request.args.get('ordering') or ''
         return order_query(query, self.model, ordering,
@@ -586,6 +828,98 @@ class RestResource(object):
             'next': next,
         }
 
+    def get_facets(self):
+        serializer = self.get_serializer()
+        facets = {}
+        for name in self.facet_fields:
+            field = self.model._meta.fields[name]
+            query = self.process_query(self.get_query(), skip=name)
+            facets[name] = [
+                {'value': serializer.convert_value(value), 'count': count}
+                for value, count in get_facet_counts(
+                    query, field, self.facet_cache)]
+        return facets
+
+    def get_aggregate_query(self, query):
+        """
+        Group `query` by the request's group_by fields and date_trunc
+        (field:unit) expressions, selecting the number of rows of each group
+        and the requested aggregates. Returns the query and the name of each
+        column: a group's field name, field__unit for a truncated date,
+        "count", or field__function for an aggregate. Only fields that are
+        both filterable and serialized may be named, and a ValueError names
+        any other, or a column named twice.
+        """
+        serialized = set(self._fields[()]) - set(self._exclude.get((), ()))
+        fields = dict((field.name, field) for field in self._field_tree.fields
+                      if field.name in serialized)
+        names = []
+        columns = []
+
+        def get_field(name, *field_types):
+            field = fields.get(name)
+            if field is None or (field_types and not isinstance(field, field_types)):
+                raise ValueError('Cannot aggregate on field: %s' % name)
+            return field
+
+        def add(name, column):
+            # a field named "count", say, would shadow the row count.
+            if name in names:
+                raise ValueError('Duplicate column: %s' % name)
+            names.append(name)
+            columns.append(column)
+
+        for name in self.get_request_names('group_by') or ():
+            add(name, get_field(name))
+        for value in self.get_request_names('date_trunc') or ():
+            name, _, part = value.partition(':')
+            if part not in self.DATE_TRUNC_PARTS:
+                raise ValueError('Unrecognized date_trunc unit: %s' % value)
+            field = get_field(name, DateField, DateTimeField)
+            add('%s__%s' % (name, part),
+                self.model._meta.database.truncate_date(part, field))
+
+        # groups are referenced by position, which postgres needs to match a
+        # parameterized date_trunc() in the select list.
+        groups = [SQL(str(i + 1)) for i in range(len(columns))]
+        add('count', fn.COUNT(SQL('*')))
+
+        for agg, func in self.AGGREGATES.items():
+            field_types = ()
+            if agg in ('sum', 'avg'):
+                field_types = (IntegerField, FloatField, DecimalField)
+            for name in self.get_request_names(agg) or ():
+                add('%s__%s' % (name, agg), func(get_field(name, *field_types)))
+
+        query = query.select(*columns).order_by(*groups)
+        if groups:
+            query = query.group_by(*groups)
+        return query, names
+
+    def object_aggregate(self):
+        # one GROUP BY over the filtered query, returned by column:
+        # {"columns": {"user": [1, 2], "count": [10, 4]}}.
+        ignore = ('group_by', 'date_trunc') + tuple(self.AGGREGATES)
+        try:
+            query = self.process_query(self.get_query(), ignore=ignore)
+            query, names = self.get_aggregate_query(query)
+        except ValueError as exc:
+            return self.response_bad_request(str(exc))
+
+        rows = list(query.limit(self.max_aggregate_groups + 1).tuples())
+        if len(rows) > self.max_aggregate_groups:
+            return self.response_bad_request(
+                'More than %d groups, filter the query further.'
+                % self.max_aggregate_groups)
+
+        convert = self.get_serializer().convert_value
+        values = list(zip(*rows)) or [()] * len(names)
+        return self.response({
+            'meta': {'model': self.get_api_name(), 'group_count': len(rows)},
+            'columns': dict((name, [convert(value) for value in column])
+                            for name, column in zip(names, values)),
+        })
+
     def get_paginate_by(self):
         # an explicit "limit" wins (capped at max_paginate_by if set),
         # otherwise fall back to the resource default. paginate_by is the
@@ -610,6 +944,8 @@ class RestResource(object):
             paginate_by = filtered_query.count() or 1
         pq = PaginatedQuery(filtered_query, paginate_by)
         meta_data = self.get_request_metadata(pq)
+        if self.facet_fields:
+            meta_data['facets'] = self.get_facets()
 
         query_dict = self.serialize_query(pq.get_list())
 
@@ -618,32 +954,67 @@ class RestResource(object):
             'objects': query_dict,
         })
 
-    def apply_related_joins(self, query):
+    def apply_related_joins(self, query, extra=()):
         # Eager-load the include_resources tree in a single query so nested
         # serialization does not issue a lookup per row (the N+1 you would get
         # from lazily following each foreign key). Each related model is LEFT
         # OUTER joined -- nullable FKs stay None -- and aliased, so the same
         # model may be nested more than once (e.g. from_user / to_user).
-        return self._join_related(query, self.model, self)
-
-    def _join_related(self, query, src, resource):
+        # an include the selection leaves out is not joined. when pruning,
+        # only the columns the selection serializes are selected, from the
+        # model and from each alias, and `extra` names further fields of the
+        # model to load. a get_query() that selects columns of its own keeps
+        # them.
+        fields, exclude, names = self.get_current_selection()
+        prune = self.prune_columns or fields is not self._fields
+        if prune and query._is_default:
+            extra = list(extra) + list(self.load_fields or ())
+            extra.extend(self._collections[name][0].rel_field.name
+                         for name in names)
+            query = query.select(*self.get_columns(
+                self.model, self.model, fields, exclude, (), extra))
+        return self._join_related(query, self.model, self, fields, exclude, (),
+                                  prune)
+
+    def _join_related(self, query, src, resource, fields, exclude, path, prune):
         for field_name, child in resource._resources.items():
+            child_path = path + (field_name,)
+            if child_path not in fields:
+                continue
             dest = child.model.alias()
             fk = getattr(src, field_name)
             pk = getattr(dest, child.model._meta.primary_key.name)
-            query = query.select_extend(dest).join_from(
+            if prune:
+                columns = self.get_columns(dest, child.model, fields, exclude,
+                                           child_path)
+            else:
+                columns = [dest]
+            query = query.select_extend(*columns).join_from(
                 src, dest, JOIN.LEFT_OUTER, on=(fk == pk), attr=field_name)
-            query = self._join_related(query, dest, child)
+            query = self._join_related(query, dest, child, fields, exclude,
+                                       child_path, prune)
         return query
 
+    def get_columns(self, source, model, fields, exclude, path, extra=()):
+        # the columns of `source` -- the model or its join alias -- that
+        # serializing `path` reads: the primary key, the fields not excluded
+        # (a foreign key's own column holds its id) and any `extra` fields.
+        names = [field.name for field in model._meta.get_primary_keys()]
+        for name in fields.get(path, model._meta.sorted_field_names):
+            if name not in names and name not in exclude.get(path, ()):
+                names.append(name)
+        names.extend(name for name in extra if name not in names)
+        return [getattr(source, name) for name in names]
+
     def object_list(self):
         query = self.get_query()
         query = self.apply_ordering(query)
 
-        # process any filters, translating an unknown-filter rejection into a
-        # 400 (see reject_unknown_filters).
+        # process any filters, translating an unknown-filter rejection (see
+        # reject_unknown_filters) or an unknown field into a 400.
         try:
             query = self.process_query(query)
+            self.use_request_selection()
         except ValueError as exc:
             return self.response_bad_request(str(exc))
 
@@ -657,6 +1028,10 @@ class RestResource(object):
         return self.paginated_object_list(query)
 
     def object_detail(self, obj):
+        try:
+            self.use_request_selection()
+        except ValueError as exc:
+            return self.response_bad_request(str(exc))
         return self.response(self.serialize_object(obj))
 
     def save_related_objects(self, instance, data):
@@ -680,6 +1055,38 @@ class RestResource(object):
                 rel_resource.save_related_objects(rel_obj, v)
                 setattr(instance, k, rel_resource.save_object(rel_obj, v))
 
+    def prefetch_related(self, instance, data):
+        # load the related rows the payload's nested objects edit, one query
+        # per related model at each level, before anything is deserialized.
+        # the same instances are then deserialized into, checked with
+        # check_put and saved, and each remembers its loaded values so only
+        # its changed columns are written. rows are read through each nested
+        # resource's get_query(), and a nested object editing a row that one
+        # scopes out is forbidden.
+        if not self.nested_writes:
+            return {}
+
+        def get_query(path, model):
+            resource = self
+            for name in path:
+                if not resource.nested_writes:
+                    return None
+                resource = resource._resources.get(name)
+                if resource is None:
+                    return None
+            return resource.get_query()
+
+        related = prefetch_related(instance, self.scrub_readonly_fields(data),
+                                   get_query)
+        for path, row in related.items():
+            if row is not None:
+                row._loaded_data = dict(row.__data__)
+                continue
+            parent = related[path[:-1]] if path[:-1] else instance
+            if parent.__data__.get(path[-1]) is not None:
+                raise RestForbidden()
+        return related
+
     def read_request_data(self):
         if request.data:
             return json.loads(request.data.decode('utf-8'))
@@ -694,6 +1101,7 @@ class RestResource(object):
         # Wrapped in a transaction so a rejected nested write (RestForbidden)
         # or an integrity error cannot leave a half-written object graph.
         with self.model._meta.database.atomic():
+            self.prefetch_related(instance, data)
             obj, models = self.deserialize_object(data, instance)
             self.save_related_objects(obj, data)
             return self.save_object(obj, data)
@@ -708,6 +1116,8 @@ class RestResource(object):
             obj = self.persist_object(instance, data)
         except RestForbidden:
             return self.response_forbidden()
+        except ConcurrentUpdateError as exc:
+            return self.response_error(str(exc), 409)
         except (IntegrityError, DataError, ValueError, TypeError) as exc:
             return self.response_bad_request(str(exc))
 
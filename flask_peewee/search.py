@@ -0,0 +1,141 @@
+import operator
+from functools import reduce
+
+from peewee import CharField
+from peewee import Expression
+from peewee import JOIN
+from peewee import TextField
+from peewee import fn
+
+from flask_peewee.utils import alias_field
+
+
+class SearchBackend(object):
+    """
+    Applies the admin's quick-search term to a query. ModelAdmin.search_fields
+    stays the source of columns: each backend resolves those (joining related
+    models with LEFT OUTER, so a null fk does not hide a row that matches a
+    direct field) and only decides how one column matches the term.
+    """
+    def resolve_fields(self, model_admin, query):
+        alias_map = {}
+        accum = []
+        for name in model_admin.get_search_fields():
+            field, fks = model_admin._resolve_search_field(name)
+            query, field = alias_field(
+                query, model_admin.model, fks, field, alias_map,
+                JOIN.LEFT_OUTER)
+            accum.append((name, field))
+        return query, accum
+
+    def match(self, field, term):
+        raise NotImplementedError
+
+    def apply(self, model_admin, query, term):
+        query, search_fields = self.resolve_fields(model_admin, query)
+        clauses = [self.match(field, term) for name, field in search_fields]
+        return query.where(reduce(operator.or_, clauses))
+
+
+class ContainsSearch(SearchBackend):
+    """
+    Case-insensitive substring match, LIKE '%term%'. The default. It cannot
+    use a b-tree index, but on Postgres a pg_trgm GIN index on the column
+    (gin_trgm_ops) serves the ILIKE peewee generates.
+    """
+    def match(self, field, term):
+        return field.contains(term)
+
+
+class PrefixSearch(SearchBackend):
+    """
+    Case-sensitive prefix match, written as the range
+    ``column >= 'term' AND column < 'terN'`` (the term with its last character
+    incremented) so that a plain b-tree index on the column serves it in any
+    database. A column that is not text is matched with LIKE 'term%'.
+    """
+    def get_upper_bound(self, term):
+        # the least string above every string starting with `term`, or None.
+        # a last character that cannot be incremented is dropped, and the
+        # one before it incremented instead.
+        term = term.rstrip(chr(0x10FFFF))
+        if not term:
+            return None
+        return term[:-1] + chr(ord(term[-1]) + 1)
+
+    def match(self, field, term):
+        if not isinstance(field, (CharField, TextField)):
+            return field.startswith(term)
+        upper = self.get_upper_bound(term)
+        if upper is None:
+            return field >= term
+        return (field >= term) & (field < upper)
+
+
+class SqliteFTSSearch(SearchBackend):
+    """
+    Full-text search through an FTS5 table (playhouse.sqlite_ext.FTS5Model)
+    whose rowid is the model's primary key and whose columns are named after
+    the search fields, e.g. ``content`` and ``user__username``. The term is
+    matched as a quoted prefix phrase, restricted to those columns. Call
+    rebuild() to (re)populate the index from the search fields.
+    """
+    def __init__(self, fts_model):
+        self.fts_model = fts_model
+
+    def get_columns(self, model_admin):
+        fts_fields = self.fts_model._meta.fields
+        return [name for name in model_admin.get_search_fields()
+                if name in fts_fields]
+
+    def apply(self, model_admin, query, term):
+        # quote the term so FTS5 query syntax in the input is taken literally.
+        phrase = '"%s"*' % term.replace('"', '""')
+        columns = self.get_columns(model_admin)
+        if columns:
+            phrase = '{%s} : %s' % (' '.join(columns), phrase)
+        subquery = (self.fts_model
+                    .select(self.fts_model.rowid)
+                    .where(self.fts_model.match(phrase)))
+        return query.where(model_admin.pk << subquery)
+
+    def rebuild(self, model_admin, chunk_size=500):
+        # the rows are read and indexed a chunk at a time, in primary-key
+        # order, so the table is never held in memory at once.
+        pk = model_admin.pk
+        query, search_fields = self.resolve_fields(
+            model_admin, model_admin.model.select())
+        columns = [field for name, field in search_fields]
+        names = ['rowid'] + [name for name, field in search_fields]
+        query = query.columns(pk, *columns).order_by(pk).tuples()
+
+        count = 0
+        last = None
+        fts_db = self.fts_model._meta.database
+        with fts_db.atomic():
+            self.fts_model.delete().execute()
+            while True:
+                batch = query if last is None else query.where(pk > last)
+                rows = list(batch.limit(chunk_size))
+                if not rows:
+                    break
+                self.fts_model.insert_many(
+                    [dict(zip(names, row)) for row in rows]).execute()
+                last = rows[-1][0]
+                count += len(rows)
+        return count
+
+
+class PostgresFullTextSearch(SearchBackend):
+    """
+    Postgres full-text search, ``to_tsvector(config, column) @@
+    plainto_tsquery(config, term)`` per search field. Each predicate can use a
+    GIN expression index over the same to_tsvector() call, e.g.
+    ``CREATE INDEX ON message USING gin (to_tsvector('english', content))``.
+    """
+    def __init__(self, config='english'):
+        self.config = config
+
+    def match(self, field, term):
+        return Expression(fn.to_tsvector(self.config, field), '@@',
+                          fn.plainto_tsquery(self.config, term))
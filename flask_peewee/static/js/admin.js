@@ -17,7 +17,9 @@ var Admin = window.Admin || {};
     };
   }
 
-  /* paginated list of models displayed in a modal window */
+  /* paginated list of models displayed in a modal window. pages are fetched
+     by keyset: "next" sends the cursor of the last row shown, and the cursors
+     of the pages before are kept so "previous" can go back. */
   function AjaxModalList(modal_elem, on_select) {
     var self = this;
     this.modal_elem = modal_elem;
@@ -27,24 +29,39 @@ var Admin = window.Admin || {};
     this.next_btn = modal_elem.querySelector('a.next');
     this.prev_btn = modal_elem.querySelector('a.previous');
     this.on_select = on_select;
+    this.cursors = [];
+    this.cursor = '';
+    this.next_after = null;
 
     this.input.addEventListener('keyup', debounce(function() {
-      self.load(self.input.dataset.ajaxUrl);
+      self.cursors = [];
+      self.load('');
     }, 200));
 
-    [this.prev_btn, this.next_btn].forEach(function(btn) {
-      btn.addEventListener('click', function(e) {
-        e.preventDefault();
-        if (!btn.classList.contains('disabled') && btn.dataset.page) {
-          self.load(self.input.dataset.ajaxUrl + '&page=' + btn.dataset.page);
-        }
-      });
+    this.next_btn.addEventListener('click', function(e) {
+      e.preventDefault();
+      if (self.next_after) {
+        self.cursors.push(self.cursor);
+        self.load(self.next_after);
+      }
+    });
+    this.prev_btn.addEventListener('click', function(e) {
+      e.preventDefault();
+      if (self.cursors.length) {
+        self.load(self.cursors.pop());
+      }
     });
   }
 
-  AjaxModalList.prototype.load = function(url) {
-    var self = this;
-    getJSON(url + '&query=' + encodeURIComponent(this.input.value), function(data) {
+  AjaxModalList.prototype.load = function(after) {
+    var self = this,
+        url = this.input.dataset.ajaxUrl + '&query=' + encodeURIComponent(this.input.value);
+    if (after) {
+      url += '&after=' + encodeURIComponent(after);
+    }
+    getJSON(url, function(data) {
+      self.cursor = after;
+      self.next_after = data.next_after;
       self.list.innerHTML = '';
       data.object_list.forEach(function(o) {
         var link = document.createElement('a');
@@ -60,15 +77,14 @@ var Admin = window.Admin || {};
         self.list.appendChild(li);
       });
 
-      [[self.prev_btn, data.prev_page], [self.next_btn, data.next_page]].forEach(function(pair) {
-        pair[0].classList.toggle('disabled', !pair[1]);
-        pair[0].dataset.page = pair[1] || '';
-      });
+      self.prev_btn.classList.toggle('disabled', !self.cursors.length);
+      self.next_btn.classList.toggle('disabled', !data.next_after);
     });
   };
 
   AjaxModalList.prototype.open = function() {
-    this.load(this.input.dataset.ajaxUrl);
+    this.cursors = [];
+    this.load('');
     this.modal.show();
   };
 
@@ -215,6 +231,26 @@ var Admin = window.Admin || {};
     return this.add_row(elem.dataset.field, elem.dataset.select);
   };
 
+  /* check every row on the page, offering to select all matching rows */
+  A.select_page = function(checked) {
+    var form = document.getElementById('model-list');
+    form.querySelectorAll('td input[name=id]').forEach(function(cb) { cb.checked = checked; });
+    var row = form.querySelector('tr.select-all');
+    if (row) row.classList.toggle('d-none', !checked);
+    if (!checked) A.select_all(false);
+  };
+
+  /* act on every row matching the filters and search, not just this page */
+  A.select_all = function(on) {
+    var form = document.getElementById('model-list');
+    form.querySelector('input[name=select_all]').value = on ? '1' : '';
+    form.querySelector('.select-page-msg').classList.toggle('d-none', on);
+    form.querySelector('.select-all-msg').classList.toggle('d-none', !on);
+    if (!on && !form.querySelector('th input[type=checkbox]').checked) {
+      form.querySelector('tr.select-all').classList.add('d-none');
+    }
+  };
+
   /* bulk action helper for the model list */
   A.index_submit = function(action) {
     var form = document.getElementById('model-list');
@@ -2,8 +2,12 @@
 import datetime
 import json
 import re
+import threading
+from unittest import mock
+from urllib.parse import quote
 
 from flask import g
+from flask import has_app_context
 from flask import request
 from flask import session
 from flask import url_for
@@ -11,13 +15,17 @@ from flask import url_for
 from flask_peewee.admin import AdminFilterModelConverter
 from flask_peewee.admin import AdminPanel
 from flask_peewee.admin import Export
+from flask_peewee.admin import InlineModelAdmin
 from flask_peewee.admin import ModelAdmin
+from flask_peewee.admin import StatsPanel
 from flask_peewee.serializer import Serializer
 from flask_peewee.filters import FilterForm
 from flask_peewee.filters import FilterMapping
 from flask_peewee.filters import FilterModelConverter
 from flask_peewee.filters import make_field_tree
+from flask_peewee.utils import KeysetPaginatedQuery
 from flask_peewee.utils import PaginatedQuery
+from flask_peewee.utils import TTLCache
 from flask_peewee.tests.base import FlaskPeeweeTestCase
 from flask_peewee.tests.test_app import AModel
 from flask_peewee.tests.test_app import BDetails
@@ -25,9 +33,11 @@ from flask_peewee.tests.test_app import BModel
 from flask_peewee.tests.test_app import CModel
 from flask_peewee.tests.test_app import DModel
 from flask_peewee.tests.test_app import Entry
+from flask_peewee.tests.test_app import HModel
 from flask_peewee.tests.test_app import Link
 from flask_peewee.tests.test_app import Message
 from flask_peewee.tests.test_app import Note
+from flask_peewee.tests.test_app import Page
 from flask_peewee.tests.test_app import ScopedItem
 from flask_peewee.tests.test_app import ScopedRef
 from flask_peewee.tests.test_app import TSModel
@@ -38,8 +48,13 @@ from flask_peewee.utils import check_password
 from flask_peewee.utils import get_next
 from flask_peewee.utils import make_password
 
+from peewee import BooleanField
 from peewee import CharField
+from peewee import fn
 from peewee import ForeignKeyField
+from peewee import IntegerField
+from peewee import OperationalError
+from werkzeug.datastructures import MultiDict
 from wtforms.fields import FieldList
 from wtforms.fields import StringField
 from wtfpeewee.orm import model_form
@@ -133,11 +148,14 @@ class AdminTestCase(BaseAdminTestCase):
             admin._registry[Entry],
             admin._registry[Message],
             admin._registry[Note],
+            admin._registry[Page],
             admin._registry[ScopedItem],
             admin._registry[ScopedRef],
             admin._registry[User],
         ])
         self.assertContext('panels', [
+            admin._panels['Audit log'],
+            admin._panels['Exports'],
             admin._panels['Notes'],
         ])
 
@@ -546,6 +564,473 @@ class AdminTestCase(BaseAdminTestCase):
             data = json.loads(resp.data.decode('utf8'))
             self.assertEqual(data['object_list'], [])
 
+    def test_ajax_list_keyset_and_cache(self):
+        from flask_peewee.search import PrefixSearch
+        self.create_users()
+        for i in range(20):
+            ScopedItem.create(label='item-%02d' % i)
+        ScopedItem.create(label='other')
+        ScopedItem.create(label='item-99', hidden=True)
+
+        ref_admin = admin[ScopedRef]
+        load = lambda c, url: json.loads(c.get(url).data.decode('utf8'))
+        with self.flask_app.test_client() as c:
+            self.login(c)
+
+            # pages end with a cursor, and following it seeks past the last
+            # row without an offset or a count.
+            data = load(c, '/admin/scopedref/_ajax/?field=item&query=item')
+            self.assertEqual([o['id'] for o in data['object_list']],
+                             list(range(1, 16)))
+            self.assertEqual(data['next_page'], 2)
+            self.assertTrue(data['next_after'])
+
+            data = load(c, '/admin/scopedref/_ajax/?field=item&query=item'
+                           '&after=%s' % data['next_after'])
+            self.assertEqual([o['id'] for o in data['object_list']],
+                             list(range(16, 21)))
+            self.assertIsNone(data['next_after'])
+
+            # the old page protocol still works, without a count.
+            data = load(c, '/admin/scopedref/_ajax/?field=item&query=item&page=2')
+            self.assertEqual([o['id'] for o in data['object_list']],
+                             list(range(16, 21)))
+            self.assertEqual((data['prev_page'], data['next_page']), (1, 0))
+
+            # a garbled cursor is ignored rather than a 500.
+            data = load(c, '/admin/scopedref/_ajax/?field=item&after=nope')
+            self.assertEqual(len(data['object_list']), 15)
+
+            ref_admin.ajax_search_backend = PrefixSearch()
+            ref_admin.ajax_cache = TTLCache(60)
+            try:
+                data = load(c, '/admin/scopedref/_ajax/?field=item&query=item-1')
+                self.assertEqual(len(data['object_list']), 10)
+                # substring matches are not prefix matches.
+                data = load(c, '/admin/scopedref/_ajax/?field=item&query=ther')
+                self.assertEqual(data['object_list'], [])
+
+                # a burst of the same lookup is answered from the cache.
+                ScopedItem.update(label='item-1x').where(
+                    ScopedItem.label == 'other').execute()
+                data = load(c, '/admin/scopedref/_ajax/?field=item&query=item-1')
+                self.assertEqual(len(data['object_list']), 10)
+                ref_admin.ajax_cache.clear()
+                data = load(c, '/admin/scopedref/_ajax/?field=item&query=item-1')
+                self.assertEqual(len(data['object_list']), 11)
+            finally:
+                ref_admin.ajax_search_backend = None
+                ref_admin.ajax_cache = None
+
+    def test_ajax_list_keyset_nullable(self):
+        # a nullable lookup field sorts its NULLs last, and the cursor seeks
+        # into and through them instead of stopping at the first.
+        class Tag(db.Model):
+            name = CharField(null=True)
+        class Tagged(db.Model):
+            tag = ForeignKeyField(Tag)
+
+        db.database.create_tables([Tag, Tagged])
+        try:
+            for name in ('b', None, 'a', None, 'c'):
+                Tag.create(name=name)
+            tagged_admin = ModelAdmin(admin, Tagged)
+            tagged_admin.foreign_key_lookups = {'tag': 'name'}
+            tagged_admin.filter_paginate_by = 2
+
+            seen = []
+            after = ''
+            for i in range(4):
+                url = '/?field=tag' + (after and '&after=' + after)
+                with self.flask_app.test_request_context(url):
+                    data = json.loads(tagged_admin.ajax_list().data)
+                seen.extend(o['repr'] for o in data['object_list'])
+                after = data['next_after']
+                if not after:
+                    break
+            names = dict((str(t), t.name) for t in Tag.select())
+            self.assertEqual([names[r] for r in seen],
+                             ['a', 'b', 'c', None, None])
+        finally:
+            db.database.drop_tables([Tagged, Tag])
+
+        with self.assertRaises(ValueError):
+            KeysetPaginatedQuery(HModel.select(), 10, HModel.h_date)
+
+    def test_inline_formset(self):
+        self.create_users()
+        item = ScopedItem.create(label='item')
+        other = ScopedItem.create(label='other')
+        r1 = ScopedRef.create(item=item, name='r1')
+        r2 = ScopedRef.create(item=item, name='r2')
+        r3 = ScopedRef.create(item=item, name='r3')
+        foreign = ScopedRef.create(item=other, name='foreign')
+
+        with self.flask_app.test_client() as c:
+            self.login(c)
+
+            resp = c.get('/admin/scopeditem/%d/' % item.id)
+            self.assertEqual(resp.status_code, 200)
+            html = resp.data.decode('utf8')
+            self.assertIn('name="scopedref_item-TOTAL" value="4"', html)
+            self.assertIn('name="scopedref_item-0-_pk" value="%d"' % r1.id, html)
+            self.assertIn('value="r2"', html)
+            self.assertNotIn('foreign', html)
+
+            def post(rows, **data):
+                data.update({'label': 'item', 'scopedref_item-TOTAL': len(rows)})
+                for i, row in enumerate(rows):
+                    for key, value in row.items():
+                        data['scopedref_item-%d-%s' % (i, key)] = value
+                return c.post('/admin/scopeditem/%d/' % item.id, data=data)
+
+            # an inline error keeps the parent from saving too.
+            resp = post([{'_pk': r1.id, 'name': ''}], label='changed')
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(ScopedItem.get_by_id(item.id).label, 'item')
+
+            with self.capture_queries() as statements:
+                resp = post([
+                    {'_pk': r1.id, 'name': 'r1'},  # unchanged
+                    {'_pk': r2.id, 'name': 'r2 edited'},
+                    {'_pk': r3.id, 'name': 'r3', '_delete': '1'},
+                    {'_pk': '', 'name': 'r4'},
+                    {'_pk': foreign.id, 'name': 'hijacked'},
+                ])
+            self.assertEqual(resp.status_code, 302)
+
+        names = [r.name for r in ScopedRef.select().where(
+            ScopedRef.item == item).order_by(ScopedRef.id)]
+        self.assertEqual(names, ['r1', 'r2 edited', 'r4'])
+        self.assertEqual(ScopedRef.get_by_id(foreign.id).name, 'foreign')
+
+        # one select loads the children, one statement per kind of write.
+        def count(prefix, table='"scopedref"'):
+            return len([sql for sql in statements
+                        if sql.startswith(prefix) and table in sql])
+        self.assertEqual(count('SELECT'), 1)
+        self.assertEqual(count('UPDATE'), 1)
+        self.assertEqual(count('INSERT'), 1)
+        self.assertEqual(count('DELETE'), 1)
+
+        # on the add page the children are inserted once the parent has a pk,
+        # and a blank extra row is skipped.
+        with self.flask_app.test_client() as c:
+            self.login(c)
+            resp = c.post('/admin/scopeditem/add/', data={
+                'label': 'new', 'scopedref_item-TOTAL': 2,
+                'scopedref_item-0-name': 'child',
+                'scopedref_item-1-name': ''})
+            self.assertEqual(resp.status_code, 302)
+        new = ScopedItem.get(ScopedItem.label == 'new')
+        self.assertEqual([r.name for r in new.scopedref_set], ['child'])
+
+    def test_inline_formset_blank_rows(self):
+        # a child made only of a select and a checkbox: a row posted as it
+        # was rendered is blank, a row with either one changed is added.
+        class Shelf(db.Model):
+            label = CharField()
+        class Flag(db.Model):
+            shelf = ForeignKeyField(Shelf)
+            color = CharField(choices=[('red', 'Red'), ('blue', 'Blue')])
+            starred = BooleanField(default=False)
+
+        class FlagInline(InlineModelAdmin):
+            model = Flag
+            extra = 3
+
+        db.database.create_tables([Shelf, Flag])
+        try:
+            shelf = Shelf.create(label='shelf')
+            inline = FlagInline(ModelAdmin(admin, Shelf))
+            formdata = MultiDict([
+                ('flag_shelf-TOTAL', '3'),
+                ('flag_shelf-0-color', 'red'),
+                ('flag_shelf-1-color', 'blue'),
+                ('flag_shelf-2-color', 'red'),
+                ('flag_shelf-2-starred', 'y')])
+            with self.flask_app.test_request_context():
+                formset = inline.get_formset(shelf, formdata)
+                self.assertEqual(len(list(formset.get_active_rows())), 2)
+                self.assertTrue(formset.validate())
+                formset.save(shelf)
+            flags = [(f.color, f.starred) for f in
+                     Flag.select().order_by(Flag.id)]
+            self.assertEqual(flags, [('blue', False), ('red', True)])
+        finally:
+            db.database.drop_tables([Flag, Shelf])
+
+    def test_save_only_changed_fields(self):
+        self.create_users()
+        page = Page.create(title='t1', body='b1')
+        url = '/admin/page/%d/' % page.id
+
+        with self.flask_app.test_client() as c:
+            self.login(c)
+
+            # the version rides along in a hidden input, with no label row.
+            html = c.get(url).data.decode('utf8')
+            self.assertIn('name="version" type="hidden" value="1"', html)
+            self.assertNotIn('for="version"', html)
+
+            with self.capture_queries() as queries:
+                resp = c.post(url, data={'title': 't1', 'body': 'b1', 'version': 1})
+            self.assertEqual(resp.status_code, 302)
+            self.assertFalse([sql for sql in queries if sql.startswith('UPDATE')])
+
+            with self.capture_queries() as queries:
+                resp = c.post(url, data={'title': 't2', 'body': 'b1', 'version': 1})
+            self.assertEqual(resp.status_code, 302)
+            updates = [sql for sql in queries if sql.startswith('UPDATE')]
+            self.assertEqual(len(updates), 1)
+            self.assertIn('"title"', updates[0])
+            self.assertNotIn('"body"', updates[0])
+
+            page = Page.get_by_id(page.id)
+            self.assertEqual((page.title, page.version), ('t2', 2))
+
+            # a form rendered before that save carries version 1 and no longer
+            # overwrites the row.
+            resp = c.post(url, data={'title': 't3', 'body': 'b1', 'version': 1})
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn('changed by someone else', resp.data.decode('utf8'))
+            page = Page.get_by_id(page.id)
+            self.assertEqual((page.title, page.version), ('t2', 2))
+
+    def test_audit_log(self):
+        from flask_peewee.admin import Action
+        from flask_peewee.audit import AuditLog
+        from flask_peewee.tests.test_app import AuditEntry
+        from flask_peewee.tests.test_app import audit_log
+
+        class Noop(Action):
+            def run(self, model_admin, id_list):
+                pass
+
+        self.create_users()
+        admin.audit_log = audit_log
+        page_admin = admin[Page]
+        page_admin.action_map = {'noop': Noop()}
+        try:
+            with self.flask_app.test_client() as c:
+                self.login(c)
+                c.post('/admin/page/add/', data={'title': 't1', 'body': 'b1',
+                                                 'version': 1})
+                page = Page.get()
+                url = '/admin/page/%d/' % page.id
+                c.post(url, data={'title': 't2', 'body': 'b1', 'version': 1})
+                # saving without changes records nothing.
+                c.post(url, data={'title': 't2', 'body': 'b1', 'version': 2})
+                c.post('/admin/page/', data={'action': 'noop', 'id': page.id})
+                c.post('/admin/page/delete/', data={'id': page.id})
+
+                # the test app's log is inline, so each request wrote its own.
+                entries = list(AuditEntry.select().order_by(AuditEntry.id))
+                self.assertEqual([(e.action, e.model, e.username)
+                                  for e in entries],
+                                 [('add', 'page', 'admin'),
+                                  ('edit', 'page', 'admin'),
+                                  ('noop', 'page', 'admin'),
+                                  ('delete', 'page', 'admin')])
+                self.assertEqual(entries[0].get_data(), {
+                    'id': [None, page.id], 'title': [None, 't1'],
+                    'body': [None, 'b1'], 'version': [None, 1]})
+                self.assertEqual(entries[1].get_data(), {
+                    'title': ['t1', 't2'], 'version': [1, 2]})
+                self.assertEqual(entries[2].object_id, None)
+                self.assertEqual(entries[2].get_data(), {'id': [str(page.id)]})
+                self.assertEqual(entries[3].get_data()['title'], ['t2', None])
+
+                # the log page, narrowed to one action.
+                resp = c.get('/admin/audit-log/?action=edit')
+                body = resp.data.decode('utf8')
+                self.assertEqual(resp.status_code, 200)
+                self.assertIn('t1 &rarr; t2', body)
+                self.assertNotIn('noop', body)
+                self.assertIn('<a href="%s">#%d</a>' % (url, page.id), body)
+
+            # an inline failing to save rolls the parent back, and a queued
+            # entry for it is never written.
+            class FailingFormSet(object):
+                def save(self, parent):
+                    raise ValueError
+            admin.audit_log = queued = AuditLog(db, model=AuditEntry)
+            queued.start = lambda: None
+            with self.flask_app.test_request_context():
+                form = page_admin.get_form(adding=True)(
+                    MultiDict({'title': 't3', 'version': '1'}))
+                self.assertRaises(ValueError, page_admin.save_with_inlines,
+                                  Page(), form, [FailingFormSet()], True)
+            self.assertEqual(Page.select().count(), 0)
+            self.assertEqual(queued._queue.qsize(), 0)
+        finally:
+            admin.audit_log = None
+            page_admin.action_map = {}
+
+        # values of audit_exclude fields are left out.
+        self.assertEqual(admin[User].get_changes(
+            {'password': 'a', 'email': 'x'}, {'password': 'b', 'email': 'x'}),
+            {'password': [None, None]})
+
+        # by default entries are queued for the writer thread, and stop()
+        # flushes whatever it has not yet written.
+        log = AuditLog(db, model=AuditEntry, interval=0.01)
+        self.assertFalse(log.inline)
+        AuditEntry.delete().execute()
+        for i in range(3):
+            log.record('page', 'edit', i)
+        self.assertTrue(log._thread.is_alive())
+        log.stop(5)
+        self.assertIsNone(log._thread)
+        self.assertEqual(sorted(e.object_id for e in AuditEntry.select()),
+                         ['0', '1', '2'])
+
+        # past max_queue entries, writes are synchronous. queued entries go
+        # out in one INSERT.
+        log = AuditLog(db, model=AuditEntry, max_queue=2)
+        log.start = lambda: None
+        AuditEntry.delete().execute()
+        for i in range(3):
+            log.record('page', 'edit', i)
+        self.assertEqual([e.object_id for e in AuditEntry.select()], ['2'])
+        with self.capture_queries() as queries:
+            self.assertEqual(log.flush(), 2)
+        self.assertEqual(len([sql for sql in queries
+                              if sql.startswith('INSERT')]), 1)
+        self.assertEqual(AuditEntry.select().count(), 3)
+
+        # inside atomic() entries wait for the commit, and a rolled back
+        # block, or savepoint, drops its own.
+        AuditEntry.delete().execute()
+        with log.atomic(db.database):
+            log.record('page', 'edit', 'kept')
+            try:
+                with log.atomic(db.database):
+                    log.record('page', 'edit', 'inner')
+                    raise ValueError
+            except ValueError:
+                pass
+            self.assertEqual(log._queue.qsize(), 0)
+        try:
+            with log.atomic(db.database):
+                log.record('page', 'edit', 'rolled back')
+                raise ValueError
+        except ValueError:
+            pass
+        log.flush()
+        self.assertEqual([e.object_id for e in AuditEntry.select()], ['kept'])
+
+        # a batch that can't be written is logged, and counted.
+        with self.assertLogs('flask_peewee.audit', 'ERROR'):
+            log.write([{'model': None, 'action': 'edit'}])
+        self.assertEqual(log.dropped, 1)
+
+        # a locked database is retried, sleeping only between attempts.
+        locked = OperationalError('database is locked')
+        with mock.patch.object(AuditEntry, 'insert_many', side_effect=locked):
+            with mock.patch('flask_peewee.audit.time.sleep') as sleep:
+                with self.assertLogs('flask_peewee.audit', 'ERROR'):
+                    log.write([{'model': 'page', 'action': 'edit'}])
+        self.assertEqual(sleep.call_count, log.retries - 1)
+        self.assertEqual(log.dropped, 2)
+
+        # user_id takes the type of the user model's primary key.
+        class Account(db.Model):
+            name = CharField(max_length=40, primary_key=True)
+        user_id = AuditLog(db, db_table='a', user_model=Account).model.user_id
+        self.assertIsInstance(user_id, CharField)
+        self.assertEqual((user_id.max_length, user_id.null), (40, True))
+        user_id = AuditLog(db, db_table='b', user_model=User).model.user_id
+        self.assertEqual(type(user_id), IntegerField)
+
+    def test_list_editable(self):
+        users = self.create_users()
+        notes = [Note.create(user=users[0], message='n%d' % i) for i in range(3)]
+
+        note_admin = admin[Note]
+        note_admin.list_editable = ('message',)
+        try:
+            with self.flask_app.test_client() as c:
+                self.login(c)
+
+                html = c.get('/admin/note/?ordering=id').data.decode('utf8')
+                self.assertIn('name="row-%d-message"' % notes[0].id, html)
+                self.assertIn('name="_save_list"', html)
+
+                def post(values):
+                    data = {'_save_list': '1', 'action': '',
+                            '_list_pk': [n.id for n in notes]}
+                    for note, value in zip(notes, values):
+                        data['row-%d-message' % note.id] = value
+                    return c.post('/admin/note/?ordering=id', data=data)
+
+                # a row that fails validation holds back the whole page, and
+                # is re-rendered with its error and the submitted values.
+                resp = post(['n0', '', 'changed'])
+                self.assertEqual(resp.status_code, 200)
+                html = resp.data.decode('utf8')
+                self.assertIn('had errors', html)
+                self.assertIn('invalid-feedback', html)
+                self.assertIn('changed', html)
+                self.assertEqual(Note.get_by_id(notes[2].id).message, 'n2')
+
+                with self.capture_queries() as queries:
+                    resp = post(['n0', 'one', 'two'])
+                self.assertEqual(resp.status_code, 302)
+                # rows are saved as the edit view saves them, and the
+                # unchanged row is not written.
+                updates = [sql for sql in queries if sql.startswith('UPDATE')]
+                self.assertEqual(len(updates), 2)
+                self.assertEqual(
+                    [n.message for n in Note.select().order_by(Note.id)],
+                    ['n0', 'one', 'two'])
+        finally:
+            note_admin.list_editable = None
+
+        # the version field is posted with each row, a row changed since the
+        # page was rendered holds back the others, and saves are audited.
+        from flask_peewee.tests.test_app import AuditEntry
+        from flask_peewee.tests.test_app import audit_log
+        pages = [Page.create(title='p%d' % i) for i in range(2)]
+        page_admin = admin[Page]
+        page_admin.list_editable = ('title',)
+        page_admin.columns = ('title',)
+        admin.audit_log = audit_log
+        try:
+            with self.flask_app.test_client() as c:
+                self.login(c)
+                html = c.get('/admin/page/').data.decode('utf8')
+                self.assertIn('name="row-%d-version" type="hidden" value="1"' %
+                              pages[0].id, html)
+
+                def post(titles, version=1):
+                    data = {'_save_list': '1', 'action': '',
+                            '_list_pk': [p.id for p in pages]}
+                    for page, title in zip(pages, titles):
+                        data['row-%d-title' % page.id] = title
+                        data['row-%d-version' % page.id] = version
+                    return c.post('/admin/page/', data=data)
+
+                Page.update(version=2).where(Page.id == pages[1].id).execute()
+                resp = post(['a', 'b'])
+                self.assertEqual(resp.status_code, 200)
+                self.assertIn('changed by someone else', resp.data.decode('utf8'))
+                self.assertEqual([p.title for p in Page.select().order_by(Page.id)],
+                                 ['p0', 'p1'])
+
+                Page.update(version=1).execute()
+                self.assertEqual(post(['a', 'p1']).status_code, 302)
+                self.assertEqual(
+                    [(p.title, p.version) for p in Page.select().order_by(Page.id)],
+                    [('a', 2), ('p1', 1)])
+                entry, = AuditEntry.select()
+                self.assertEqual(entry.get_data(),
+                                 {'title': ['p0', 'a'], 'version': [1, 2]})
+        finally:
+            admin.audit_log = None
+            del page_admin.list_editable
+            del page_admin.columns
+
     def test_fk_select_respects_related_get_query(self):
         # the non-ajax FK pickers (edit-form select, filter-form select) draw
         # candidates from the related admin's get_query(), so a scoped-out row
@@ -573,6 +1058,71 @@ class AdminTestCase(BaseAdminTestCase):
             self.assertIn('visible', labels)
             self.assertNotIn('hidden', labels)
 
+    def test_fk_select_switches_to_lookup_when_large(self):
+        # past foreign_key_select_limit visible related rows the <select> is
+        # replaced by the lookup picker, and either way the submitted pk is
+        # checked against the related admin's query.
+        v1 = ScopedItem.create(label='v1')
+        ScopedItem.create(label='v2')
+        hidden = ScopedItem.create(label='hidden', hidden=True)
+
+        class PlainRefAdmin(ModelAdmin):
+            foreign_key_select_limit = 2
+
+        ref_admin = PlainRefAdmin(admin, ScopedRef)
+        self.assertIsNone(ModelAdmin.foreign_key_select_limit)
+        with self.flask_app.test_request_context():
+            # hidden rows do not count toward the limit.
+            self.assertEqual(ref_admin.get_foreign_key_lookups(), {})
+            form = ref_admin.get_add_form()()
+            self.assertEqual(form.item.type, 'ScopedModelSelectField')
+
+        ScopedItem.create(label='v3')
+        ref_admin.relation_size_cache.clear()
+        with self.flask_app.test_request_context():
+            # the lookups are worked out once per request.
+            sized = []
+            ref_admin.get_relation_size = lambda rel_model: sized.append(
+                rel_model) or PlainRefAdmin.get_relation_size(ref_admin,
+                                                              rel_model)
+            self.assertEqual(ref_admin.get_foreign_key_lookups(),
+                             {'item': 'label'})
+            self.assertEqual(ref_admin.get_foreign_key_lookups(),
+                             {'item': 'label'})
+            self.assertEqual(sized, [ScopedItem])
+            del ref_admin.get_relation_size
+
+            form_cls = ref_admin.get_add_form()
+            form = form_cls(MultiDict({'item': str(v1.id), 'name': 'r'}))
+            self.assertEqual(form.item.type, 'ScopedModelHiddenField')
+            self.assertTrue(form.validate())
+            self.assertEqual(form.item.data, v1)
+
+            for value in (str(hidden.id), '999'):
+                form = form_cls(MultiDict({'item': value, 'name': 'r'}))
+                self.assertFalse(form.validate())
+                self.assertEqual(list(form.errors), ['item'])
+
+        ref_admin.foreign_key_select_limit = None
+        with self.flask_app.test_request_context():
+            self.assertEqual(ref_admin.get_foreign_key_lookups(), {})
+
+        # a get_query() scoped per user is sized, and cached, per scope.
+        ref_admin.foreign_key_select_limit = 3
+        item_admin = admin[ScopedItem]
+        item_admin.get_query = lambda: ScopedItem.select().where(
+            (ScopedItem.hidden == False) | (g.show_hidden == True))
+        try:
+            with self.flask_app.test_request_context():
+                g.show_hidden = False
+                self.assertEqual(ref_admin.get_foreign_key_lookups(), {})
+            with self.flask_app.test_request_context():
+                g.show_hidden = True
+                self.assertEqual(ref_admin.get_foreign_key_lookups(),
+                                 {'item': 'label'})
+        finally:
+            del item_admin.get_query
+
     def test_ajax_list_bad_field_returns_empty(self):
         # the /_ajax/ route exists on every admin, so it must not 500 on inputs
         # it accepts: no field, a real fk the admin did not configure for
@@ -875,6 +1425,54 @@ class AdminTestCase(BaseAdminTestCase):
         self.assertEqual(counts, [])
         self.assertEqual(resp.mimetype, 'application/json')
 
+    def test_export_in_background(self):
+        import gzip
+        from flask_peewee.tests.test_app import export_runner
+        users = self.create_users()
+        for user in users:
+            Note.create(user=user, message='note-%s' % user.username)
+
+        with self.flask_app.test_client() as c:
+            self.login(c)
+
+            # the background option is offered only when a runner is set.
+            self.assertIn(b'name="background"', c.get('/admin/note/export/').data)
+            self.assertNotIn(b'name="background"', c.get('/admin/user/export/').data)
+
+            resp = c.post('/admin/note/export/?fo_user=eq&fv_user=%s' % self.admin.id,
+                          data={'fields': ['message', 'user__password'],
+                                'background': '1'})
+            self.assertRedirect(resp)
+            self.assertTrue(resp.headers['location'].endswith('/admin/'))
+
+            job = export_runner.get_jobs()[0].wait()
+            self.assertEqual(job.status, job.DONE)
+            self.assertEqual((job.progress, job.total), (1, 1))
+            with gzip.open(job.path) as fh:
+                # filters apply, and the allowlist still drops user__password.
+                self.assertEqual(json.loads(fh.read()), [{'message': 'note-admin'}])
+
+            self.assertEqual(job.owner, self.admin.id)
+            self.assertIn(job.filename, c.get('/admin/').data.decode('utf8'))
+
+            resp = c.get('/admin/exports/%s/download/' % job.id)
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(json.loads(gzip.decompress(resp.data)),
+                             [{'message': 'note-admin'}])
+            resp.close()
+
+        # another admin neither sees the job nor downloads it.
+        self.create_user('other', 'other', admin=True)
+        with self.flask_app.test_client() as c:
+            c.post('/accounts/login/', data={'username': 'other',
+                                             'password': 'other'})
+            self.assertNotIn(job.filename,
+                             c.get('/admin/').data.decode('utf8'))
+            resp = c.get('/admin/exports/%s/download/' % job.id)
+            self.assertEqual(resp.status_code, 404)
+
+            self.assertEqual(c.get('/admin/exports/missing/download/').status_code, 404)
+
     def test_export_excludes_sensitive_fields(self):
         self.create_users()
 
@@ -977,6 +1575,85 @@ class AdminTestCase(BaseAdminTestCase):
             self.assertEqual(pq.get_page_range(),
                              [1, None, 7, 8, 9, 10, 11, 12, 13, None, 20])
 
+    def test_counted_pagination(self):
+        user = self.create_user('paginate', 'paginate')
+        for i in range(45):
+            Note.create(user=user, message='n%d' % i)
+
+        class CappedNoteAdmin(ModelAdmin):
+            count_mode = 'capped'
+            count_cap = 30
+            count_cache_timeout = 60
+
+        note_admin = CappedNoteAdmin(admin, Note)
+        with self.flask_app.test_request_context('/?page=1'):
+            pq = note_admin.get_paginated_query(Note.select())
+            self.assertEqual(pq.get_count(), 30)
+            self.assertTrue(pq.is_count_approximate())
+            self.assertEqual(pq.get_count_display(), '30+')
+            self.assertTrue(pq.has_next())
+            self.assertEqual(len(pq.get_list()), 20)
+
+            # the count is cached per query signature: new rows do not show
+            # until it expires, and a different filter counts afresh.
+            Note.create(user=user, message='late')
+            filtered = Note.select().where(Note.message.startswith('n1'))
+            pq = note_admin.get_paginated_query(filtered)
+            self.assertEqual(pq.get_count_display(), '11')
+            self.assertFalse(pq.is_count_approximate())
+
+            note_admin.count_cache.clear()
+            note_admin.count_cap = 100
+            pq = note_admin.get_paginated_query(Note.select())
+            self.assertEqual(pq.get_count_display(), '46')
+
+        # 'estimate' reads sqlite_stat1 after ANALYZE, but only while the
+        # list is unfiltered.
+        note_admin = CappedNoteAdmin(admin, Note)
+        note_admin.count_mode = 'estimate'
+        db.database.execute_sql('ANALYZE')
+        try:
+            with self.flask_app.test_request_context('/?page=1'):
+                pq = note_admin.get_paginated_query(Note.select())
+                self.assertEqual(pq.get_count_display(), '~46')
+                pq = note_admin.get_paginated_query(
+                    Note.select().where(Note.id > 40))
+                self.assertEqual(pq.get_count_display(), '6')
+        finally:
+            db.database.execute_sql('DROP TABLE IF EXISTS sqlite_stat1')
+
+        # the index renders the approximate count and keeps "Next" enabled.
+        self.create_users()
+        note_admin = admin[Note]
+        note_admin.count_mode = 'capped'
+        note_admin.count_cap = 30
+        try:
+            with self.flask_app.test_client() as c:
+                self.login(c)
+                resp = c.get('/admin/note/?page=2')
+                body = resp.data.decode('utf-8')
+                self.assertIn('30+ records', body)
+                self.assertIn('page 2 of 3+', body)
+                self.assertIn('page=3">Next', body)
+                self.assertIn('page=3">3</a>', body)
+
+                # past the last row "Next" goes away, whatever the count.
+                resp = c.get('/admin/note/?page=3')
+                body = resp.data.decode('utf-8')
+                self.assertIn('page 3 of 3+', body)
+                self.assertNotIn('page=4">Next', body)
+                self.assertIn('<span class="page-link">Next</span>', body)
+
+            # the page range reaches the page being read, past the count.
+            with self.flask_app.test_request_context('/?page=10'):
+                pq = note_admin.get_paginated_query(Note.select())
+                self.assertEqual(pq.get_pages(), 10)
+                self.assertEqual(pq.get_page_range(),
+                                 [1, None, 7, 8, 9, 10])
+        finally:
+            del note_admin.count_mode
+            del note_admin.count_cap
+
     def test_model_admin_index_pagination(self):
         users = self.create_users()
         notes = {}
@@ -1012,6 +1689,284 @@ class AdminTestCase(BaseAdminTestCase):
             query = self.get_context('query')
             self.assertEqual(list(query.get_list()), notes[users[2]])
 
+    def test_keyset_pagination(self):
+        users = self.create_users()
+        base = datetime.datetime(2024, 1, 1)
+        notes = [Note.create(user=users[i % 2], message='n%02d' % i,
+                             created_date=base + datetime.timedelta(days=i // 2))
+                 for i in range(25)]
+
+        note_admin = admin[Note]
+        note_admin.pagination = 'keyset'
+        note_admin.paginate_by = 10
+        try:
+            with self.flask_app.test_client() as c:
+                self.login(c)
+
+                # seeks on the ordering column, the pk breaking the ties
+                # between notes created the same day.
+                resp = c.get('/admin/note/?ordering=-created_date')
+                query = self.get_context('query')
+                expected = sorted(notes, key=lambda n: (n.created_date, n.id),
+                                  reverse=True)
+                self.assertEqual(query.get_list(), expected[:10])
+                self.assertIsNone(query.get_prev_args())
+                body = resp.data.decode('utf-8')
+                self.assertIn('name="jump"', body)
+                self.assertNotIn('page=2', body)
+
+                pages = []
+                url = '/admin/note/?ordering=-created_date'
+                while url:
+                    with self.capture_queries() as queries:
+                        c.get(url)
+                    query = self.get_context('query')
+                    pages.append(query.get_list())
+                    self.assertFalse([sql for sql in queries
+                                      if 'FROM "note"' in sql and 'OFFSET' in sql])
+                    # nor is the table counted beyond count_cap, on the list
+                    # or on the tabs.
+                    counts = [sql for sql in queries
+                              if 'COUNT(' in sql and 'FROM "note"' in sql]
+                    self.assertTrue(counts)
+                    self.assertFalse([sql for sql in counts
+                                      if 'LIMIT ?) AS "_wrapped"' not in sql])
+                    next_args = query.get_next_args()
+                    url = next_args and '/admin/note/?' + next_args
+                self.assertEqual([len(p) for p in pages], [10, 10, 5])
+                self.assertEqual(sum(pages, []), expected)
+
+                # and back again from the last page.
+                c.get('/admin/note/?' + query.get_prev_args())
+                query = self.get_context('query')
+                self.assertEqual(query.get_list(), expected[10:20])
+                self.assertTrue(query.get_prev_args())
+                self.assertTrue(query.get_next_args())
+
+                # jump to the first row at or past a value, keeping filters.
+                resp = c.get('/admin/note/?ordering=created_date&jump=2024-01-05'
+                             '&fo_user=0&fv_user=%d' % users[0].id)
+                query = self.get_context('query')
+                self.assertEqual(query.get_list(), [
+                    n for n in notes if n.user == users[0] and
+                    n.created_date >= datetime.datetime(2024, 1, 5)][:10])
+                self.assertIn('fv_user=%d' % users[0].id, query.get_prev_args())
+
+                # searching, where a cursor left over from another ordering
+                # is ignored.
+                note_admin.search_fields = ('message',)
+                c.get('/admin/note/?q=n1&ordering=message&after=' +
+                      quote(query.dump_cursor(notes[3])))
+                query = self.get_context('query')
+                self.assertEqual([n.message for n in query.get_list()],
+                                 ['n%d' % i for i in range(10, 20)])
+                self.assertIsNone(query.get_next_args())
+
+                # an unparseable jump value starts at the beginning.
+                c.get('/admin/note/?ordering=created_date&jump=nope')
+                self.assertEqual(self.get_context('query').get_list(),
+                                 notes[:10])
+        finally:
+            del note_admin.pagination
+            del note_admin.paginate_by
+            del note_admin.search_fields
+
+    def test_stats_panel(self):
+        self.create_users()
+        for i in range(3):
+            self.create_message(self.admin, 'm%d' % i)
+        old = datetime.datetime.now() - datetime.timedelta(days=3)
+        self.create_message(self.admin, 'old', pub_date=old)
+
+        panel = StatsPanel(admin, 'Stats', interval=60, models=[Message, User],
+                           date_fields={User: 'join_date'})
+        with self.flask_app.test_request_context():
+            stats = dict((row['model_admin'].model, row)
+                         for row in panel.refresh())
+            self.assertEqual(stats[Message]['count'], 4)
+            self.assertEqual(stats[Message]['recent'], 3)
+            self.assertEqual(stats[User]['count'], 3)
+            self.assertEqual(stats[User]['recent'], 3)
+
+            # the dashboard reads the last collection and starts the
+            # refresher thread, it never queries the tables itself.
+            Message.delete().execute()
+            try:
+                html = panel.render()
+                self.assertTrue(panel._thread.is_alive())
+            finally:
+                panel.stop(5)
+            self.assertFalse(panel._thread)
+            self.assertIn('Last 24h', html)
+            self.assertIn('<td class="text-end">4</td>', html)
+
+    def test_stats_panel_thread_errors(self):
+        contexts = []
+        collected = threading.Event()
+
+        class BrokenStatsPanel(StatsPanel):
+            def collect(self, model_admin):
+                contexts.append(has_app_context())
+                collected.set()
+                raise ValueError('no such table')
+
+        panel = BrokenStatsPanel(admin, 'Stats', interval=60, models=[User])
+        with self.flask_app.test_request_context():
+            with self.assertLogs('flask_peewee.admin', 'ERROR'):
+                try:
+                    panel.start()
+                    self.assertTrue(collected.wait(5))
+                finally:
+                    panel.stop(5)
+
+            # the thread collects within the app's context, and the error
+            # is kept for the panel to show rather than swallowed.
+            self.assertEqual(contexts, [True])
+            self.assertEqual(panel.last_error, 'no such table')
+            self.assertEqual(panel.stats, [])
+            panel.start = lambda: None
+            html = panel.render()
+            self.assertIn('could not be collected: no such table', html)
+
+    def test_chunked_action(self):
+        from flask_peewee.admin import ChunkedAction
+        from flask_peewee.tests.test_app import export_runner
+        users = self.create_users()
+        notes = [Note.create(user=users[i % 3], message='n%d' % i)
+                 for i in range(7)]
+
+        class ShoutAction(ChunkedAction):
+            def process_chunk(self, model_admin, rows):
+                chunks.append([row.id for row in rows])
+                ids = [row.id for row in rows]
+                (Note.update(message=fn.UPPER(Note.message))
+                 .where(Note.id << ids).execute())
+
+        chunks = []
+        note_admin = admin[Note]
+        note_admin.action_map = {'Shout': ShoutAction(chunk_size=3)}
+        selected = [n.id for n in notes[1:]]
+        try:
+            with self.flask_app.test_client() as c:
+                self.login(c)
+                resp = c.post('/admin/note/', data={
+                    'action': 'Shout', 'id': selected})
+                self.assertRedirect(resp)
+
+                # keyset batches in pk order, bounded by chunk_size.
+                self.assertEqual(chunks, [selected[:3], selected[3:]])
+                self.assertEqual(
+                    [n.message for n in Note.select().order_by(Note.id)],
+                    ['n0', 'N1', 'N2', 'N3', 'N4', 'N5', 'N6'])
+
+                # with a runner the request returns at once, and the job
+                # reports its progress.
+                del chunks[:]
+                note_admin.action_map = {'Shout': ShoutAction(
+                    chunk_size=4, runner=export_runner)}
+                resp = c.post('/admin/note/', data={
+                    'action': 'Shout', 'id': [n.id for n in notes]})
+                self.assertRedirect(resp)
+                job = export_runner.get_jobs()[0].wait()
+                self.assertEqual(job.status, job.DONE)
+                self.assertEqual((job.progress, job.total), (7, 7))
+                self.assertEqual(len(chunks), 2)
+                self.assertEqual(Note.get(Note.id == notes[0].id).message, 'N0')
+                self.assertEqual(job.name, 'Shout Note')
+        finally:
+            note_admin.action_map = {}
+
+    def test_select_all_matching(self):
+        from flask_peewee.admin import Action
+        from peewee import SelectQuery
+        users = self.create_users()
+        notes = [Note.create(user=users[i % 2], message='n%d' % i)
+                 for i in range(30)]
+        matching = [n.id for n in notes if n.user == users[0] and
+                    n.message.startswith('n1')]
+
+        class Collect(Action):
+            def run(self, model_admin, id_list):
+                received.append(id_list)
+
+        class CollectQuery(Action):
+            supports_query = True
+
+            def run_query(self, model_admin, query):
+                received.append(query)
+
+        received = []
+        note_admin = admin[Note]
+        note_admin.action_map = {'collect': Collect(),
+                                 'collect_query': CollectQuery()}
+        note_admin.search_fields = ('message',)
+        index = '/admin/note/?fo_user=eq&fv_user=%d&q=n1&page=2' % users[0].id
+        try:
+            with self.flask_app.test_client() as c:
+                self.login(c)
+                self.assertIn(b'name="select_all"', c.get(index).data)
+
+                # an action receives the matching primary keys as a list,
+                # unless there are more than it accepts.
+                c.post(index, data={'action': 'collect', 'select_all': '1'})
+                self.assertEqual(received.pop(), [str(pk) for pk in matching])
+                note_admin.action_map['collect'].select_all_limit = 3
+                resp = c.post(index, data={'action': 'collect',
+                                           'select_all': '1'},
+                              follow_redirects=True)
+                self.assertFalse(received)
+                self.assertIn('at most 3 rows', resp.data.decode('utf8'))
+
+                # an action supporting queries receives the matching query,
+                # unevaluated.
+                with self.capture_queries() as queries:
+                    c.post(index, data={'action': 'collect_query',
+                                        'select_all': '1'})
+                query, = received
+                self.assertTrue(isinstance(query, SelectQuery))
+                self.assertEqual(sorted(n.id for n in query), matching)
+                self.assertFalse([sql for sql in queries if 'FROM "note"' in sql])
+
+                # the filters and search stay in a subquery of primary keys.
+                sql, params = query.sql()
+                self.assertIn('WHERE ("t1"."id" IN (SELECT', sql)
+
+                # export and delete are redirected with the filters and search,
+                # less the page.
+                resp = c.post(index, data={'action': 'export', 'select_all': '1'})
+                location = resp.headers['location']
+                self.assertIn('/admin/note/export/?', location)
+                self.assertIn('q=n1', location)
+                self.assertNotIn('page=', location)
+                resp = c.post(location, data={'fields': ['id']})
+                self.assertEqual(sorted(r['id'] for r in json.loads(resp.data)),
+                                 matching)
+
+                resp = c.post(index, data={'action': 'delete', 'select_all': '1'})
+                location = resp.headers['location']
+                self.assertIn('select_all=1', location)
+                note_admin.delete_preview_limit = 3
+                body = c.get(location).data.decode('utf8')
+                self.assertIn('all %d Note records matching' % len(matching), body)
+                self.assertIn('and %d more' % (len(matching) - 3), body)
+                self.assertNotIn('name="id"', body)
+
+                # a chunk of rows is removed with a single DELETE.
+                note_admin.delete_chunk_size = 4
+                with self.capture_queries() as queries:
+                    resp = c.post(location)
+                self.assertRedirect(resp)
+                deletes = [sql for sql in queries
+                           if sql.startswith('DELETE FROM "note"')]
+                self.assertEqual(len(deletes), 2)
+                self.assertEqual(Note.select().count(), 30 - len(matching))
+                self.assertFalse(Note.select().where(Note.id << matching).exists())
+        finally:
+            note_admin.action_map = {}
+            del note_admin.search_fields
+            for attr in ('delete_preview_limit', 'delete_chunk_size'):
+                note_admin.__dict__.pop(attr, None)
+
     def test_panel_simple(self):
         users = self.create_users()
 
@@ -1329,6 +2284,73 @@ class AdminFilterTestCase(BaseAdminTestCase):
         self.assertIn('nxt', [f.name for f in hop3.fields])
         self.assertEqual(list(hop3.children), [])
 
+    def test_field_tree_memoized(self):
+        from flask_peewee.filters import clear_field_tree_cache
+        from flask_peewee.filters import field_tree_stats
+
+        # resources, admins and filter forms built alike share one tree, and
+        # paths reaching a model alike share its subtree.
+        tree = make_field_tree(Message, None, ['user__password'])
+        self.assertIs(make_field_tree(Message, None, ('user__password',)), tree)
+        note_tree = make_field_tree(Note, None, ['user__password'])
+        self.assertIs(note_tree.children['user'], tree.children['user'])
+        self.assertNotIn('password',
+                         [f.name for f in tree.children['user'].fields])
+        self.assertIsNot(make_field_tree(Message, None, []), tree)
+
+        hits = field_tree_stats['hits']
+        make_field_tree(Message, None, ['user__password'])
+        self.assertEqual(field_tree_stats['hits'], hits + 1)
+        self.assertTrue(field_tree_stats['seconds'] > 0)
+
+        clear_field_tree_cache()
+        self.assertIsNot(make_field_tree(Message, None, ['user__password']),
+                         tree)
+
+    def test_field_tree_memoized_cycle(self):
+        from flask_peewee.filters import clear_field_tree_cache
+        from peewee import DeferredForeignKey
+
+        # under Y, X's link back to Y can't take Y.x again, but under Z it
+        # can. both reach X with the same hops left, so a key that only
+        # looks at X's own foreign keys gave them one tree.
+        class X(db.Model):
+            y = DeferredForeignKey('Y', null=True)
+        class Y(db.Model):
+            x = ForeignKeyField(X, null=True)
+        class Z(db.Model):
+            x = ForeignKeyField(X)
+
+        def shape(node):
+            return ([f.name for f in node.fields],
+                    dict((k, shape(v)) for k, v in node.children.items()))
+
+        trees = []
+        for roots in ((Y, Z), (Z, Y)):
+            clear_field_tree_cache()
+            built = dict((root, shape(make_field_tree(root, None, [])))
+                         for root in roots)
+            trees.append(built)
+        self.assertEqual(trees[0], trees[1])
+        self.assertNotIn('x', trees[0][Y][1]['x'][1]['y'][1])
+        self.assertIn('x', trees[0][Z][1]['x'][1]['y'][1])
+
+    def test_filter_parameter_index(self):
+        form = FilterForm(Message, FilterModelConverter(), FilterMapping())
+        other = FilterForm(Message, FilterModelConverter(), FilterMapping())
+        # built once per (shared) field tree.
+        self.assertIs(form.get_parameter_index(), other.get_parameter_index())
+
+        url = ('/?fr_user-fo_username=eq&fr_user-fv_username=admin'
+               '&fo_content=eq&fv_content=x&fo_pub_date=eq&fo_nope=eq&fv_nope=1')
+        with self.flask_app.test_request_context(url):
+            parsed = form.parse_query_filters()
+        # an operation without its value, or an unknown name, is skipped.
+        self.assertEqual(list(parsed), [Message.content, User.username])
+        self.assertEqual(parsed[User.username], [(
+            ['eq'], ['admin'], [Message.user], 'fr_user-fo_username',
+            'fr_user-fv_username', 'user / username')])
+
     def assertFieldTree(self, expected):
         field_tree = self.get_context('field_tree')
 
@@ -1408,6 +2430,99 @@ class AdminFilterTestCase(BaseAdminTestCase):
         self.assertEqual(run('year', '2020'), ({'y2020'}, True))
         self.assertEqual(run('within_days', '2'), ({'today'}, True))
 
+    def test_date_filters_compile_to_ranges(self):
+        # year and month filters compare the column to a half-open range, not
+        # an extracted part of it, so an index on the column is usable.
+        import peewee
+        HModel.create(h_field='a', h_date=datetime.datetime(2023, 12, 31, 23),
+                      h_day=datetime.date(2023, 12, 31))
+        HModel.create(h_field='b', h_date=datetime.datetime(2024, 1, 1),
+                      h_day=datetime.date(2024, 1, 1))
+        HModel.create(h_field='c', h_date=datetime.datetime(2024, 12, 31, 23),
+                      h_day=datetime.date(2024, 12, 31))
+
+        def process(field, op, value):
+            qs = '/?fo_%s=%s&fv_%s=%s' % (field, op, field, value)
+            with self.flask_app.test_request_context(qs):
+                form = FilterForm(HModel, FilterModelConverter(), FilterMapping())
+                return form.process_request(HModel.select())[1]
+
+        def run(field, op, value):
+            return sorted(h.h_field for h in process(field, op, value))
+
+        for field in ('h_date', 'h_day'):
+            self.assertEqual(run(field, 'year', '2024'), ['b', 'c'])
+            self.assertEqual(run(field, 'month', '2023-12'), ['a'])
+            self.assertEqual(run(field, 'month', '2024-12'), ['c'])
+            # a bare month matches every year, by extracting it.
+            self.assertEqual(run(field, 'month', '12'), ['a', 'c'])
+            # a month past the last one is not a filter.
+            self.assertEqual(run(field, 'month', '2024-13'), ['a', 'b', 'c'])
+
+        # the bound matches the column: a date for a DateField, midnight for
+        # a DateTimeField.
+        self.assertEqual(process('h_day', 'year', '2024').sql()[1],
+                         [datetime.date(2024, 1, 1), datetime.date(2025, 1, 1)])
+
+        sql, params = process('h_date', 'month', '2024-02').sql()
+        self.assertIn('WHERE (("t1"."h_date" >= ?) AND ("t1"."h_date" < ?))', sql)
+        self.assertEqual(params, [datetime.datetime(2024, 2, 1),
+                                  datetime.datetime(2024, 3, 1)])
+
+        sql, params = process('h_date', 'month', '2').sql()
+        self.assertIn('WHERE (date_part(?, "t1"."h_date") = ?)', sql)
+
+        today = datetime.date.today()
+        ago = datetime.datetime.combine(
+            today - datetime.timedelta(days=3), datetime.time())
+        sql, params = process('h_date', 'within_days', '3').sql()
+        self.assertIn('WHERE ("t1"."h_date" >= ?)', sql)
+        self.assertEqual(params, [ago])
+        sql, params = process('h_date', 'older_days', '3').sql()
+        self.assertIn('WHERE ("t1"."h_date" < ?)', sql)
+        self.assertEqual(params, [ago])
+
+        # postgres, compiled against an unconnected database.
+        pg = peewee.PostgresqlDatabase(None)
+        with pg.bind_ctx([HModel]):
+            sql, params = process('h_date', 'year', '2024').sql()
+            self.assertIn('WHERE (("t1"."h_date" >= %s) AND ("t1"."h_date" < %s))', sql)
+            self.assertNotIn('EXTRACT', sql)
+            self.assertEqual(params, [datetime.datetime(2024, 1, 1),
+                                      datetime.datetime(2025, 1, 1)])
+
+    def test_facets(self):
+        self.create_users()
+        user_admin = admin[User]
+        user_admin.facet_fields = ('active', 'admin')
+        user_admin.search_fields = ('username',)
+        try:
+            with self.flask_app.test_client() as c:
+                self.login(c)
+                resp = c.get('/admin/user/?fo_active=eq&fv_active=1&q=i')
+                self.assertEqual(resp.status_code, 200)
+                active, is_admin = self.get_context('facets')
+                # active counts ignore the active filter, but not the search
+                # or the other filters.
+                self.assertEqual(
+                    [(v['label'], v['count'], v['active']) for v in active['values']],
+                    [('Yes', 1, True), ('No', 1, False)])
+                self.assertEqual(
+                    [(v['label'], v['count'], v['active']) for v in is_admin['values']],
+                    [('Yes', 1, False), ('No', 0, False)])
+                self.assertEqual(active['values'][1]['url'],
+                                 './?q=i&fo_active=eq&fv_active=0')
+                # the selected value links to the list without its filter.
+                self.assertEqual(active['values'][0]['url'], './?q=i')
+                self.assertIn(b'No (0)', resp.data)
+
+                resp = c.get('/admin/user/' + active['values'][1]['url'][2:])
+                self.assertEqual(list(self.get_context('query').get_list()),
+                                 [self.inactive])
+        finally:
+            user_admin.facet_fields = user_admin.search_fields = None
+            user_admin.facet_cache.clear()
+
     def test_filter_two_fks_same_model(self):
         # two foreign keys to one model must join through separate aliases, so a
         # filter on both does not collapse to one join with contradictory
@@ -1437,6 +2552,82 @@ class AdminFilterTestCase(BaseAdminTestCase):
         query = link_admin.apply_search(Link.select(), 'findme')
         self.assertEqual([l.label for l in query], ['null-dst-findme'])
 
+    def test_search_backends(self):
+        import peewee
+        from playhouse.sqlite_ext import FTS5Model
+        from playhouse.sqlite_ext import SearchField
+        from flask_peewee.search import PostgresFullTextSearch
+        from flask_peewee.search import PrefixSearch
+        from flask_peewee.search import SqliteFTSSearch
+
+        self.create_users()
+        a, n = self.admin, self.normal
+        Link.create(src=a, dst=n, label='alpha beta')
+        Link.create(src=a, dst=None, label='beta gamma')
+        Link.create(src=n, dst=a, label='gamma')
+
+        class PrefixLinkAdmin(LinkAdmin):
+            search_backend = PrefixSearch()
+
+        link_admin = PrefixLinkAdmin(admin, Link)
+        labels = lambda q: sorted(l.label for l in q)
+
+        # a prefix match is a half-open range the column's index can serve.
+        query = link_admin.apply_search(Link.select(), 'beta')
+        self.assertEqual(labels(query), ['beta gamma'])
+        sql, params = query.sql()
+        self.assertNotIn('LIKE', sql)
+        self.assertIn('beta', params)
+        self.assertIn('betb', params)
+        # ...through related search fields too.
+        self.assertEqual(labels(link_admin.apply_search(Link.select(), 'adm')),
+                         ['gamma'])
+        # a last character that cannot be incremented is dropped, and a
+        # column that is not text is matched with LIKE.
+        backend = PrefixSearch()
+        self.assertEqual(backend.get_upper_bound('b\U0010ffff'), 'c')
+        self.assertIsNone(backend.get_upper_bound('\U0010ffff'))
+        self.assertEqual(labels(Link.select().where(
+            backend.match(Link.label, 'gamma\U0010ffff'))), [])
+        sql, params = Link.select().where(backend.match(Link.id, '1')).sql()
+        self.assertIn('LIKE', sql)
+
+        class LinkIndex(FTS5Model):
+            label = SearchField()
+            dst__username = SearchField()
+
+            class Meta:
+                database = db.database
+
+        LinkIndex.create_table()
+        try:
+            backend = SqliteFTSSearch(LinkIndex)
+            fts_admin = LinkAdmin(admin, Link)
+            fts_admin.search_backend = backend
+            with self.capture_queries() as queries:
+                self.assertEqual(backend.rebuild(fts_admin, chunk_size=2), 3)
+            self.assertEqual(len([sql for sql in queries
+                                  if 'INSERT' in sql]), 2)
+
+            # words match anywhere, as prefixes, across the search columns.
+            self.assertEqual(labels(fts_admin.apply_search(Link.select(), 'gam')),
+                             ['beta gamma', 'gamma'])
+            self.assertEqual(labels(fts_admin.apply_search(Link.select(), 'norm')),
+                             ['alpha beta'])
+            # FTS query syntax in the term is taken literally.
+            self.assertEqual(list(fts_admin.apply_search(Link.select(), 'x" OR "')), [])
+        finally:
+            LinkIndex.drop_table()
+
+        # postgres full text, compiled against an unconnected database.
+        pg = peewee.PostgresqlDatabase(None)
+        with pg.bind_ctx([Link, User]):
+            pg_admin = LinkAdmin(admin, Link)
+            pg_admin.search_backend = PostgresFullTextSearch('simple')
+            sql, params = pg_admin.apply_search(Link.select(), 'beta').sql()
+        self.assertIn('to_tsvector(%s, "t1"."label") @@ plainto_tsquery(%s, %s)', sql)
+        self.assertEqual(params[:3], ['simple', 'simple', 'beta'])
+
     def test_export_two_fks_same_model(self):
         # two foreign keys to one model export through separate aliased joins
         # instead of raising "more than one foreign key".
@@ -1497,6 +2688,30 @@ class TemplateHelperTestCase(FlaskPeeweeTestCase):
         self.assertEqual(admin.get_model_field(self.admin, 'message_count'), 2)
         self.assertRaises(AttributeError, admin.get_model_field, self.admin, 'missing_attr')
 
+    def test_column_accessors(self):
+        class ColumnAdmin(ModelAdmin):
+            columns = ('username', 'message_count', 'shout')
+            readonly_fields = ('join_date',)
+
+            def shout(self, obj):
+                return obj.username.upper()
+
+        model_admin = ColumnAdmin(admin, User)
+        # columns and readonly fields are resolved when the admin is built.
+        self.assertEqual(sorted(model_admin._accessors),
+                         ['join_date', 'message_count', 'shout', 'username'])
+
+        get = model_admin.get_column_value
+        self.assertEqual(get(self.admin, 'username'), 'admin')
+        self.assertEqual(get(self.admin, 'message_count'), 2)
+        self.assertEqual(get(self.normal, 'shout'), 'NORMAL')
+        self.assertEqual(get(self.admin, 'join_date'), self.admin.join_date)
+
+        # a name only set on the instance is still found on it.
+        self.admin.nickname = 'boss'
+        self.assertEqual(get(self.admin, 'nickname'), 'boss')
+        self.assertRaises(AttributeError, get, self.normal, 'nickname')
+
     def test_get_form_field(self):
         form = model_form(User)(obj=self.admin)
         self.assertEqual(admin.get_form_field(form, 'username'), form.username)
@@ -1537,6 +2752,7 @@ class TemplateHelperTestCase(FlaskPeeweeTestCase):
             admin._registry[Entry],
             admin._registry[Message],
             admin._registry[Note],
+            admin._registry[Page],
             admin._registry[ScopedItem],
             admin._registry[ScopedRef],
             admin._registry[User],
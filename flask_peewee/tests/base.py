@@ -1,8 +1,11 @@
+import contextlib
+import logging
 import unittest
 
 from flask_peewee import utils
 from flask_peewee.tests import test_app
 from flask_peewee.tests.test_app import AModel
+from flask_peewee.tests.test_app import AuditEntry
 from flask_peewee.tests.test_app import BDetails
 from flask_peewee.tests.test_app import BModel
 from flask_peewee.tests.test_app import CModel
@@ -18,6 +21,7 @@ from flask_peewee.tests.test_app import Tweet
 from flask_peewee.tests.test_app import Message
 from flask_peewee.tests.test_app import Link
 from flask_peewee.tests.test_app import Note
+from flask_peewee.tests.test_app import Page
 from flask_peewee.tests.test_app import ScopedItem
 from flask_peewee.tests.test_app import ScopedRef
 from flask_peewee.tests.test_app import User
@@ -30,7 +34,8 @@ class FlaskPeeweeTestCase(unittest.TestCase):
 
         # drop_tables/create_tables resolve foreign-key ordering for us.
         models = [User, Message, Note, Comment, EModel, FModel, GModel,
-                  HModel, Ping, ApiToken, Tweet, ScopedItem, ScopedRef, Link]
+                  HModel, Ping, ApiToken, Tweet, ScopedItem, ScopedRef, Link, Page,
+                  AuditEntry]
         test_app.db.database.drop_tables(models)
         test_app.db.database.create_tables(models)
 
@@ -57,6 +62,23 @@ class FlaskPeeweeTestCase(unittest.TestCase):
         self.admin, self.normal, self.inactive = users
         return users
 
+    @contextlib.contextmanager
+    def capture_queries(self):
+        # collects the sql of every query peewee runs inside the block.
+        queries = []
+        class Handler(logging.Handler):
+            def emit(self, record):
+                queries.append(record.getMessage().lstrip("(').\""))
+        logger = logging.getLogger('peewee')
+        level, handler = logger.level, Handler()
+        logger.setLevel(logging.DEBUG)
+        logger.addHandler(handler)
+        try:
+            yield queries
+        finally:
+            logger.removeHandler(handler)
+            logger.setLevel(level)
+
     def get_context(self, var_name):
         if var_name not in self.flask_app._template_context:
             raise KeyError('%s not in template context' % var_name)
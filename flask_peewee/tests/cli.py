@@ -236,3 +236,30 @@ class CLITestCase(unittest.TestCase):
         self.assertTrue(context['Employee'] is self.Employee)
         self.assertTrue(context['Pet'] is self.Pet)
         self.assertTrue(context['User'] is self.auth.User)
+
+    def test_compile_templates(self):
+        from flask_peewee.admin import Admin
+
+        result = self.runner.invoke(args=['fp', 'compile-templates'])
+        self.assertNotEqual(result.exit_code, 0)
+        self.assertIn('no Admin instance', self.all_output(result))
+
+        cache_dir = os.path.join(self.tempdir, 'templates')
+        self.app.config['TEMPLATE_CACHE_DIR'] = cache_dir
+        admin = Admin(self.app, self.auth)
+        admin.setup()
+        self.assertEqual(self.app.jinja_env.bytecode_cache.directory,
+                         cache_dir)
+
+        result = self.runner.invoke(args=['fp', 'compile-templates'])
+        self.assertEqual(result.exit_code, 0)
+        self.assertIn('compiled: admin/models/index.html', result.output)
+        self.assertIn('compiled: macros/forms.html', result.output)
+        names = admin.get_template_names()
+        self.assertEqual(len(os.listdir(cache_dir)), len(names))
+
+    def test_field_tree_stats(self):
+        result = self.runner.invoke(args=['fp', 'field-tree-stats'])
+        self.assertEqual(result.exit_code, 0)
+        self.assertRegex(result.output,
+                         r'^field trees: \d+ built, \d+ reused, [\d.]+s building')
@@ -4,9 +4,12 @@ import json
 import unittest
 
 from flask import g
+from peewee import fn
 
 from flask_peewee.rest import Authentication
+from flask_peewee.rest import Collection
 from flask_peewee.rest import RestAPI
+from flask_peewee.rest import RestForbidden
 from flask_peewee.rest import RestResource
 from flask_peewee.rest import UserAuthentication
 from flask_peewee.tests.base import FlaskPeeweeTestCase
@@ -26,6 +29,7 @@ from flask_peewee.tests.test_app import HModel
 from flask_peewee.tests.test_app import Link
 from flask_peewee.tests.test_app import Message
 from flask_peewee.tests.test_app import Note
+from flask_peewee.tests.test_app import Page
 from flask_peewee.tests.test_app import Ping
 from flask_peewee.tests.test_app import TestModel
 from flask_peewee.tests.test_app import Tweet
@@ -577,6 +581,291 @@ class RestApiResourceTestCase(RestApiTestCase):
         # plus one joined SELECT), not ~1 + 6*2 from lazy per-row loading.
         self.assertLessEqual(count['n'], 3)
 
+    def test_sparse_fieldsets(self):
+        # "fields" and "include" narrow the response, the select list and
+        # the joins, and are checked against the resource's fields.
+        self.create_test_models()
+        get = lambda qs: self.app.get('/api/cmodel/?ordering=id&' + qs)
+
+        with self.capture_queries() as queries:
+            resp = get('fields=id,b.b_field')
+        self.assertEqual(self.response_json(resp)['objects'], [
+            {'id': self.c1.id, 'b': {'b_field': 'b1'}},
+            {'id': self.c2.id, 'b': {'b_field': 'b2'}},
+        ])
+        select = queries[-1]
+        self.assertNotIn('c_field', select)
+        self.assertNotIn('a_field', select)
+        self.assertEqual(select.count('JOIN'), 1)
+
+        # without the fk in fields an include is not expanded or joined.
+        with self.capture_queries() as queries:
+            resp = get('fields=c_field')
+        self.assertEqual(self.response_json(resp)['objects'],
+                         [{'c_field': 'c1'}, {'c_field': 'c2'}])
+        self.assertNotIn('JOIN', queries[-1])
+
+        # include expands only the relations it names, others are ids.
+        resp = get('include=b')
+        self.assertEqual(self.response_json(resp)['objects'][0], {
+            'id': self.c1.id, 'c_field': 'c1',
+            'b': {'id': self.b1.id, 'b_field': 'b1', 'a': self.a1.id}})
+
+        resp = self.app.get('/api/cmodel/%s/?fields=c_field&include=b.a' % self.c2.id)
+        self.assertEqual(self.response_json(resp), {
+            'c_field': 'c2',
+            'b': {'id': self.b2.id, 'b_field': 'b2',
+                  'a': {'id': self.a2.id, 'a_field': 'a2'}}})
+
+        # the pagination links carry the parameters.
+        resp = self.app.get('/api/cmodel/?ordering=id&limit=1&fields=id')
+        self.assertIn('fields=id', self.response_json(resp)['meta']['next'])
+
+        # unknown and excluded names are rejected.
+        for qs in ('fields=id,nope', 'fields=b.nope', 'include=a'):
+            resp = get(qs)
+            self.assertEqual(resp.status_code, 400)
+            self.assertIn('Unrecognized field(s)', self.response_json(resp)['error'])
+        self.create_users()
+        resp = self.app.get('/api/user/?fields=username,password',
+                            headers=self.auth_headers('admin', 'admin'))
+        self.assertEqual(resp.status_code, 400)
+        self.assertEqual(self.response_json(resp)['error'],
+                         'Unrecognized field(s): password')
+
+        # overrides with the original signatures still serialize the
+        # request's selection.
+        resource = api._registry[CModel]
+        base = type(resource)
+        resource.serialize_query = lambda query: [
+            dict(data, seen=True) for data in base.serialize_query(resource, query)]
+        resource.serialize_object = lambda obj: base.serialize_object(resource, obj)
+        try:
+            resp = get('fields=c_field')
+            self.assertEqual(self.response_json(resp)['objects'], [
+                {'c_field': 'c1', 'seen': True},
+                {'c_field': 'c2', 'seen': True}])
+            resp = self.app.get('/api/cmodel/%s/?fields=c_field' % self.c1.id)
+            self.assertEqual(self.response_json(resp),
+                             {'c_field': 'c1', 'seen': True})
+        finally:
+            del resource.serialize_query
+            del resource.serialize_object
+
+    def test_nested_write_prefetch(self):
+        # the rows a nested write edits load with one query per related model
+        # before deserializing, and each writes its own changed columns.
+        a = AModel.create(a_field='a1')
+        b = BModel.create(a=a, b_field='b1')
+        c = CModel.create(b=b, c_field='c1')
+        data = {'c_field': 'c2', 'b': {'b_field': 'b2', 'a': {'a_field': 'a2'}}}
+        with self.capture_queries() as queries:
+            resp = self.app.put('/api/cmodel/%s/' % c.id, data=json.dumps(data))
+        self.assertEqual(resp.status_code, 200)
+        selects = [sql for sql in queries if sql.startswith('SELECT')]
+        self.assertEqual(len(selects), 3)
+        self.assertEqual(len([sql for sql in queries if sql.startswith('UPDATE')]), 3)
+        self.assertEqual(AModel.get_by_id(a.id).a_field, 'a2')
+        self.assertEqual(BModel.get_by_id(b.id).b_field, 'b2')
+        self.assertEqual(CModel.get_by_id(c.id).c_field, 'c2')
+
+        # two foreign keys to one model share a query, and the rows checked
+        # with check_put are the rows saved.
+        checked = []
+        class NestedUserResource(RestResource):
+            def check_put(self, obj):
+                checked.append(obj)
+                return True
+        class LinkResource(RestResource):
+            include_resources = {'src': NestedUserResource,
+                                 'dst': NestedUserResource}
+
+        src, dst = self.create_user('src', 'src'), self.create_user('dst', 'dst')
+        link = Link.create(src=src, dst=dst, label='l1')
+        resource = LinkResource(api, Link, Authentication())
+        with self.flask_app.test_request_context():
+            with self.capture_queries() as queries:
+                obj = resource.persist_object(link, {
+                    'label': 'l2',
+                    'src': {'username': 'src2'},
+                    'dst': {'username': 'dst2'}})
+        selects = [sql for sql in queries if sql.startswith('SELECT')]
+        self.assertEqual(len(selects), 1)
+        self.assertIn('IN (?, ?)', selects[0])
+        self.assertEqual(checked, [obj.src, obj.dst])
+        self.assertEqual(
+            sorted(u.username for u in User.select().where(
+                User.id.in_([src.id, dst.id]))), ['dst2', 'src2'])
+
+        # two foreign keys to one row are two instances, each checked.
+        del checked[:]
+        same = Link.create(src=src, dst=src, label='same')
+        with self.flask_app.test_request_context():
+            obj = resource.persist_object(same, {
+                'src': {'username': 'src3'}, 'dst': {'username': 'src3'}})
+        self.assertIsNot(obj.src, obj.dst)
+        self.assertEqual(checked, [obj.src, obj.dst])
+
+        # rows are read through the nested resource's get_query(), and one
+        # it scopes out can't be edited.
+        class ActiveUserResource(NestedUserResource):
+            def get_query(self):
+                return User.select().where(User.active == True)
+        class ScopedLinkResource(RestResource):
+            include_resources = {'src': ActiveUserResource}
+        inactive = self.create_user('inactive', 'inactive', active=False)
+        hidden = Link.create(src=inactive, dst=dst, label='hidden')
+        resource = ScopedLinkResource(api, Link, Authentication())
+        with self.flask_app.test_request_context():
+            with self.assertRaises(RestForbidden):
+                resource.persist_object(hidden, {'src': {'username': 'x'}})
+        self.assertEqual(User.get_by_id(inactive.id).username, 'inactive')
+
+        # without nested writes nothing is prefetched.
+        resource.nested_writes = False
+        with self.flask_app.test_request_context():
+            with self.capture_queries() as queries:
+                resource.persist_object(link, {'label': 'l3',
+                                               'src': {'username': 'x'}})
+        self.assertFalse([sql for sql in queries if 'FROM "user"' in sql])
+
+    def test_include_collections(self):
+        # reverse relations nest each object's rows, loaded for the whole
+        # page with one query per relation, through the child resource's
+        # fields, and capped per object with a window function.
+        class MessageResource(RestResource):
+            exclude = ('user',)
+        class NoteResource(RestResource):
+            fields = ('id', 'message')
+        class UserMessagesResource(RestResource):
+            fields = ('id', 'username')
+            include_collections = {
+                'message_set': Collection(MessageResource, limit=2,
+                                          ordering='-pub_date'),
+                'note_set': NoteResource,
+            }
+
+        users = self.create_users()
+        start = datetime.datetime(2026, 1, 1)
+        for i, user in enumerate(users[:2]):
+            for j in range(3):
+                Message.create(user=user, content='%s-%s' % (user.username, j),
+                               pub_date=start + datetime.timedelta(days=j))
+                Note.create(user=user, message='n%s-%s' % (i, j))
+
+        resource = UserMessagesResource(api, User, Authentication())
+        with self.flask_app.test_request_context():
+            with self.capture_queries() as queries:
+                data = resource.serialize_query(User.select().order_by(User.id))
+        self.assertEqual(len(queries), 3)
+        self.assertIn('ROW_NUMBER() OVER (PARTITION BY', queries[1])
+
+        admin_data, normal_data, inactive_data = data
+        self.assertEqual(
+            [m['content'] for m in admin_data['message_set']],
+            ['admin-2', 'admin-1'])
+        self.assertEqual(
+            [m['content'] for m in normal_data['message_set']],
+            ['normal-2', 'normal-1'])
+        self.assertEqual(sorted(admin_data['message_set'][0]),
+                         ['content', 'id', 'pub_date'])
+        self.assertEqual(
+            normal_data['note_set'],
+            [{'id': n.id, 'message': n.message} for n in
+             Note.select().where(Note.user == self.normal).order_by(Note.id)])
+        self.assertEqual(inactive_data['message_set'], [])
+        self.assertEqual(inactive_data['note_set'], [])
+        self.assertEqual(sorted(inactive_data),
+                         ['id', 'message_set', 'note_set', 'username'])
+
+        # a detail serializes the same way.
+        with self.flask_app.test_request_context():
+            self.assertEqual(resource.serialize_object(self.admin), admin_data)
+
+    def test_column_pruning(self):
+        # with prune_columns a list selects only the columns it serializes,
+        # from the model and from each joined include, plus load_fields.
+        class UserResource(RestResource):
+            exclude = ('password', 'email')
+        class CommentResource(RestResource):
+            exclude = ('body',)
+            include_resources = {'user': UserResource}
+
+        self.create_users()
+        comment = Comment.create(user=self.admin, body='b1')
+
+        # by default whole rows are read, excluded columns too.
+        resource = CommentResource(api, Comment, Authentication())
+        with self.flask_app.test_request_context():
+            query = resource.apply_related_joins(resource.get_query())
+            sql, params = query.sql()
+            self.assertEqual(list(query)[0].body, 'b1')
+        self.assertIn('"t1"."body"', sql)
+        self.assertIn('"t2"."password"', sql)
+
+        class PrunedCommentResource(CommentResource):
+            prune_columns = True
+
+        resource = PrunedCommentResource(api, Comment, Authentication())
+        with self.flask_app.test_request_context():
+            query = resource.apply_related_joins(resource.get_query())
+            sql, params = query.sql()
+            self.assertEqual(resource.serialize_query(query), [{
+                'id': comment.id, 'user': {
+                    'id': self.admin.id, 'username': 'admin', 'active': True,
+                    'admin': True,
+                    'join_date': self.admin.join_date.isoformat()}}])
+        for column in ('body', 'password', 'email'):
+            self.assertNotIn('"%s"' % column, sql)
+        self.assertIn('"t2"."username"', sql)
+
+        class BodyLengthResource(PrunedCommentResource):
+            load_fields = ('body',)
+            def prepare_data(self, obj, data):
+                data['length'] = len(obj.body)
+                return data
+
+        resource = BodyLengthResource(api, Comment, Authentication())
+        with self.flask_app.test_request_context():
+            query = resource.apply_related_joins(resource.get_query())
+            self.assertEqual(resource.serialize_query(query)[0]['length'], 2)
+
+        # a get_query() with a select list of its own keeps it.
+        class AnnotatedResource(PrunedCommentResource):
+            def get_query(self):
+                return Comment.select(Comment, fn.LENGTH(Comment.body).alias('size'))
+
+        resource = AnnotatedResource(api, Comment, Authentication())
+        with self.flask_app.test_request_context():
+            sql, params = resource.apply_related_joins(resource.get_query()).sql()
+        self.assertIn('"t1"."body"', sql)
+        self.assertIn('LENGTH', sql)
+        self.assertNotIn('"password"', sql)
+
+    def test_save_only_changed_fields(self):
+        page = Page.create(title='t1', body='b1')
+        url = '/api/page/%d/' % page.id
+        put = lambda data: self.app.put(url, data=json.dumps(data))
+
+        with self.capture_queries() as queries:
+            resp = put({'title': 't1', 'body': 'b1'})
+        self.assertEqual(resp.status_code, 200)
+        self.assertFalse([sql for sql in queries if sql.startswith('UPDATE')])
+
+        with self.capture_queries() as queries:
+            resp = put({'body': 'b2', 'version': 1})
+        self.assertEqual(resp.status_code, 200)
+        updates = [sql for sql in queries if sql.startswith('UPDATE')]
+        self.assertEqual(len(updates), 1)
+        self.assertNotIn('"title"', updates[0])
+        self.assertEqual(self.response_json(resp)['version'], 2)
+
+        # a write based on the old version is refused.
+        resp = put({'body': 'b3', 'version': 1})
+        self.assertEqual(resp.status_code, 409)
+        page = Page.get_by_id(page.id)
+        self.assertEqual((page.body, page.version), ('b2', 2))
+
     def test_nested_writes_disabled(self):
         # GResource sets nested_writes=False: a nested related dict is ignored
         # (never created), though the FK can still be set by scalar id.
@@ -1030,6 +1319,102 @@ class RestApiBasicTestCase(RestApiTestCase):
         resp = self.app.get('/api/note/?id__between=%s' % ids[1])
         self.assertEqual(resp.status_code, 400)
 
+    def test_facet_counts(self):
+        # a facet counts its values under every filter but its own, with one
+        # GROUP BY per facet, and is cached per filter signature. the user
+        # resource lists active users only.
+        self.create_users()
+        resource = api._registry[User]
+        resource.facet_fields = ['admin']
+        try:
+            resp = self.app.get('/api/user/?admin=0')
+            meta = self.response_json(resp)['meta']
+            self.assertEqual(meta['object_count'], 1)
+            self.assertEqual(meta['facets'], {
+                'admin': [{'value': True, 'count': 1},
+                          {'value': False, 'count': 1}],
+            })
+
+            with self.capture_queries() as queries:
+                resp = self.app.get('/api/user/?admin=0&username=normal')
+            meta = self.response_json(resp)['meta']
+            self.assertEqual(meta['object_count'], 1)
+            self.assertEqual(meta['facets']['admin'],
+                             [{'value': True, 'count': 0},
+                              {'value': False, 'count': 1}])
+            self.assertEqual(
+                len([q for q in queries if 'GROUP BY' in q]), 1)
+
+            with self.capture_queries() as queries:
+                self.app.get('/api/user/?admin=1&username=normal')
+            self.assertFalse([q for q in queries if 'GROUP BY' in q])
+        finally:
+            resource.facet_fields = None
+            resource.facet_cache.clear()
+
+        resp = self.app.get('/api/user/')
+        self.assertNotIn('facets', self.response_json(resp)['meta'])
+
+    def test_aggregate(self):
+        # one GROUP BY over the filtered rows, returned by column.
+        self.create_users()
+        start = datetime.datetime(2026, 1, 1, 12)
+        for user, days in ((self.admin, (0, 0, 1)), (self.normal, (1,))):
+            for day in days:
+                Message.create(user=user, content='m',
+                               pub_date=start + datetime.timedelta(days=day))
+
+        with self.capture_queries() as queries:
+            resp = self.app.get('/api/message/aggregate/?group_by=user'
+                                '&date_trunc=pub_date:day&max=pub_date')
+        self.assertEqual(len(queries), 1)
+        self.assertIn('GROUP BY', queries[0])
+        self.assertEqual(self.response_json(resp), {
+            'meta': {'model': 'message', 'group_count': 3},
+            'columns': {
+                'user': [self.admin.id, self.admin.id, self.normal.id],
+                'pub_date__day': ['2026-01-01T00:00:00', '2026-01-02T00:00:00',
+                                  '2026-01-02T00:00:00'],
+                'count': [2, 1, 1],
+                'pub_date__max': ['2026-01-01T12:00:00', '2026-01-02T12:00:00',
+                                  '2026-01-02T12:00:00'],
+            },
+        })
+
+        # filters apply, and without a group there is one row of totals.
+        resp = self.app.get('/api/message/aggregate/?user=%s&count=id'
+                            % self.admin.id)
+        self.assertEqual(self.response_json(resp)['columns'],
+                         {'count': [3], 'id__count': [3]})
+
+        # unknown fields, fields of the wrong type and a column named twice
+        # are rejected.
+        for qs in ('group_by=nope', 'sum=content', 'date_trunc=pub_date:week',
+                   'date_trunc=content:day', 'group_by=user,user',
+                   'max=id&max=id'):
+            resp = self.app.get('/api/message/aggregate/?' + qs)
+            self.assertEqual(resp.status_code, 400)
+
+        # so are fields the resource does not serialize.
+        headers = self.auth_headers('admin', 'admin')
+        resp = self.app.get('/api/user/aggregate/?max=username',
+                            headers=headers)
+        self.assertEqual(resp.status_code, 200)
+        for qs in ('max=password', 'group_by=email'):
+            resp = self.app.get('/api/user/aggregate/?' + qs, headers=headers)
+            self.assertEqual(resp.status_code, 400)
+            self.assertIn('Cannot aggregate', self.response_json(resp)['error'])
+
+        # too many groups is an error, not a truncated result.
+        resource = api._registry[Message]
+        resource.max_aggregate_groups = 1
+        try:
+            resp = self.app.get('/api/message/aggregate/?group_by=user')
+        finally:
+            del resource.max_aggregate_groups
+        self.assertEqual(resp.status_code, 400)
+        self.assertIn('More than 1 groups', self.response_json(resp)['error'])
+
     def test_serialize_two_relations_one_model(self):
         # two relations to one model each get their own path-keyed field set:
         # one cannot leak the other's fields, and nesting one does not nest the
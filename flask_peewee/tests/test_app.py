@@ -1,4 +1,5 @@
 import datetime
+import tempfile
 
 from flask import Flask
 from flask import Response
@@ -14,11 +15,16 @@ from peewee import *
 # flask-peewee bindings
 from flask_peewee.admin import Admin
 from flask_peewee.admin import AdminPanel
+from flask_peewee.admin import AuditLogPanel
+from flask_peewee.admin import InlineModelAdmin
+from flask_peewee.admin import JobPanel
 from flask_peewee.admin import ModelAdmin
+from flask_peewee.audit import AuditLog
 from flask_peewee.auth import Auth
 from flask_peewee.auth import BaseUser
 from flask_peewee.db import Database
 from flask_peewee.filters import QueryFilter
+from flask_peewee.jobs import JobRunner
 from flask_peewee.rest import ALL_METHODS
 from flask_peewee.rest import APIKeyAuthentication
 from flask_peewee.rest import AdminAuthentication
@@ -195,6 +201,14 @@ class Entry(db.Model):
     created = DateTimeField(default=datetime.datetime.now)
 
 
+class Page(db.Model):
+    # exercises optimistic concurrency through the version_field of PageAdmin
+    # and the Page resource.
+    title = CharField()
+    body = TextField(default='')
+    version = IntegerField(default=1)
+
+
 class NotePanel(AdminPanel):
     template_name = 'admin/notes.html'
 
@@ -222,6 +236,14 @@ class NotePanel(AdminPanel):
 auth = Auth(app, db, user_model=User)
 admin = Admin(app, auth)
 
+# background exports write here. NoteAdmin opts in via export_runner.
+export_runner = JobRunner(tempfile.mkdtemp())
+
+# admin changes are recorded here while a test sets admin.audit_log. the
+# database is sqlite, so each request writes its own entries.
+audit_log = AuditLog(db, inline=True)
+AuditEntry = audit_log.model
+
 
 class AAdmin(ModelAdmin):
     columns = ('a_field',)
@@ -244,8 +266,14 @@ class MessageAdmin(ModelAdmin):
 
 class NoteAdmin(ModelAdmin):
     columns = ('user', 'message', 'created_date',)
+    export_runner = export_runner
+
+class ScopedRefInline(InlineModelAdmin):
+    model = ScopedRef
 
 class ScopedItemAdmin(ModelAdmin):
+    inlines = (ScopedRefInline,)
+
     # scope every path, including delete, to non-hidden rows.
     def get_query(self):
         return ScopedItem.select().where(ScopedItem.hidden == False)
@@ -261,6 +289,9 @@ class EntryAdmin(ModelAdmin):
         ('Meta', {'fields': ('created',), 'collapsed': True}),
     ]
 
+class PageAdmin(ModelAdmin):
+    version_field = 'version'
+
 
 auth.register_admin(admin)
 admin.register(AModel, AAdmin)
@@ -273,7 +304,10 @@ admin.register(Note, NoteAdmin)
 admin.register(ScopedItem, ScopedItemAdmin)
 admin.register(ScopedRef, ScopedRefAdmin)
 admin.register(Entry, EntryAdmin)
+admin.register(Page, PageAdmin)
 admin.register_panel('Notes', NotePanel)
+admin.register_panel('Exports', JobPanel, export_runner)
+admin.register_panel('Audit log', AuditLogPanel, audit_log)
 
 
 class UserResource(RestResource):
@@ -314,6 +348,9 @@ class HResource(RestResource):
     reject_unknown_fields = True
     reject_unknown_filters = True
 
+class PageResource(RestResource):
+    version_field = 'version'
+
 class AdminOnlyUserResource(UserResource):
     # user writes (even nested) require an admin -- exercises check_*
     # enforcement on nested writes.
@@ -361,6 +398,7 @@ api.register(FModel, FResource, auth=dummy_auth)
 api.register(GModel, GResource, auth=dummy_auth)
 api.register(HModel, HResource, auth=dummy_auth)
 api.register(Link, auth=dummy_auth)
+api.register(Page, PageResource, auth=dummy_auth)
 
 
 # views
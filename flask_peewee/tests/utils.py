@@ -4,8 +4,11 @@ import json
 from flask import request
 from werkzeug.exceptions import NotFound
 
+from flask_peewee.exceptions import ConcurrentUpdateError
 from flask_peewee.utils import check_password
 from flask_peewee.utils import deserialize_datetime
+from flask_peewee.utils import get_datetime_formats
+from flask_peewee.utils import get_deserialize_plan
 from flask_peewee.utils import get_hexdigest
 from flask_peewee.utils import get_model_from_dictionary
 from flask_peewee.utils import get_next
@@ -14,11 +17,13 @@ from flask_peewee.utils import is_legacy_password
 from flask_peewee.utils import is_safe_url
 from flask_peewee.utils import make_password
 from flask_peewee.utils import path_to_models
+from flask_peewee.utils import save_changed
 from flask_peewee.tests.base import FlaskPeeweeTestCase
 from flask_peewee.tests.test_app import Message
 from flask_peewee.tests.test_app import Note
 from flask_peewee.tests.test_app import User
 from flask_peewee.tests.test_app import app as flask_app
+from flask_peewee.tests.test_app import db
 from peewee import *
 
 
@@ -120,6 +125,52 @@ class UtilsTestCase(FlaskPeeweeTestCase):
             deserialize_datetime(field, '2026-01-02T03:04:05.789Z'),
             datetime.datetime(2026, 1, 2, 3, 4, 5, 789000, tzinfo=utc))
 
+    def test_datetime_formats(self):
+        # fromisoformat() (None) goes first for a field with peewee's default
+        # formats, and after a field's own formats otherwise.
+        formats = get_datetime_formats(Message.pub_date)
+        self.assertIsNone(formats[0])
+        self.assertEqual(formats[1:len(DateTimeField.formats) + 1],
+                         tuple(DateTimeField.formats))
+
+        field = DateField(formats=['%Y-%d-%m'])
+        self.assertEqual(get_datetime_formats(field)[:2], ('%Y-%d-%m', None))
+        self.assertEqual(deserialize_datetime(field, '2026-05-06'),
+                         datetime.datetime(2026, 6, 5))
+        self.assertEqual(deserialize_datetime(field, '2026-05-16'),
+                         datetime.datetime(2026, 5, 16))
+
+        # formats fromisoformat() rejects still parse.
+        self.assertEqual(deserialize_datetime(Message.pub_date, '2026-1-2'),
+                         datetime.datetime(2026, 1, 2))
+
+    def test_deserialize_plan(self):
+        plan = get_deserialize_plan(Message)
+        self.assertIs(get_deserialize_plan(Message), plan)
+        self.assertEqual(sorted(plan), ['content', 'id', 'pub_date', 'user'])
+
+        field, coerce, is_fk = plan['pub_date']
+        self.assertIs(field, Message.pub_date)
+        self.assertFalse(is_fk)
+        self.assertEqual(coerce('2026-01-02T03:04:05.5'),
+                         datetime.datetime(2026, 1, 2, 3, 4, 5, 500000))
+        self.assertTrue(plan['user'][2])
+        self.assertIs(get_deserialize_plan(User)['active'][1]('false'), False)
+
+        # adding or removing a field rebuilds the plan.
+        class Post(Model):
+            title = CharField()
+
+        plan = get_deserialize_plan(Post)
+        Post._meta.add_field('published', BooleanField(default=False))
+        plan = get_deserialize_plan(Post)
+        self.assertEqual(sorted(plan), ['id', 'published', 'title'])
+        self.assertIs(plan['published'][1]('false'), False)
+        self.assertEqual(get_model_from_dictionary(
+            Post, {'published': 'true'})[0].published, True)
+        Post._meta.remove_field('published')
+        self.assertEqual(sorted(get_deserialize_plan(Post)), ['id', 'title'])
+
     def test_is_safe_url(self):
         for good in ('/', '/admin/', '/a/b/?x=1', 'relative/path'):
             self.assertTrue(is_safe_url(good), good)
@@ -163,3 +214,48 @@ class UtilsTestCase(FlaskPeeweeTestCase):
         class A(Model):
             b = ForeignKeyField(B)
         self.assertEqual(path_to_models(A, 'b__c'), [B, C])
+
+    def test_save_changed_runs_save(self):
+        # fields set by an overridden save() are written too, and the
+        # versioned update goes through save() as well.
+        class Draft(db.Model):
+            title = CharField()
+            body = TextField(default='')
+            slug = CharField(default='')
+            version = IntegerField(default=1)
+
+            def save(self, *args, **kwargs):
+                # like many overrides, this one drops save()'s row count.
+                self.slug = self.title.lower()
+                super(Draft, self).save(*args, **kwargs)
+
+        db.database.create_tables([Draft])
+        try:
+            draft = Draft.create(title='A', body='b')
+            before = dict(draft.__data__)
+            draft.title = 'B'
+            with self.capture_queries() as queries:
+                self.assertTrue(save_changed(draft, before))
+            self.assertEqual(len(queries), 1)
+            self.assertIn('"slug"', queries[0])
+            self.assertNotIn('"body"', queries[0])
+            self.assertEqual(Draft.get_by_id(draft.id).slug, 'b')
+
+            before = dict(draft.__data__)
+            draft.title = 'C'
+            self.assertTrue(save_changed(draft, before, 'version'))
+            saved = Draft.get_by_id(draft.id)
+            self.assertEqual((saved.slug, saved.version), ('c', 2))
+            self.assertEqual(draft.version, 2)
+
+            # a stale version writes nothing and is left as it was.
+            stale = Draft.get_by_id(draft.id)
+            stale.version = 1
+            before = dict(stale.__data__)
+            stale.title = 'D'
+            self.assertRaises(ConcurrentUpdateError, save_changed, stale,
+                              before, 'version')
+            self.assertEqual(stale.version, 1)
+            self.assertEqual(Draft.get_by_id(draft.id).title, 'C')
+        finally:
+            db.database.drop_tables([Draft])
@@ -1,23 +1,40 @@
 import datetime
+import decimal
 import hmac
+import json
 import math
 import re
 import sys
+import threading
+import time
 from hashlib import sha1
+from urllib.parse import urlencode
 from urllib.parse import urlparse
 
 from flask import abort
 from flask import render_template
 from flask import request
+from flask_peewee.exceptions import ConcurrentUpdateError
 from peewee import BooleanField
+from peewee import DatabaseError
 from peewee import DateField
 from peewee import DateTimeField
+from peewee import DecimalField
 from peewee import DoesNotExist
+from peewee import FloatField
 from peewee import ForeignKeyField
+from peewee import IntegerField
 from peewee import JOIN
 from peewee import Model
+from peewee import MySQLDatabase
+from peewee import PostgresqlDatabase
+from peewee import Proxy
+from peewee import SQL
 from peewee import SelectQuery
+from peewee import SqliteDatabase
 from peewee import TimeField
+from peewee import Tuple
+from peewee import fn
 from werkzeug.security import check_password_hash
 from werkzeug.security import generate_password_hash
 
@@ -61,6 +78,12 @@ class PaginatedQuery(object):
             self._get_count = self.query.count()
         return self._get_count
 
+    def is_count_approximate(self):
+        return False
+
+    def get_count_display(self):
+        return str(self.get_count())
+
     def get_pages(self):
         if not hasattr(self, '_get_pages'):
             self._get_pages = int(math.ceil(
@@ -70,6 +93,9 @@ class PaginatedQuery(object):
     def get_list(self):
         return self.query.paginate(self.get_page(), self.paginate_by)
 
+    def has_next(self):
+        return self.get_page() < self.get_pages()
+
     def get_page_range(self, window=3):
         # a windowed list of page numbers around the current page, with None
         # marking gaps (rendered as an ellipsis), e.g. [1, None, 4, 5, 6, None, 20].
@@ -92,6 +118,427 @@ class PaginatedQuery(object):
         return result
 
 
+class CountedPaginatedQuery(PaginatedQuery):
+    """
+    A PaginatedQuery for large tables, whose count may be:
+
+    * capped: COUNT over at most `count_cap` + 1 rows, shown as "10,000+"
+    * estimated: `estimate()` returns a row count from table statistics (or
+      None to fall back to the capped/exact count), shown as "~1,200,000"
+    * cached: stored in `cache` (a TTLCache) under the compiled SQL of the
+      query, so paging through one filtered/searched result does not re-count
+    """
+    def __init__(self, query_or_model, paginate_by, count_cap=None,
+                 estimate=None, cache=None):
+        super(CountedPaginatedQuery, self).__init__(query_or_model, paginate_by)
+        self.count_cap = count_cap
+        self.estimate = estimate
+        self.cache = cache
+        self._approximate = None
+
+    def get_cache_key(self):
+        sql, params = self.query.sql()
+        return (sql, tuple(params))
+
+    def compute_count(self):
+        if self.estimate is not None:
+            estimate = self.estimate()
+            if estimate is not None:
+                return estimate, '~'
+        if self.count_cap:
+            # the limit is applied inside a subquery, so the database stops
+            # after count_cap + 1 matching rows.
+            count = self.query.order_by().limit(self.count_cap + 1).count()
+            if count > self.count_cap:
+                return self.count_cap, '+'
+            return count, None
+        return self.query.count(), None
+
+    def get_count(self):
+        if not hasattr(self, '_get_count'):
+            key = self.get_cache_key() if self.cache is not None else None
+            result = self.cache.get(key) if key is not None else None
+            if result is None:
+                result = self.compute_count()
+                if key is not None:
+                    self.cache.set(key, result)
+            self._get_count, self._approximate = result
+        return self._get_count
+
+    def is_count_approximate(self):
+        self.get_count()
+        return self._approximate is not None
+
+    def get_list(self):
+        # with an approximate count the page's rows are read with one more,
+        # which tells whether another page follows. an exact count tells
+        # that by itself.
+        if not self.is_count_approximate():
+            return super(CountedPaginatedQuery, self).get_list()
+        if not hasattr(self, '_get_list'):
+            offset = (max(self.get_page(), 1) - 1) * self.paginate_by
+            rows = list(self.query.offset(offset).limit(self.paginate_by + 1))
+            self._has_next = len(rows) > self.paginate_by
+            self._get_list = rows[:self.paginate_by]
+        return self._get_list
+
+    def has_next(self):
+        if not self.is_count_approximate():
+            return super(CountedPaginatedQuery, self).has_next()
+        self.get_list()
+        return self._has_next
+
+    def get_pages(self):
+        # an approximate count may fall short of the page being read, so the
+        # pages run at least through it, and the next one when rows follow.
+        pages = super(CountedPaginatedQuery, self).get_pages()
+        if not self.is_count_approximate():
+            return pages
+        return max(pages, self.get_page() + (1 if self.has_next() else 0))
+
+    def get_count_display(self):
+        count = self.get_count()
+        if self._approximate == '+':
+            return '{:,}+'.format(count)
+        elif self._approximate == '~':
+            return '~{:,}'.format(count)
+        return str(count)
+
+
+class KeysetPaginatedQuery(CountedPaginatedQuery):
+    """
+    Pages through a query by seeking past the last row shown rather than
+    with OFFSET, so a page deep into a large table costs the same as the
+    first. Rows are ordered by `field` (descending if `descending`), with
+    the primary key breaking ties, and a page is addressed by a cursor
+    holding that row's (value, pk):
+
+    * ``after=<cursor>`` the page following a row
+    * ``before=<cursor>`` the page preceding a row
+    * ``jump=<value>`` the page starting at the first row at or past a value
+
+    There are no page numbers. The count, if displayed, is that of the
+    parent class. The ordering column may not be nullable, since no
+    comparison seeks past a NULL; page such a column by offset instead.
+    """
+    after_var = 'after'
+    before_var = 'before'
+    jump_var = 'jump'
+
+    def __init__(self, query_or_model, paginate_by, field, descending=False,
+                 name=None, **kwargs):
+        if field.null:
+            raise ValueError('Cannot seek on nullable field: %s' % field.name)
+        super(KeysetPaginatedQuery, self).__init__(
+            query_or_model, paginate_by, **kwargs)
+        self.field = field
+        self.descending = descending
+        # identifies the ordering a cursor was issued for, so a cursor left
+        # in the url after re-sorting is ignored instead of misread.
+        self.name = name or field.name
+        self.pk = self.model._meta.primary_key
+        self._results = None
+
+    def coerce(self, value):
+        # convert a value from the url to the ordering column's type, raising
+        # ValueError for one the column cannot hold.
+        field = self.field
+        if isinstance(field, ForeignKeyField):
+            field = field.rel_field
+        if isinstance(field, (DateField, DateTimeField, TimeField)):
+            value = deserialize_datetime(field, value)
+            if isinstance(field, DateField) and value is not None:
+                value = value.date()
+            elif isinstance(field, TimeField) and value is not None:
+                value = value.time()
+        elif isinstance(field, IntegerField):
+            value = int(value)
+        elif isinstance(field, FloatField):
+            value = float(value)
+        elif isinstance(field, DecimalField):
+            try:
+                value = decimal.Decimal(value)
+            except decimal.InvalidOperation:
+                raise ValueError('Invalid decimal: %r' % value)
+        elif isinstance(field, BooleanField):
+            value = convert_boolean(value)
+        return value
+
+    def dump_cursor(self, obj):
+        from flask_peewee.serializer import Serializer
+        convert = Serializer().convert_value
+        # the raw column value, so a foreign key does not load its object.
+        return json.dumps([self.name,
+                           convert(obj.__data__.get(self.field.name)),
+                           convert(obj._pk)])
+
+    def load_cursor(self, cursor):
+        try:
+            name, value, pk = json.loads(cursor)
+            if name != self.name:
+                return None
+            return self.coerce(value), pk
+        except (TypeError, ValueError):
+            return None
+
+    def get_jump(self):
+        value = request.args.get(self.jump_var)
+        if value:
+            try:
+                return self.coerce(value)
+            except (TypeError, ValueError):
+                pass
+
+    def get_key(self):
+        if self.field is self.pk:
+            return Tuple(self.pk)
+        return Tuple(self.field, self.pk)
+
+    def get_key_values(self, cursor):
+        value, pk = cursor
+        if self.field is self.pk:
+            return Tuple(pk)
+        return Tuple(value, pk)
+
+    def get_ordering(self, reverse=False):
+        descending = self.descending != reverse
+        fields = [self.field] if self.field is self.pk else [self.field, self.pk]
+        return [f.desc() if descending else f.asc() for f in fields]
+
+    def seek(self, cursor, forward):
+        # rows strictly after (forward) or before the cursor, in page order.
+        key, values = self.get_key(), self.get_key_values(cursor)
+        if forward != self.descending:
+            return key > values
+        return key < values
+
+    def get_list(self):
+        if self._results is not None:
+            return self._results
+
+        after = self.load_cursor(request.args.get(self.after_var) or '')
+        before = self.load_cursor(request.args.get(self.before_var) or '')
+        jump = self.get_jump()
+
+        query = self.query.order_by(*self.get_ordering())
+        forward = before is None
+        if after is not None:
+            query = query.where(self.seek(after, True))
+        elif before is not None:
+            query = (self.query
+                     .where(self.seek(before, False))
+                     .order_by(*self.get_ordering(reverse=True)))
+        elif jump is not None:
+            if self.descending:
+                query = query.where(self.field <= jump)
+            else:
+                query = query.where(self.field >= jump)
+
+        # one extra row tells whether there is more in the direction of
+        # travel, the other direction is known from where we started.
+        results = list(query.limit(self.paginate_by + 1))
+        more = len(results) > self.paginate_by
+        results = results[:self.paginate_by]
+        if not forward:
+            results.reverse()
+
+        if forward:
+            self._has_next = more
+            self._has_prev = False
+            if results and (after is not None or jump is not None):
+                # probe for any row before this page.
+                first = self.get_cursor(results[0])
+                self._has_prev = (self.query
+                                  .where(self.seek(first, False))
+                                  .exists())
+        else:
+            self._has_next = True
+            self._has_prev = more
+        self._results = results
+        return results
+
+    def get_cursor(self, obj):
+        return obj.__data__.get(self.field.name), obj._pk
+
+    def has_next(self):
+        self.get_list()
+        return self._has_next
+
+    def has_prev(self):
+        self.get_list()
+        return self._has_prev
+
+    def get_url_args(self, key=None, value=None):
+        # the current query string, minus any position, plus the new one.
+        skip = (self.after_var, self.before_var, self.jump_var, self.page_var)
+        args = [(k, v) for k, v in request.args.items(multi=True)
+                if k not in skip]
+        if key is not None:
+            args.append((key, value))
+        return urlencode(args)
+
+    def get_next_args(self):
+        results = self.get_list()
+        if self.has_next() and results:
+            return self.get_url_args(self.after_var,
+                                     self.dump_cursor(results[-1]))
+
+    def get_prev_args(self):
+        results = self.get_list()
+        if self.has_prev() and results:
+            return self.get_url_args(self.before_var,
+                                     self.dump_cursor(results[0]))
+
+    def get_first_args(self):
+        return self.get_url_args()
+
+
+class TTLCache(object):
+    """
+    A small thread-safe in-memory cache whose entries expire `timeout` seconds
+    after they are set. Past `max_size` entries, expired ones are purged and,
+    if that is not enough, the oldest are dropped.
+    """
+    def __init__(self, timeout, max_size=1000):
+        self.timeout = timeout
+        self.max_size = max_size
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return default
+            expires, value = item
+            if expires < time.time():
+                del self._data[key]
+                return default
+            return value
+
+    def set(self, key, value):
+        now = time.time()
+        with self._lock:
+            if len(self._data) >= self.max_size:
+                for k, (expires, _) in list(self._data.items()):
+                    if expires < now:
+                        del self._data[k]
+                if len(self._data) >= self.max_size:
+                    oldest = sorted(self._data, key=lambda k: self._data[k][0])
+                    for k in oldest[:len(oldest) - self.max_size + 1]:
+                        del self._data[k]
+            self._data[key] = (now + self.timeout, value)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+def get_table_estimate(model):
+    """
+    The row count the database's statistics hold for `model`'s table, without
+    scanning it, or None when no statistics are available (sqlite before
+    ANALYZE, a postgres table never vacuumed or analyzed).
+    """
+    database = model._meta.database
+    if isinstance(database, Proxy):
+        database = database.obj
+    table = model._meta.table_name
+    try:
+        if isinstance(database, PostgresqlDatabase):
+            sql = 'SELECT reltuples FROM pg_class WHERE oid = %s::regclass'
+            if model._meta.schema:
+                table = '%s.%s' % (model._meta.schema, table)
+        elif isinstance(database, MySQLDatabase):
+            sql = ('SELECT table_rows FROM information_schema.tables WHERE '
+                   'table_schema = DATABASE() AND table_name = %s')
+        elif isinstance(database, SqliteDatabase):
+            sql = ('SELECT stat FROM sqlite_stat1 WHERE tbl = ? '
+                   'ORDER BY idx IS NOT NULL LIMIT 1')
+        else:
+            return None
+        # a savepoint, so a failed lookup cannot abort an enclosing transaction.
+        with database.atomic():
+            row = database.execute_sql(sql, (table,)).fetchone()
+    except DatabaseError:
+        return None
+    if not row or row[0] is None:
+        return None
+    # sqlite's stat is "<rows> <rows per key>...". postgres reports -1 for a
+    # table with no statistics yet.
+    estimate = int(float(str(row[0]).split()[0]))
+    return estimate if estimate >= 0 else None
+
+
+def get_table_size(model):
+    """
+    The bytes on disk used by `model`'s table and its indexes, or None when
+    the database cannot say (sqlite built without the dbstat table).
+    """
+    database = model._meta.database
+    if isinstance(database, Proxy):
+        database = database.obj
+    table = model._meta.table_name
+    params = (table,)
+    try:
+        if isinstance(database, PostgresqlDatabase):
+            sql = 'SELECT pg_total_relation_size(%s::regclass)'
+            if model._meta.schema:
+                params = ('%s.%s' % (model._meta.schema, table),)
+        elif isinstance(database, MySQLDatabase):
+            sql = ('SELECT data_length + index_length FROM '
+                   'information_schema.tables WHERE '
+                   'table_schema = DATABASE() AND table_name = %s')
+        elif isinstance(database, SqliteDatabase):
+            # the table's pages plus those of every index on it.
+            sql = ('SELECT SUM(pgsize) FROM dbstat WHERE name IN '
+                   '(SELECT name FROM sqlite_master WHERE tbl_name = ?)')
+        else:
+            return None
+        with database.atomic():
+            row = database.execute_sql(sql, params).fetchone()
+    except DatabaseError:
+        return None
+    if not row or row[0] is None:
+        return None
+    return int(row[0])
+
+
+def get_facet_counts(query, field, cache=None):
+    """
+    The number of rows of `query` for each value of `field`, counted with one
+    GROUP BY, as a list of (value, count). A field with choices lists them in
+    the order declared, including those no row has, and a boolean lists True
+    then False; any other values follow, sorted. Results are stored in
+    `cache` (a TTLCache), if given, under the compiled SQL of the count.
+    """
+    query = (query
+             .order_by()
+             .select(field, fn.COUNT(SQL('*')))
+             .group_by(field))
+    key = None
+    if cache is not None:
+        sql, params = query.sql()
+        key = (sql, tuple(params))
+        result = cache.get(key)
+        if result is not None:
+            return result
+
+    counts = dict(query.tuples())
+    if field.choices:
+        values = [choice[0] for choice in field.choices]
+    elif isinstance(field, BooleanField):
+        values = [True, False]
+    else:
+        values = []
+    values.extend(sorted((v for v in counts if v not in values),
+                         key=lambda v: (v is not None, v)))
+    result = [(value, counts.get(value, 0)) for value in values]
+    if key is not None:
+        cache.set(key, result)
+    return result
+
+
 def get_next():
     if not request.query_string:
         return request.path
@@ -140,6 +587,37 @@ def get_dictionary_from_model(model, fields=None, exclude=None, path=()):
             data[field_name] = field_data
     return data
 
+def get_coercer(field_obj):
+    # the function converting a value from a dictionary to the field's python
+    # value, with the type checks done once, here, rather than for every key.
+    python_value = field_obj.python_value
+    if isinstance(field_obj, BooleanField):
+        return lambda value: python_value(convert_boolean(value))
+    elif isinstance(field_obj, (DateTimeField, DateField, TimeField)):
+        formats = get_datetime_formats(field_obj)
+        return lambda value: python_value(
+            deserialize_datetime(field_obj, value, formats))
+    return python_value
+
+def get_deserialize_plan(model):
+    """
+    Map each field name of `model` to (field, coercer, is foreign key), built
+    once per model class, so deserializing a payload costs one dictionary
+    lookup and one call per key.
+    """
+    # kept on the model's metadata with the field list it was built from.
+    # peewee replaces sorted_fields whenever a field is added or removed, so
+    # the plan is rebuilt then.
+    meta = model._meta
+    sorted_fields, plan = getattr(meta, 'deserialize_plan', (None, None))
+    if sorted_fields is not meta.sorted_fields:
+        plan = dict(
+            (name, (field_obj, get_coercer(field_obj),
+                    isinstance(field_obj, ForeignKeyField)))
+            for name, field_obj in meta.fields.items())
+        meta.deserialize_plan = (meta.sorted_fields, plan)
+    return plan
+
 def get_model_from_dictionary(model, field_dict, strict=False):
     if isinstance(model, Model):
         model_instance = model
@@ -148,9 +626,10 @@ def get_model_from_dictionary(model, field_dict, strict=False):
         model_instance = model()
         check_fks = False
     models = [model_instance]
+    plan = get_deserialize_plan(type(model_instance))
     for field_name, value in field_dict.items():
         try:
-            field_obj = model._meta.fields[field_name]
+            field_obj, coerce, is_fk = plan[field_name]
         except KeyError:
             # non-field keys (the "user_id" column name, a user property) are
             # set on the instance. underscore names are peewee internals, and
@@ -164,7 +643,7 @@ def get_model_from_dictionary(model, field_dict, strict=False):
                     pass  # read-only property, no setter
             continue
 
-        if isinstance(value, dict) and isinstance(field_obj, ForeignKeyField):
+        if is_fk and isinstance(value, dict):
             rel_obj = field_obj.rel_model
             if check_fks:
                 try:
@@ -177,14 +656,150 @@ def get_model_from_dictionary(model, field_dict, strict=False):
             models.extend(rel_models)
             setattr(model_instance, field_name, rel_inst)
         else:
-            if isinstance(field_obj, BooleanField):
-                value = convert_boolean(value)
-            elif isinstance(field_obj, (DateTimeField, DateField, TimeField)):
-                value = deserialize_datetime(field_obj, value)
-
-            setattr(model_instance, field_name, field_obj.python_value(value))
+            setattr(model_instance, field_name, coerce(value))
     return model_instance, models
 
+def prefetch_related(instance, field_dict, get_query=None):
+    """
+    Load the existing rows the nested dictionaries in `field_dict` edit --
+    those `instance`'s foreign keys point to, and theirs in turn -- with one
+    query per related model at each level of nesting, and set each on the
+    instance referencing it, so get_model_from_dictionary finds it in place
+    of a lazy load per foreign key. Returns the rows by their path of field
+    names, None where a foreign key is unset or its row is not in the query.
+
+    `get_query(path, model)` returns the query a path's rows are read from,
+    model.select() by default, or None to leave that path alone. Foreign keys
+    pointing at the same row are each given an instance of their own.
+    """
+    if get_query is None:
+        get_query = lambda path, model: model.select()
+    related = {}
+    level = [((), instance, field_dict)]
+    while level:
+        wanted = {}
+        for path, obj, data in level:
+            plan = get_deserialize_plan(type(obj))
+            for name, value in data.items():
+                if name not in plan or not plan[name][2] or \
+                        not isinstance(value, dict):
+                    continue
+                field_obj = plan[name][0]
+                query = get_query(path + (name,), field_obj.rel_model)
+                if query is None:
+                    continue
+                rel_id = obj.__data__.get(name)
+                if rel_id is None:
+                    related[path + (name,)] = None
+                    continue
+                # paths reading from the same query share one.
+                sql, params = query.sql()
+                key = (field_obj.rel_field, sql, tuple(params))
+                wanted.setdefault(key, (query, {}))[1].setdefault(
+                    rel_id, []).append((path + (name,), obj, value))
+
+        level = []
+        for (rel_field, sql, params), (query, by_id) in wanted.items():
+            rel_name = rel_field.name
+            rows = dict((getattr(row, rel_name), row) for row in
+                        query.where(rel_field.in_(list(by_id))))
+            for rel_id, references in by_id.items():
+                row = rows.get(rel_id)
+                for i, (path, obj, data) in enumerate(references):
+                    if row is not None and i:
+                        row = type(row)(__no_default__=1, **row.__data__)
+                        row._dirty.clear()
+                    related[path] = row
+                    if row is not None:
+                        setattr(obj, path[-1], row)
+                        level.append((path, row, data))
+    return related
+
+def changed_fields(instance, before):
+    """
+    The fields of `instance` whose value differs from `before`, a copy of its
+    __data__ taken before it was modified. peewee marks a field dirty on any
+    assignment, so dirty_fields alone also lists values set to what they were.
+    """
+    return [field for field in instance.dirty_fields
+            if instance.__data__.get(field.name) != before.get(field.name)]
+
+def bulk_update_changed(model, changes):
+    """
+    Write `changes`, (instance, fields) pairs as returned by changed_fields,
+    with one bulk_update per distinct set of changed fields. Returns the
+    number of instances written.
+    """
+    groups = {}
+    for instance, fields in changes:
+        if fields:
+            key = tuple(field.name for field in fields)
+            groups.setdefault(key, (fields, []))[1].append(instance)
+    for fields, instances in groups.values():
+        model.bulk_update(instances, fields=fields)
+    return sum(len(instances) for fields, instances in groups.values())
+
+class ChangedFields(object):
+    """
+    The `only` save_changed passes to Model.save(). It is read when the
+    model's own save() runs, after any override of it has set fields of its
+    own, so those are written along with the ones the caller changed.
+    """
+    def __init__(self, instance, before):
+        self.instance = instance
+        self.before = before
+
+    def __iter__(self):
+        return iter(changed_fields(self.instance, self.before))
+
+def save_changed(instance, before=None, version_field=None):
+    """
+    UPDATE only the fields of `instance` that differ from `before` (see
+    changed_fields), and nothing at all when none do. Returns whether a write
+    was made. Without `before`, every field is saved. A model overriding
+    save() has the write go through it, and fields the override sets are
+    written too.
+
+    With a `version_field`, the integer column used for optimistic
+    concurrency, the update only applies while the row still holds the
+    version the instance carries, and increments it. ConcurrentUpdateError is
+    raised when it no longer does.
+    """
+    if before is None:
+        instance.save()
+        return True
+
+    model = type(instance)
+    version = model._meta.fields[version_field] if version_field else None
+    if not [f for f in changed_fields(instance, before) if f is not version]:
+        return False
+    if version is None:
+        instance.save(only=ChangedFields(instance, before))
+        return True
+
+    expected = instance.__data__.get(version.name)
+    guard = (model._meta.primary_key == instance._pk) & (version == expected)
+    overridden = model.save is not Model.save
+    with model._meta.database.atomic():
+        if overridden:
+            # the version is claimed first, and save() then writes the
+            # changed fields along with whatever the override sets.
+            data = {version: (expected or 0) + 1}
+        else:
+            setattr(instance, version.name, (expected or 0) + 1)
+            data = dict((f, instance.__data__.get(f.name))
+                        for f in changed_fields(instance, before))
+        if not model.update(data).where(guard).execute():
+            setattr(instance, version.name, expected)
+            raise ConcurrentUpdateError('%s %s was changed by someone else.' % (
+                model.__name__, instance._pk))
+        if overridden:
+            setattr(instance, version.name, data[version])
+            instance.save(only=ChangedFields(instance, before))
+        else:
+            instance._dirty -= set(f.name for f in data)
+    return True
+
 ISO_FORMATS = ('%Y-%m-%dT%H:%M:%S.%f%z',
                '%Y-%m-%dT%H:%M:%S%z',
                '%Y-%m-%dT%H:%M:%S.%f',
@@ -192,20 +807,37 @@ ISO_FORMATS = ('%Y-%m-%dT%H:%M:%S.%f%z',
                '%Y-%m-%dT',
                '%Y-%m-%d')
 
-def deserialize_datetime(field_obj, value):
+def get_datetime_formats(field_obj):
+    """
+    The formats deserialize_datetime tries for `field_obj`, in order: the
+    field's own, then the ISO-8601 variants the serializer emits. None stands
+    for datetime.fromisoformat(), which parses ISO-8601 without trying each
+    format in turn. It goes first unless the field was given formats of its
+    own, which take precedence.
+    """
+    own = list(getattr(field_obj, 'formats', None) or ())
+    iso = [f for f in ISO_FORMATS if f not in own]
+    if own == list(getattr(type(field_obj), 'formats', None) or ()):
+        return tuple([None] + own + iso)
+    return tuple(own + [None] + iso)
+
+def deserialize_datetime(field_obj, value, formats=None):
     # String values arriving over the wire are parsed against the field's own
     # formats plus the ISO-8601 variants the serializer emits.  An unparseable
     # string raises ValueError (a 400 in the REST api) rather than passing
     # garbage through to the database, which sqlite would happily store.
+    # `formats` is get_datetime_formats(field_obj), when the caller has it.
     if not isinstance(value, str):
         return value
     if not value:
         # empty string (e.g. a blank form input) means "no value".
         return None
-    formats = list(getattr(field_obj, 'formats', None) or ())
-    formats.extend(f for f in ISO_FORMATS if f not in formats)
+    if formats is None:
+        formats = get_datetime_formats(field_obj)
     for fmt in formats:
         try:
+            if fmt is None:
+                return datetime.datetime.fromisoformat(value)
             return datetime.datetime.strptime(value, fmt)
         except ValueError:
             continue